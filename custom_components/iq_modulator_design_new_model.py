@@ -12,12 +12,24 @@ from ipkiss3.pcell.model import CompactModel
 from ipkiss3.pcell.photonics.term import OpticalTerm
 from ipkiss3.pcell.wiring import ElectricalTerm
 import numpy as np
-from scipy.constants import speed_of_light
+from lnoi_iq_modulator.derived_parameters import (DERIVED_PUSH_PULL_PARAMETERS, DERIVED_SMATRIX_PARAMETERS,
+                                                  build_compact_model, push_pull_derive, push_pull_smatrix,
+                                                  push_pull_transmissions)
 
 from asp_sin_lnoi_photonics.components.modulator.mzm.pcell.connector import bend_connector
 
 __all__ = ["IQModulator"]
 
+# Waveguide driven by the states voltage_1 to voltage_4 of CustomPushPullModulatorModel:
+# (waveguide setting the phase and the delay, waveguide setting the loss, sign of the phase shift)
+PUSH_PULL_ARMS = (
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+)
+
+
 class CustomPushPullModulatorModel(CompactModel):
     """
     Model for a push-pull modulator with two optical waveguides in the electrode gaps.
@@ -44,6 +56,10 @@ class CustomPushPullModulatorModel(CompactModel):
         The DC voltage applied to the electrode (only used for s-matrix calculation)
     bandwidth:
         The bandwidth of the phase modulator in Hz
+    amplitude_k, delay_k, phase_lambda_k, phase_v_k, phase_0_k, inv_tau:
+        Coefficients derived from the parameters above by push_pull_derive (k = 1 to 4)
+    smatrix_amplitude, smatrix_phase_lambda, smatrix_phase_v, smatrix_phase_0:
+        The same coefficients as arrays over the arms of calculate_smatrix, see push_pull_transmissions
     """
 
     parameters = [
@@ -58,7 +74,7 @@ class CustomPushPullModulatorModel(CompactModel):
         'voltage_top',
         'voltage_bottom',
         'bandwidth'
-    ]
+    ] + DERIVED_PUSH_PULL_PARAMETERS + DERIVED_SMATRIX_PARAMETERS
 
     terms = [
         OpticalTerm(name='top_in'),
@@ -84,82 +100,49 @@ class CustomPushPullModulatorModel(CompactModel):
     ]
 
     def calculate_smatrix(parameters, env, S):
-        # First order approximation of neff based on group index and effective index at the given center wavelength
-        dneff = -(parameters.n_g - parameters.n_eff) / parameters.center_wavelength
-        neff_total = parameters.n_eff + (env.wavelength - parameters.center_wavelength) * dneff
-
-        switching_voltage = parameters.vpi_l / parameters.electrode_length * 1e4
-        dn_dv = parameters.center_wavelength / (2.0 * parameters.electrode_length * switching_voltage)
-
-        phase = 2.0 * np.pi / env.wavelength * (
-                    neff_total * parameters.top_wg_length + dn_dv * parameters.voltage_top * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        S['top_in', 'top_out'] = S['top_out', 'top_in'] = np.exp(1j * phase) * loss
-
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.bottom_wg_length - dn_dv * parameters.voltage_top * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        S['bottom_in', 'bottom_out'] = S['bottom_out', 'bottom_in'] = np.exp(1j * phase) * loss
-
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.top_wg_length + dn_dv * parameters.voltage_bottom * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        S['top_in_2', 'top_out_2'] = S['top_out_2', 'top_in_2'] = np.exp(1j * phase) * loss
-
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.bottom_wg_length - dn_dv * parameters.voltage_bottom * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        S['bottom_in_2', 'bottom_out_2'] = S['bottom_out_2', 'bottom_in_2'] = np.exp(1j * phase) * loss
+        # All four arms in one broadcast expression, with the coefficients derived once by push_pull_derive
+        voltages = np.array([parameters.voltage_top, parameters.voltage_top,
+                             parameters.voltage_bottom, parameters.voltage_bottom])
+        a = push_pull_transmissions(parameters.smatrix_amplitude, parameters.smatrix_phase_lambda,
+                                    parameters.smatrix_phase_v, parameters.smatrix_phase_0, env.wavelength, voltages)
+        S['top_in', 'top_out'] = S['top_out', 'top_in'] = a[0]
+        S['bottom_in', 'bottom_out'] = S['bottom_out', 'bottom_in'] = a[1]
+        S['top_in_2', 'top_out_2'] = S['top_out_2', 'top_in_2'] = a[2]
+        S['bottom_in_2', 'bottom_out_2'] = S['bottom_out_2', 'bottom_in_2'] = a[3]
 
     def calculate_signals(parameters, env, output_signals, y, t, input_signals):
-        dneff = -(parameters.n_g - parameters.n_eff) / parameters.center_wavelength
-        neff = parameters.n_eff + (env.wavelength - parameters.center_wavelength) * dneff
-
-        # First-order approximation of the delay
-        switching_voltage = parameters.vpi_l / parameters.electrode_length * 1e4
-        dn_dv = parameters.center_wavelength / (2.0 * parameters.electrode_length * switching_voltage)
+        # The invariant coefficients are derived once by push_pull_derive, see PUSH_PULL_ARMS
+        inv_wavelength = 1.0 / env.wavelength
 
         # Top Arm
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.top_wg_length + dn_dv * y['voltage_1'] * parameters.electrode_length)
-        delay = parameters.top_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['top_out'] = a * input_signals['top_in', t - delay]
-        output_signals['top_in'] = a * input_signals['top_out', t - delay]
-
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.bottom_wg_length - dn_dv * y['voltage_2'] * parameters.electrode_length)
-        delay = parameters.bottom_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['bottom_out'] = a * input_signals['bottom_in', t - delay]
-        output_signals['bottom_in'] = a * input_signals['bottom_out', t - delay]
+        a = parameters.amplitude_1 * np.exp(1j * (
+            (parameters.phase_lambda_1 + parameters.phase_v_1 * y['voltage_1']) * inv_wavelength + parameters.phase_0_1))
+        output_signals['top_out'] = a * input_signals['top_in', t - parameters.delay_1]
+        output_signals['top_in'] = a * input_signals['top_out', t - parameters.delay_1]
+
+        a = parameters.amplitude_2 * np.exp(1j * (
+            (parameters.phase_lambda_2 + parameters.phase_v_2 * y['voltage_2']) * inv_wavelength + parameters.phase_0_2))
+        output_signals['bottom_out'] = a * input_signals['bottom_in', t - parameters.delay_2]
+        output_signals['bottom_in'] = a * input_signals['bottom_out', t - parameters.delay_2]
 
 
         # Bottom Arm
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.top_wg_length + dn_dv * y['voltage_3'] * parameters.electrode_length)
-        delay = parameters.top_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['top_out_2'] = a * input_signals['top_in_2', t - delay]
-        output_signals['top_in_2'] = a * input_signals['top_out_2', t - delay]
-
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (neff * parameters.bottom_wg_length - dn_dv * y['voltage_4'] * parameters.electrode_length)
-        delay = parameters.bottom_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['bottom_out_2'] = a * input_signals['bottom_in_2', t - delay]
-        output_signals['bottom_in_2'] = a * input_signals['bottom_out_2', t - delay]
+        a = parameters.amplitude_3 * np.exp(1j * (
+            (parameters.phase_lambda_3 + parameters.phase_v_3 * y['voltage_3']) * inv_wavelength + parameters.phase_0_3))
+        output_signals['top_out_2'] = a * input_signals['top_in_2', t - parameters.delay_3]
+        output_signals['top_in_2'] = a * input_signals['top_out_2', t - parameters.delay_3]
 
+        a = parameters.amplitude_4 * np.exp(1j * (
+            (parameters.phase_lambda_4 + parameters.phase_v_4 * y['voltage_4']) * inv_wavelength + parameters.phase_0_4))
+        output_signals['bottom_out_2'] = a * input_signals['bottom_in_2', t - parameters.delay_4]
+        output_signals['bottom_in_2'] = a * input_signals['bottom_out_2', t - parameters.delay_4]
 
     def calculate_dydt(parameters, env, dydt, y, t, input_signals):
-        tau = 1.0 / (2.0 * np.pi * parameters.bandwidth)
-        dydt['voltage_1'] = ((input_signals['top_signal'] - input_signals['top_ground']) - y['voltage_1']) / tau
-        dydt['voltage_2'] = ((input_signals['top_signal'] - input_signals['middle_ground']) - y['voltage_2']) / tau
-        dydt['voltage_3'] = ((input_signals['bottom_signal'] - input_signals['middle_ground']) - y['voltage_3']) / tau
-        dydt['voltage_4'] = ((input_signals['bottom_signal'] - input_signals['bottom_ground']) - y['voltage_4']) / tau
+        inv_tau = parameters.inv_tau
+        dydt['voltage_1'] = ((input_signals['top_signal'] - input_signals['top_ground']) - y['voltage_1']) * inv_tau
+        dydt['voltage_2'] = ((input_signals['top_signal'] - input_signals['middle_ground']) - y['voltage_2']) * inv_tau
+        dydt['voltage_3'] = ((input_signals['bottom_signal'] - input_signals['middle_ground']) - y['voltage_3']) * inv_tau
+        dydt['voltage_4'] = ((input_signals['bottom_signal'] - input_signals['bottom_ground']) - y['voltage_4']) * inv_tau
 
 
 class CPWElectrode(i3.PCell):
@@ -506,12 +489,12 @@ class CPWElectrodeWithWaveguides(i3.PCell):
         voltage_bottom = i3.NumberProperty(default=0, doc='voltage applied to the bottom electrode in V')
         bandwidth = i3.PositiveNumberProperty(default=40e9, doc="electrial bandwidth of the modulator in Hz")
 
-        def _generate_model(self):
+        def _model_parameters(self):
             wg_tmpl_cm = self.cell.trace_template.get_default_view(i3.CircuitModelView)
             lv = self.cell.get_default_view(i3.LayoutView)
             top_wg_length = lv.instances['top_wg'].reference.trace_length()
             bottom_wg_length = lv.instances['bottom_wg'].reference.trace_length()
-            return CustomPushPullModulatorModel(
+            return dict(
                 n_g=wg_tmpl_cm.n_g,
                 n_eff=wg_tmpl_cm.n_eff,
                 center_wavelength=wg_tmpl_cm.center_wavelength,
@@ -525,6 +508,19 @@ class CPWElectrodeWithWaveguides(i3.PCell):
                 bandwidth=self.bandwidth
             )
 
+        def _generate_model(self):
+            return build_compact_model(CustomPushPullModulatorModel, push_pull_derive(PUSH_PULL_ARMS),
+                                       **self._model_parameters())
+
+        def get_smatrix_sweep(self, wavelengths, voltage_top=None, voltage_bottom=None):
+            """S-matrix for arrays of wavelengths and DC voltages, see push_pull_smatrix.
+
+            Unlike get_smatrix, this is evaluated with numpy broadcasting in one pass, e.g. for a wavelength-bias map:
+
+                S = cm.get_smatrix_sweep(wavelengths[:, None], voltage_top=voltages[None, :])
+            """
+            return push_pull_smatrix(self._model_parameters(), wavelengths, voltage_top, voltage_bottom)
+
 
 class IQModulator(i3.PCell):
     """
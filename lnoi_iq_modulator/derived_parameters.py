@@ -0,0 +1,183 @@
+"""
+One-time derivation of the invariant coefficients of a CompactModel.
+
+calculate_signals and calculate_dydt are evaluated on every solver step, but most of what they compute only depends
+on the parameters of the model: effective index dispersion, switching voltage, losses, delays and time constants.
+A derive hook computes those coefficients once, when the CircuitModelView generates its model, and
+build_compact_model passes them to the CompactModel next to its regular parameters. The kernels then only evaluate
+what depends on the states and the wavelength.
+
+For the push-pull modulator models, the phase of the waveguide driven by the state voltage_k is
+
+    phase_k = (phase_lambda_k + phase_v_k * voltage_k) / wavelength + phase_0_k
+
+which is the first-order effective index model of calculate_smatrix rearranged, and its field is multiplied by
+amplitude_k and delayed by delay_k. The same coefficients, as arrays over the four arms (smatrix_amplitude,
+smatrix_phase_lambda, ...), fill the S-matrix of all the arms in one broadcast expression, push_pull_transmissions.
+calculate_smatrix evaluates it for the wavelength of the solver, and push_pull_smatrix for whole arrays of wavelengths
+and voltages at once.
+
+This is the only copy of the module: the lnoi designs import it as derived_parameters (run from lnoi_iq_modulator),
+the custom_components designs as lnoi_iq_modulator.derived_parameters (run from the root of the repository).
+"""
+
+import numpy as np
+from numba import njit
+from scipy.constants import speed_of_light
+
+N_PUSH_PULL_ARMS = 4
+
+# Coefficients of push_pull_derive, added to the parameters of the push-pull modulator models
+DERIVED_PUSH_PULL_PARAMETERS = [
+    "{}_{}".format(name, k)
+    for k in range(1, N_PUSH_PULL_ARMS + 1)
+    for name in ("amplitude", "delay", "phase_lambda", "phase_v", "phase_0")
+] + ["inv_tau"]
+# Coefficients of the four arms of calculate_smatrix as arrays, see push_pull_transmissions
+DERIVED_SMATRIX_PARAMETERS = ["smatrix_amplitude", "smatrix_phase_lambda", "smatrix_phase_v", "smatrix_phase_0"]
+
+# Arms of calculate_smatrix, the same in every design variant: the top and bottom waveguide of the gap of the
+# voltage_top electrode, then of the voltage_bottom electrode
+SMATRIX_PUSH_PULL_ARMS = (
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+)
+# Optical (in, out) ports of the arms
+PUSH_PULL_PORTS = (
+    ("top_in", "top_out"),
+    ("bottom_in", "bottom_out"),
+    ("top_in_2", "top_out_2"),
+    ("bottom_in_2", "bottom_out_2"),
+)
+
+
+def build_compact_model(model_class, derive, **parameters):
+    """Instantiate a CompactModel with the coefficients derived from its parameters.
+
+    Parameters
+    ----------
+    model_class : type
+        CompactModel class, whose parameters list includes the names returned by derive.
+    derive : callable
+        Derive hook, called once as derive(**parameters), returning a dictionary of derived coefficients.
+    parameters :
+        Regular parameters of the model.
+
+    Returns
+    -------
+    The CompactModel.
+
+    """
+    derived = derive(**parameters)
+    return model_class(**dict(parameters, **derived))
+
+
+def push_pull_derive(arms):
+    """Derive hook of a push-pull modulator model.
+
+    Parameters
+    ----------
+    arms : sequence of tuples
+        For the state voltage_1 to voltage_4, the waveguide it drives as (phase_length, loss_length, sign):
+        phase_length ("top" or "bottom") sets the phase and the delay, loss_length the loss, and sign (+1 or -1) the
+        direction of the electro-optic phase shift.
+
+    Returns
+    -------
+    Function of the model parameters returning the coefficients of DERIVED_PUSH_PULL_PARAMETERS.
+
+    """
+    if len(arms) != N_PUSH_PULL_ARMS:
+        raise ValueError("Expected {} arms, got {}".format(N_PUSH_PULL_ARMS, len(arms)))
+
+    def derive(n_g, n_eff, center_wavelength, loss_dB_m, top_wg_length, bottom_wg_length, electrode_length, vpi_l,
+               bandwidth, **_):
+        lengths = {"top": top_wg_length, "bottom": bottom_wg_length}
+        # First order approximation of neff based on group index and effective index at the given center wavelength
+        dneff = -(n_g - n_eff) / center_wavelength
+        switching_voltage = vpi_l / electrode_length * 1e4
+        dn_dv = center_wavelength / (2.0 * electrode_length * switching_voltage)
+
+        def coefficients(phase_length, loss_length, sign):
+            length = lengths[phase_length]
+            return {
+                "amplitude": 10 ** (-loss_dB_m * lengths[loss_length] * 1e-6 / 20.0),
+                "delay": length * 1e-6 / (speed_of_light / n_g),  # Convert length from um to m
+                "phase_lambda": 2 * np.pi * (n_eff - center_wavelength * dneff) * length,
+                "phase_v": sign * 2 * np.pi * dn_dv * electrode_length,
+                "phase_0": 2 * np.pi * dneff * length,
+            }
+
+        derived = {"inv_tau": 2.0 * np.pi * bandwidth}
+        for k, arm in enumerate(arms, start=1):
+            derived.update(("{}_{}".format(name, k), value) for name, value in coefficients(*arm).items())
+        smatrix_arms = [coefficients(*arm) for arm in SMATRIX_PUSH_PULL_ARMS]
+        for name in DERIVED_SMATRIX_PARAMETERS:
+            derived[name] = np.array([arm[name[len("smatrix_"):]] for arm in smatrix_arms])
+        return derived
+
+    return derive
+
+
+@njit()
+def push_pull_transmissions(amplitude, phase_lambda, phase_v, phase_0, wavelength, voltages):
+    """Transmission of the four arms of a push-pull modulator, in one broadcast expression.
+
+    This is the kernel of calculate_smatrix, compiled so the CompactModel can call it for the wavelength of the
+    solver. Its plain numpy version, push_pull_transmissions.py_func, broadcasts over arrays of any rank.
+
+    Parameters
+    ----------
+    amplitude, phase_lambda, phase_v, phase_0 : np.ndarray
+        Coefficients of the arms (the smatrix_* coefficients of push_pull_derive), along the first axis.
+    wavelength : float or np.ndarray
+        Wavelength [um].
+    voltages : np.ndarray
+        Voltage over every arm [V], along the first axis.
+
+    Returns
+    -------
+    Complex array of the broadcast shape of the arguments, with the arms along the first axis.
+
+    """
+    return amplitude * np.exp(1j * ((phase_lambda + phase_v * voltages) / wavelength + phase_0))
+
+
+def push_pull_smatrix(parameters, wavelengths, voltage_top=None, voltage_bottom=None):
+    """S-matrix of a push-pull modulator for arrays of wavelengths and DC voltages.
+
+    This is calculate_smatrix of CustomPushPullModulatorModel with broadcasting: the coefficients are derived once
+    and push_pull_transmissions fills every arm for all points in one vectorized expression, so dense sweeps of the
+    free spectral range or the bias point don't go through the circuit simulator once per wavelength.
+
+    Parameters
+    ----------
+    parameters : dict
+        Parameters of the model, as passed to build_compact_model.
+    wavelengths : float or array-like
+        Wavelengths [um].
+    voltage_top, voltage_bottom : float or array-like
+        DC voltages of the electrodes [V], broadcast against wavelengths. Default to the voltages in parameters.
+
+    Returns
+    -------
+    Dictionary of the non-zero S-matrix terms, S[port_1, port_2], as arrays of the broadcast shape.
+
+    """
+    voltage_top = parameters["voltage_top"] if voltage_top is None else voltage_top
+    voltage_bottom = parameters["voltage_bottom"] if voltage_bottom is None else voltage_bottom
+    derived = push_pull_derive(SMATRIX_PUSH_PULL_ARMS)(**parameters)
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    voltage_top, voltage_bottom = np.broadcast_arrays(voltage_top, voltage_bottom)
+    voltages = np.stack([voltage_top, voltage_top, voltage_bottom, voltage_bottom])
+    # Arms along the first axis, in front of the axes of the wavelengths and voltages
+    shape = (N_PUSH_PULL_ARMS,) + (1,) * max(wavelengths.ndim, voltage_top.ndim)
+    voltages = voltages.reshape((N_PUSH_PULL_ARMS,) + (1,) * (len(shape) - voltages.ndim) + voltage_top.shape)
+    transmissions = push_pull_transmissions.py_func(
+        *(derived[name].reshape(shape) for name in DERIVED_SMATRIX_PARAMETERS), wavelengths, voltages)
+    smatrix = {}
+    for (port_in, port_out), transmission in zip(PUSH_PULL_PORTS, transmissions):
+        smatrix[port_in, port_out] = smatrix[port_out, port_in] = transmission
+    return smatrix
@@ -12,6 +12,11 @@ import asp_sin_lnoi_photonics.all as asp
 import ipkiss3.all as i3
 from iq_modulator_design import IQModulator
 from simulation.simulate_iq_mod_QAM import simulate_modulation_QAM, result_modified_QAM
+from simulation.calibration import calibrate_heaters
+from simulation.benches.mapping import random_symbols
+from simulation.benches.noise import NoiseBank
+from simulation.metrics import link_metrics
+from simulation.sampling import sample_symbols
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -71,10 +76,17 @@ print("PS Vpi = %f" % ps_vpi)
 
 cm.bandwidth = 50e9    # Modulator bandwidth (in Hz)
 
+# Phase shifter biases: both MZMs at null and 90 degrees between I and Q at the operating wavelength
+heater_biases = calibrate_heaters(iq_mod, center_wavelength=1.55195, ps_vpi=ps_vpi)
+print(heater_biases)
+
 num_symbols = 2**12
 samples_per_symbol = 2**10
 bit_rate = 150e9
 
+# Gray-coded 16-QAM symbols, kept as the reference of the BER/EVM metrics below
+symbols = random_symbols(num_symbols, "qam", 16, rng=NoiseBank(1).generator("bits"))
+
 results = simulate_modulation_QAM(
     cell=iq_mod,
     mod_amplitude_i=rf_vpi/2,
@@ -83,20 +95,20 @@ results = simulate_modulation_QAM(
     mod_noise_q=rf_vpi/20,
     opt_amplitude=2.0,
     opt_noise=0.2,
-    v_heater_i=0,
-    # v_heater_q=ps_vpi/2, # for no-delay
-    v_heater_q=1.5542521994134897, # for with-delay
-    # v_mzm_left1=ps_vpi, # for no-delay
-    v_mzm_left1=0, # for with-delay
-    v_mzm_left2=0,
-    v_mzm_right1=0,
-    v_mzm_right2=ps_vpi,
+    # v_heater_i=0,
+    # v_heater_q=1.5542521994134897, # for with-delay (from a ps sweep)
+    # v_mzm_left1=0,
+    # v_mzm_left2=0,
+    # v_mzm_right1=0,
+    # v_mzm_right2=ps_vpi,
+    **heater_biases.voltages,
     bit_rate=50e9,
     n_bytes=num_symbols,
     steps_per_bit=samples_per_symbol,
     # center_wavelength=1.55, # for no-delay
     center_wavelength=1.55195, # for with-delay
     qam_level=16,
+    symbols=symbols,
 )
 
 outputs = ["sig_i", "sig_q", "src_in", "out", "out"]
@@ -135,7 +147,8 @@ eye.visualize(show=False)
 ########################################################################################################################
 
 plt.figure(4)
-res = result_modified_QAM(results, samples_per_symbol=samples_per_symbol, sampling_point=0.9)
+# The sampling point is searched for on the output (it was tuned by hand to 0.9), see timing.optimal_sampling_point
+res = result_modified_QAM(results, samples_per_symbol=samples_per_symbol, sampling_point=None)
 plt.scatter(np.real(res), np.imag(res), marker="+", linewidths=10, alpha=0.1)
 plt.grid()
 plt.xlabel("real", fontsize=14)
@@ -143,4 +156,13 @@ plt.ylabel("imag", fontsize=14)
 plt.title("Constellation diagram", fontsize=14)
 # plt.xlim([-1.0, 1.0])
 # plt.ylim([-1.0, 1.0])
+
+########################################################################################################################
+# Figures of merit
+########################################################################################################################
+
+metrics = link_metrics(sample_symbols(results["out"], samples_per_symbol, sampling_point=None), symbols)
+print("BER: {:.2e}, SER: {:.2e}".format(metrics.ber, metrics.ser))
+print("EVM: {:.1f} % rms, {:.1f} % peak".format(100 * metrics.evm_rms, 100 * metrics.evm_peak))
+print("MER: {:.1f} dB, SNR: {:.1f} dB, Q: {:.2f}".format(metrics.mer_db, metrics.snr_db, metrics.q_factor))
 plt.show()
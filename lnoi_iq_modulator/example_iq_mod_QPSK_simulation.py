@@ -12,6 +12,7 @@ import asp_sin_lnoi_photonics.all as asp
 import ipkiss3.all as i3
 from iq_modulator_design import IQModulator
 from simulation.simulate_iq_mod_QPSK import simulate_modulation_QPSK, result_modified_QPSK
+from simulation.bias_point import find_bias_point
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -35,15 +36,13 @@ lv = iq_mod.Layout(electrode_length=electrode_length, hot_width=50, electrode_ga
 
 cm = iq_mod.CircuitModel()
 
-wavelengths = np.linspace(1.55, 1.555, 101)
-S = cm.get_smatrix(wavelengths=wavelengths)
-
-idx_min = np.argmin(np.abs(np.abs(S['out', 'in'])**2))
-idx_max = np.argmax(np.abs(np.abs(S['out', 'in'])**2))
-wl = wavelengths[int((idx_min + idx_max) / 2)]
+bias_point = find_bias_point(iq_mod, center_wavelength=1.5525)
+wl = bias_point.quadrature
 print("Quadrature wavelength: {}".format(wl))
 
 # plt.figure()
+# wavelengths = np.linspace(1.55, 1.555, 101)
+# S = cm.get_smatrix(wavelengths=wavelengths)
 # plt.plot(wavelengths * 1e3, np.abs(S['out', 'in'])**2)
 # plt.plot([wl*1e3, wl*1e3], [0, 1])
 # plt.plot(wavelengths * 1e3, [np.abs(S['out', 'in'][int((idx_min + idx_max) / 2)])**2 for x in wavelengths])
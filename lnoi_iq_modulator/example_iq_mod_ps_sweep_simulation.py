@@ -148,6 +148,33 @@ print("min power from voltage: {}".format(min_wavelength_v))
 quad_voltage = (max_wavelength_v + min_wavelength_v) / 2
 print("Quadrature wavelength at voltage: {}".format(quad_voltage))
 
+########################################################################################################################
+# Same sweep from static S-matrices, over voltage x wavelength
+########################################################################################################################
+
+sweep_map = simulate_modulation_ps_sweep(
+    cell=iq_mod,
+    mod_amplitude_i=rf_vpi/2,
+    opt_amplitude=2.0,
+    v_heater_i=0,
+    v_mzm_left1=0,
+    v_mzm_left2=0,
+    v_mzm_right1=0,
+    v_mzm_right2=ps_vpi/2,
+    n_bytes=num_symbols,
+    mode="static",
+    wavelengths=np.linspace(1.549, 1.555, 101),
+    ps_vpi=ps_vpi,
+)
+max_v, min_v, quad_v = sweep_map.extrema(wavelength_index=int(np.argmin(np.abs(sweep_map.wavelengths - 1.55195))))
+print("Static sweep: max power at {} V, min power at {} V, quadrature at {} V".format(max_v, min_v, quad_v))
+
+plt.figure()
+plt.pcolormesh(sweep_map.wavelengths * 1e3, sweep_map.voltages, sweep_map.transmission, shading="auto")
+plt.colorbar(label="power [au]")
+plt.xlabel("Wavelength [nm]")
+plt.ylabel("Output PS voltage (Q) [V]")
+
 ########################################################################################################################
 # Plot EyeDiagram
 ########################################################################################################################
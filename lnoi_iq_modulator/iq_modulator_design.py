@@ -13,12 +13,24 @@ from ipkiss3.pcell.model import CompactModel
 from ipkiss3.pcell.photonics.term import OpticalTerm
 from ipkiss3.pcell.wiring import ElectricalTerm
 import numpy as np
-from scipy.constants import speed_of_light
+from derived_parameters import (DERIVED_PUSH_PULL_PARAMETERS, DERIVED_SMATRIX_PARAMETERS,
+                                build_compact_model, push_pull_derive, push_pull_smatrix,
+                                push_pull_transmissions)
 
 from asp_sin_lnoi_photonics.components.modulator.mzm.pcell.connector import bend_connector
 
 __all__ = ["IQModulator"]
 
+# Waveguide driven by the states voltage_1 to voltage_4 of CustomPushPullModulatorModel:
+# (waveguide setting the phase and the delay, waveguide setting the loss, sign of the phase shift)
+PUSH_PULL_ARMS = (
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+    ("top", "top", +1),
+    ("bottom", "bottom", -1),
+)
+
+
 class CustomPushPullModulatorModel(CompactModel):
     """
     Model for a push-pull modulator with two optical waveguides in the electrode gaps.
@@ -45,6 +57,10 @@ class CustomPushPullModulatorModel(CompactModel):
         The DC voltage applied to the electrode (only used for s-matrix calculation)
     bandwidth:
         The bandwidth of the phase modulator in Hz
+    amplitude_k, delay_k, phase_lambda_k, phase_v_k, phase_0_k, inv_tau:
+        Coefficients derived from the parameters above by push_pull_derive (k = 1 to 4)
+    smatrix_amplitude, smatrix_phase_lambda, smatrix_phase_v, smatrix_phase_0:
+        The same coefficients as arrays over the arms of calculate_smatrix, see push_pull_transmissions
     """
 
     parameters = [
@@ -59,7 +75,7 @@ class CustomPushPullModulatorModel(CompactModel):
         'voltage_top',
         'voltage_bottom',
         'bandwidth'
-    ]
+    ] + DERIVED_PUSH_PULL_PARAMETERS + DERIVED_SMATRIX_PARAMETERS
 
     terms = [
         OpticalTerm(name='top_in'),
@@ -85,82 +101,165 @@ class CustomPushPullModulatorModel(CompactModel):
     ]
 
     def calculate_smatrix(parameters, env, S):
-        # First order approximation of neff based on group index and effective index at the given center wavelength
-        dneff = -(parameters.n_g - parameters.n_eff) / parameters.center_wavelength
-        neff_total = parameters.n_eff + (env.wavelength - parameters.center_wavelength) * dneff
+        # All four arms in one broadcast expression, with the coefficients derived once by push_pull_derive
+        voltages = np.array([parameters.voltage_top, parameters.voltage_top,
+                             parameters.voltage_bottom, parameters.voltage_bottom])
+        a = push_pull_transmissions(parameters.smatrix_amplitude, parameters.smatrix_phase_lambda,
+                                    parameters.smatrix_phase_v, parameters.smatrix_phase_0, env.wavelength, voltages)
+        S['top_in', 'top_out'] = S['top_out', 'top_in'] = a[0]
+        S['bottom_in', 'bottom_out'] = S['bottom_out', 'bottom_in'] = a[1]
+        S['top_in_2', 'top_out_2'] = S['top_out_2', 'top_in_2'] = a[2]
+        S['bottom_in_2', 'bottom_out_2'] = S['bottom_out_2', 'bottom_in_2'] = a[3]
 
-        switching_voltage = parameters.vpi_l / parameters.electrode_length * 1e4
-        dn_dv = parameters.center_wavelength / (2.0 * parameters.electrode_length * switching_voltage)
+    def calculate_signals(parameters, env, output_signals, y, t, input_signals):
+        # The invariant coefficients are derived once by push_pull_derive, see PUSH_PULL_ARMS
+        inv_wavelength = 1.0 / env.wavelength
 
-        phase = 2.0 * np.pi / env.wavelength * (
-                    neff_total * parameters.top_wg_length + dn_dv * parameters.voltage_top * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        S['top_in', 'top_out'] = S['top_out', 'top_in'] = np.exp(1j * phase) * loss
+        # Top Arm
+        a = parameters.amplitude_1 * np.exp(1j * (
+            (parameters.phase_lambda_1 + parameters.phase_v_1 * y['voltage_1']) * inv_wavelength + parameters.phase_0_1))
+        output_signals['top_out'] = a * input_signals['top_in', t - parameters.delay_1]
+        output_signals['top_in'] = a * input_signals['top_out', t - parameters.delay_1]
 
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.bottom_wg_length - dn_dv * parameters.voltage_top * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        S['bottom_in', 'bottom_out'] = S['bottom_out', 'bottom_in'] = np.exp(1j * phase) * loss
+        a = parameters.amplitude_2 * np.exp(1j * (
+            (parameters.phase_lambda_2 + parameters.phase_v_2 * y['voltage_2']) * inv_wavelength + parameters.phase_0_2))
+        output_signals['bottom_out'] = a * input_signals['bottom_in', t - parameters.delay_2]
+        output_signals['bottom_in'] = a * input_signals['bottom_out', t - parameters.delay_2]
 
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.top_wg_length + dn_dv * parameters.voltage_bottom * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        S['top_in_2', 'top_out_2'] = S['top_out_2', 'top_in_2'] = np.exp(1j * phase) * loss
 
-        phase = 2.0 * np.pi / env.wavelength * (
-                neff_total * parameters.bottom_wg_length - dn_dv * parameters.voltage_bottom * parameters.electrode_length)
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        S['bottom_in_2', 'bottom_out_2'] = S['bottom_out_2', 'bottom_in_2'] = np.exp(1j * phase) * loss
+        # Bottom Arm
+        a = parameters.amplitude_3 * np.exp(1j * (
+            (parameters.phase_lambda_3 + parameters.phase_v_3 * y['voltage_3']) * inv_wavelength + parameters.phase_0_3))
+        output_signals['top_out_2'] = a * input_signals['top_in_2', t - parameters.delay_3]
+        output_signals['top_in_2'] = a * input_signals['top_out_2', t - parameters.delay_3]
 
-    def calculate_signals(parameters, env, output_signals, y, t, input_signals):
-        dneff = -(parameters.n_g - parameters.n_eff) / parameters.center_wavelength
-        neff = parameters.n_eff + (env.wavelength - parameters.center_wavelength) * dneff
+        a = parameters.amplitude_4 * np.exp(1j * (
+            (parameters.phase_lambda_4 + parameters.phase_v_4 * y['voltage_4']) * inv_wavelength + parameters.phase_0_4))
+        output_signals['bottom_out_2'] = a * input_signals['bottom_in_2', t - parameters.delay_4]
+        output_signals['bottom_in_2'] = a * input_signals['bottom_out_2', t - parameters.delay_4]
 
-        # First-order approximation of the delay
-        switching_voltage = parameters.vpi_l / parameters.electrode_length * 1e4
-        dn_dv = parameters.center_wavelength / (2.0 * parameters.electrode_length * switching_voltage)
+    def calculate_dydt(parameters, env, dydt, y, t, input_signals):
+        inv_tau = parameters.inv_tau
+        dydt['voltage_1'] = ((input_signals['top_signal'] - input_signals['top_ground']) - y['voltage_1']) * inv_tau
+        dydt['voltage_2'] = ((input_signals['top_signal'] - input_signals['middle_ground']) - y['voltage_2']) * inv_tau
+        dydt['voltage_3'] = ((input_signals['bottom_signal'] - input_signals['middle_ground']) - y['voltage_3']) * inv_tau
+        dydt['voltage_4'] = ((input_signals['bottom_signal'] - input_signals['bottom_ground']) - y['voltage_4']) * inv_tau
 
-        # Top Arm
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.top_wg_length + dn_dv * y['voltage_1'] * parameters.electrode_length)
-        delay = parameters.top_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['top_out'] = a * input_signals['top_in', t - delay]
-        output_signals['top_in'] = a * input_signals['top_out', t - delay]
-
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.bottom_wg_length - dn_dv * y['voltage_2'] * parameters.electrode_length)
-        delay = parameters.bottom_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['bottom_out'] = a * input_signals['bottom_in', t - delay]
-        output_signals['bottom_in'] = a * input_signals['bottom_out', t - delay]
 
+class IQModulatorSurrogateModel(CompactModel):
+    """
+    Reduced-order model of the whole IQModulator: the nested MZMs collapsed into four arms from the input to the
+    output, out = sum_k a_k * in(t - delay_k), with
 
-        # Bottom Arm
-        loss = 10 ** (-parameters.loss_dB_m * parameters.top_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (
-                    neff * parameters.top_wg_length + dn_dv * y['voltage_3'] * parameters.electrode_length)
-        delay = parameters.top_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['top_out_2'] = a * input_signals['top_in_2', t - delay]
-        output_signals['top_in_2'] = a * input_signals['top_out_2', t - delay]
-
-        loss = 10 ** (-parameters.loss_dB_m * parameters.bottom_wg_length * 1e-6 / 20.0)
-        phase = 2 * np.pi / env.wavelength * (neff * parameters.bottom_wg_length - dn_dv * y['voltage_4'] * parameters.electrode_length)
-        delay = parameters.bottom_wg_length * 1e-6 / (speed_of_light / parameters.n_g)  # Convert length from um to m
-        a = loss * np.exp(1j * phase)
-        output_signals['bottom_out_2'] = a * input_signals['bottom_in_2', t - delay]
-        output_signals['bottom_in_2'] = a * input_signals['bottom_out_2', t - delay]
+        a_k = amplitude_k * exp(1j * ((phase_lambda_k + phase_v_k * voltage_k) / wavelength + phase_0_k
+                                      + ps_phase * (heater voltages of arm k)))
+
+    The arm coefficients are fitted on the S-matrix of the hierarchical model (see simulation.surrogate), so the
+    steady state is the same; the electrode keeps its RC pole and every arm its own group delay.
+
+    Parameters
+    ----------
+    amplitude_k, phase_lambda_k, phase_0_k, delay_k:
+        Fitted transmission, phase coefficients and group delay [s] of arm k (k = 1 to 4: MZM 1 top and bottom,
+        MZM 2 top and bottom) with all the voltages at 0 V
+    phase_v_k:
+        Phase of arm k per volt on its electrode, times the wavelength
+    inv_tau:
+        1 / time constant of the electrode [1/s]
+    voltage_top, voltage_bottom:
+        The DC voltages applied to the electrodes (only used for s-matrix calculation)
+    ps_phase:
+        Phase per volt of the phase shifters [rad/V]
+    """
+
+    parameters = DERIVED_PUSH_PULL_PARAMETERS + [
+        'voltage_top',
+        'voltage_bottom',
+        'ps_phase'
+    ]
+
+    terms = [
+        OpticalTerm(name='in'),
+        OpticalTerm(name='out'),
+        ElectricalTerm(name='top_ground'),
+        ElectricalTerm(name='top_signal'),
+        ElectricalTerm(name='middle_ground'),
+        ElectricalTerm(name='bottom_signal'),
+        ElectricalTerm(name='bottom_ground'),
+        ElectricalTerm(name='mzm_1_ps_1_in'),
+        ElectricalTerm(name='mzm_1_ps_1_gnd'),
+        ElectricalTerm(name='mzm_1_ps_2_in'),
+        ElectricalTerm(name='mzm_1_ps_2_gnd'),
+        ElectricalTerm(name='mzm_2_ps_1_in'),
+        ElectricalTerm(name='mzm_2_ps_1_gnd'),
+        ElectricalTerm(name='mzm_2_ps_2_in'),
+        ElectricalTerm(name='mzm_2_ps_2_gnd'),
+        ElectricalTerm(name='mzm_1_ps_out_in'),
+        ElectricalTerm(name='mzm_1_ps_out_gnd'),
+        ElectricalTerm(name='mzm_2_ps_out_in'),
+        ElectricalTerm(name='mzm_2_ps_out_gnd'),
+    ]
+
+    states = [
+        'voltage_1',
+        'voltage_2',
+        'voltage_3',
+        'voltage_4',
+    ]
+
+    def calculate_smatrix(parameters, env, S):
+        inv_wavelength = 1.0 / env.wavelength
+        a_1 = parameters.amplitude_1 * np.exp(1j * (
+            (parameters.phase_lambda_1 + parameters.phase_v_1 * parameters.voltage_top) * inv_wavelength
+            + parameters.phase_0_1))
+        a_2 = parameters.amplitude_2 * np.exp(1j * (
+            (parameters.phase_lambda_2 + parameters.phase_v_2 * parameters.voltage_top) * inv_wavelength
+            + parameters.phase_0_2))
+        a_3 = parameters.amplitude_3 * np.exp(1j * (
+            (parameters.phase_lambda_3 + parameters.phase_v_3 * parameters.voltage_bottom) * inv_wavelength
+            + parameters.phase_0_3))
+        a_4 = parameters.amplitude_4 * np.exp(1j * (
+            (parameters.phase_lambda_4 + parameters.phase_v_4 * parameters.voltage_bottom) * inv_wavelength
+            + parameters.phase_0_4))
+        S['in', 'out'] = S['out', 'in'] = a_1 + a_2 + a_3 + a_4
 
+    def calculate_signals(parameters, env, output_signals, y, t, input_signals):
+        inv_wavelength = 1.0 / env.wavelength
+        ps_phase = parameters.ps_phase
+        heater_i = ps_phase * (input_signals['mzm_1_ps_out_in'] - input_signals['mzm_1_ps_out_gnd'])
+        heater_q = ps_phase * (input_signals['mzm_2_ps_out_in'] - input_signals['mzm_2_ps_out_gnd'])
+
+        # MZM 1 (I)
+        a_1 = parameters.amplitude_1 * np.exp(1j * (
+            (parameters.phase_lambda_1 + parameters.phase_v_1 * y['voltage_1']) * inv_wavelength + parameters.phase_0_1
+            + ps_phase * (input_signals['mzm_1_ps_1_in'] - input_signals['mzm_1_ps_1_gnd']) + heater_i))
+        a_2 = parameters.amplitude_2 * np.exp(1j * (
+            (parameters.phase_lambda_2 + parameters.phase_v_2 * y['voltage_2']) * inv_wavelength + parameters.phase_0_2
+            + ps_phase * (input_signals['mzm_1_ps_2_in'] - input_signals['mzm_1_ps_2_gnd']) + heater_i))
+
+        # MZM 2 (Q)
+        a_3 = parameters.amplitude_3 * np.exp(1j * (
+            (parameters.phase_lambda_3 + parameters.phase_v_3 * y['voltage_3']) * inv_wavelength + parameters.phase_0_3
+            + ps_phase * (input_signals['mzm_2_ps_1_in'] - input_signals['mzm_2_ps_1_gnd']) + heater_q))
+        a_4 = parameters.amplitude_4 * np.exp(1j * (
+            (parameters.phase_lambda_4 + parameters.phase_v_4 * y['voltage_4']) * inv_wavelength + parameters.phase_0_4
+            + ps_phase * (input_signals['mzm_2_ps_2_in'] - input_signals['mzm_2_ps_2_gnd']) + heater_q))
+
+        output_signals['out'] = (a_1 * input_signals['in', t - parameters.delay_1]
+                                 + a_2 * input_signals['in', t - parameters.delay_2]
+                                 + a_3 * input_signals['in', t - parameters.delay_3]
+                                 + a_4 * input_signals['in', t - parameters.delay_4])
+        output_signals['in'] = (a_1 * input_signals['out', t - parameters.delay_1]
+                                + a_2 * input_signals['out', t - parameters.delay_2]
+                                + a_3 * input_signals['out', t - parameters.delay_3]
+                                + a_4 * input_signals['out', t - parameters.delay_4])
 
     def calculate_dydt(parameters, env, dydt, y, t, input_signals):
-        tau = 1.0 / (2.0 * np.pi * parameters.bandwidth)
-        dydt['voltage_1'] = ((input_signals['top_signal'] - input_signals['top_ground']) - y['voltage_1']) / tau
-        dydt['voltage_2'] = ((input_signals['top_signal'] - input_signals['middle_ground']) - y['voltage_2']) / tau
-        dydt['voltage_3'] = ((input_signals['bottom_signal'] - input_signals['middle_ground']) - y['voltage_3']) / tau
-        dydt['voltage_4'] = ((input_signals['bottom_signal'] - input_signals['bottom_ground']) - y['voltage_4']) / tau
+        inv_tau = parameters.inv_tau
+        dydt['voltage_1'] = ((input_signals['top_signal'] - input_signals['top_ground']) - y['voltage_1']) * inv_tau
+        dydt['voltage_2'] = ((input_signals['top_signal'] - input_signals['middle_ground']) - y['voltage_2']) * inv_tau
+        dydt['voltage_3'] = ((input_signals['bottom_signal'] - input_signals['middle_ground']) - y['voltage_3']) * inv_tau
+        dydt['voltage_4'] = ((input_signals['bottom_signal'] - input_signals['bottom_ground']) - y['voltage_4']) * inv_tau
 
 
 class CPWElectrode(i3.PCell):
@@ -506,13 +605,23 @@ class CPWElectrodeWithWaveguides(i3.PCell):
         voltage_top = i3.NumberProperty(default=0, doc='voltage applied to the top electrode in V')
         voltage_bottom = i3.NumberProperty(default=0, doc='voltage applied to the bottom electrode in V')
         bandwidth = i3.PositiveNumberProperty(default=40e9, doc="electrial bandwidth of the modulator in Hz")
-
-        def _generate_model(self):
+        # Travelling-wave electrode, only used by the fast path (see simulation.electrode): the circuit solver keeps
+        # the RC pole of bandwidth, and the testbenches warn when these differ from their defaults
+        n_rf = i3.PositiveNumberProperty(default=2.2, doc="effective index of the RF wave on the electrode")
+        alpha_rf = i3.DefinitionProperty(default=0.5,
+                                         doc="RF loss of the electrode, in dB/(cm*sqrt(GHz)) scaled with sqrt(f), or "
+                                             "a function of the frequency in Hz returning the loss in dB/cm (see "
+                                             "simulation.electrode.rf_loss)")
+        z_electrode = i3.PositiveNumberProperty(default=50.0, doc="characteristic impedance of the electrode in Ohm")
+        z_source = i3.PositiveNumberProperty(default=50.0, doc="impedance of the RF source in Ohm")
+        z_load = i3.PositiveNumberProperty(default=50.0, doc="impedance of the electrode termination in Ohm")
+
+        def _model_parameters(self):
             wg_tmpl_cm = self.cell.trace_template.get_default_view(i3.CircuitModelView)
             lv = self.cell.get_default_view(i3.LayoutView)
             top_wg_length = lv.instances['top_wg'].reference.trace_length()
             bottom_wg_length = lv.instances['bottom_wg'].reference.trace_length()
-            return CustomPushPullModulatorModel(
+            return dict(
                 n_g=wg_tmpl_cm.n_g,
                 n_eff=wg_tmpl_cm.n_eff,
                 center_wavelength=wg_tmpl_cm.center_wavelength,
@@ -526,6 +635,19 @@ class CPWElectrodeWithWaveguides(i3.PCell):
                 bandwidth=self.bandwidth
             )
 
+        def _generate_model(self):
+            return build_compact_model(CustomPushPullModulatorModel, push_pull_derive(PUSH_PULL_ARMS),
+                                       **self._model_parameters())
+
+        def get_smatrix_sweep(self, wavelengths, voltage_top=None, voltage_bottom=None):
+            """S-matrix for arrays of wavelengths and DC voltages, see push_pull_smatrix.
+
+            Unlike get_smatrix, this is evaluated with numpy broadcasting in one pass, e.g. for a wavelength-bias map:
+
+                S = cm.get_smatrix_sweep(wavelengths[:, None], voltage_top=voltages[None, :])
+            """
+            return push_pull_smatrix(self._model_parameters(), wavelengths, voltage_top, voltage_bottom)
+
 
 class IQModulator(i3.PCell):
     """
@@ -923,17 +1045,40 @@ class IQModulator(i3.PCell):
         voltage_top = i3.NumberProperty(default=0, doc='voltage applied to the top electrode in V')
         voltage_bottom = i3.NumberProperty(default=0, doc='voltage applied to the bottom electrode in V')
         bandwidth = i3.PositiveNumberProperty(default=40e9, doc="electrial bandwidth of the modulator in Hz")
+        # Travelling-wave electrode, only used by the fast path (see simulation.electrode): the circuit solver keeps
+        # the RC pole of bandwidth, and the testbenches warn when these differ from their defaults
+        n_rf = i3.PositiveNumberProperty(default=2.2, doc="effective index of the RF wave on the electrode")
+        alpha_rf = i3.DefinitionProperty(default=0.5,
+                                         doc="RF loss of the electrode, in dB/(cm*sqrt(GHz)) scaled with sqrt(f), or "
+                                             "a function of the frequency in Hz returning the loss in dB/cm (see "
+                                             "simulation.electrode.rf_loss)")
+        z_electrode = i3.PositiveNumberProperty(default=50.0, doc="characteristic impedance of the electrode in Ohm")
+        z_source = i3.PositiveNumberProperty(default=50.0, doc="impedance of the RF source in Ohm")
+        z_load = i3.PositiveNumberProperty(default=50.0, doc="impedance of the electrode termination in Ohm")
+        surrogate = i3.DefinitionProperty(default=None, allow_none=True,
+                                          doc="fitted arm parameters (see simulation.surrogate.fit_surrogate), if "
+                                              "given the IQModulatorSurrogateModel replaces the hierarchical model")
 
         def _default_phase_modulator(self):
             pm_cm = self.cell.phase_modulator.get_default_view(self)
             pm_cm.set(vpi_l=self.vpi_l,
                       voltage_top=self.voltage_top,
                       voltage_bottom=self.voltage_bottom,
-                      bandwidth=self.bandwidth
+                      bandwidth=self.bandwidth,
+                      n_rf=self.n_rf,
+                      alpha_rf=self.alpha_rf,
+                      z_electrode=self.z_electrode,
+                      z_source=self.z_source,
+                      z_load=self.z_load
                       )
             return pm_cm
 
         def _generate_model(self):
+            if self.surrogate is not None:
+                return IQModulatorSurrogateModel(voltage_top=self.voltage_top,
+                                                 voltage_bottom=self.voltage_bottom,
+                                                 inv_tau=2.0 * np.pi * self.bandwidth,
+                                                 **self.surrogate)
 
             return i3.HierarchicalModel.from_netlistview(self.netlist_view)
 
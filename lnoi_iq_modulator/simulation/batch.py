@@ -0,0 +1,302 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Batch runs of the IQ modulator recipes over a grid of parameters.
+
+The grid points are fanned out over a process pool. Every worker builds the DUT and prepares the testbench of every
+format once, so a grid point only binds its waveforms and bias voltages into the testbench and re-runs the time
+integration. The outputs are gathered into a columnar store: one column
+per parameter and per recorded signal, with one row per grid point.
+
+From the lnoi_iq_modulator directory:
+
+    python -m simulation.batch --format qam pam4 --grid seed=0,1,2,3 --grid v_heater_q=0,1.5 \
+        --set mod_amplitude_i=2.5 mod_amplitude_q=2.5 mod_noise_i=0.1 mod_noise_q=0.1 opt_amplitude=2.0 \
+        opt_noise=0.2 v_heater_i=0 v_mzm_left1=0 v_mzm_left2=0 v_mzm_right1=0 v_mzm_right2=5 \
+        --layout electrode_length=8000 --out batch.npz
+"""
+
+import argparse
+import ast
+import importlib
+import itertools
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Recipe of every modulation format: (module in this package, function)
+RECIPES = {
+    "qam": ("simulate_iq_mod_QAM", "simulate_modulation_QAM"),
+    "qam_no_combiner": ("simulate_iq_mod_QAM_no_combiner", "simulate_modulation_QAM"),
+    "qam_fast": ("fast_path", "simulate_modulation_QAM_fast"),
+    "pam4": ("simulate_iq_mod_PAM4", "simulate_modulation_PAM4"),
+    "pam4_no_combiner": ("simulate_iq_mod_PAM4_no_combiner", "simulate_modulation_PAM4"),
+    "qpsk": ("simulate_iq_mod_QPSK", "simulate_modulation_QPSK"),
+    "qpsk_no_combiner": ("simulate_iq_mod_QPSK_no_combiner", "simulate_modulation_QPSK"),
+    "ps_sweep": ("simulate_iq_mod_ps_sweep", "simulate_modulation_ps_sweep"),
+}
+
+# Recipe parameters that make a recipe return something else than time-domain signals, which a batch cannot record
+STATIC_MODES = {"ps_sweep": ("mode", "static")}
+
+# State of a worker process: the DUT it simulates and the prepared testbench of every format
+_worker = {}
+
+
+def parameter_grid(**axes):
+    """All combinations of the given parameter values, as a list of dictionaries.
+
+    Parameters
+    ----------
+    axes :
+        Parameter name to a list of values.
+
+    Returns
+    -------
+    List of dictionaries of parameter name to value.
+
+    """
+    names = list(axes)
+    return [OrderedDict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def get_recipe(fmt: str):
+    """Recipe function of a modulation format, see RECIPES."""
+    if fmt not in RECIPES:
+        raise ValueError("Unknown format {}, choose from {}".format(fmt, sorted(RECIPES)))
+    module, function = RECIPES[fmt]
+    return getattr(importlib.import_module("." + module, __package__), function)
+
+
+def prepare_recipe(fmt: str, cell):
+    """Testbench of the recipe of a modulation format on a DUT, see the prepare_testbench of the recipe modules.
+
+    Returns
+    -------
+    PreparedSimulation, or None for recipes without a testbench (the fast path).
+
+    """
+    if fmt not in RECIPES:
+        raise ValueError("Unknown format {}, choose from {}".format(fmt, sorted(RECIPES)))
+    module = importlib.import_module("." + RECIPES[fmt][0], __package__)
+    if not hasattr(module, "prepare_testbench"):
+        return None
+    return module.prepare_testbench(cell)
+
+
+def build_dut(dut: str, dut_params=None, layout_params=None, model_params=None):
+    """Instantiate the DUT from a "module:class" reference, e.g. "iq_modulator_design:IQModulator".
+
+    Parameters
+    ----------
+    dut : str
+        Module and class of the DUT PCell.
+    dut_params : dict
+        Properties of the PCell.
+    layout_params : dict
+        Properties of its layout view.
+    model_params : dict
+        Properties of its circuit model view.
+
+    Returns
+    -------
+    The DUT PCell.
+
+    """
+    module, name = dut.split(":")
+    cell = getattr(importlib.import_module(module), name)(**(dut_params or {}))
+    cell.Layout(**(layout_params or {}))
+    cm = cell.CircuitModel()
+    for key, value in (model_params or {}).items():
+        setattr(cm, key, value)
+    return cell
+
+
+def _init_worker(dut, dut_params, layout_params, model_params, formats):
+    _worker["cell"] = build_dut(dut, dut_params, layout_params, model_params)
+    _worker["simulations"] = {fmt: prepare_recipe(fmt, _worker["cell"]) for fmt in formats}
+
+
+def _run_point(index, fmt, params, outputs):
+    start = time.perf_counter()
+    simulation = _worker["simulations"][fmt]
+    if simulation is not None:
+        params = dict(params, simulation=simulation)
+    results = get_recipe(fmt)(cell=_worker["cell"], **params)
+    recorded = {"timesteps": np.asarray(results.timesteps)}
+    for name in outputs:
+        recorded[name] = np.asarray(results[name])
+    return index, recorded, time.perf_counter() - start
+
+
+class BatchResults(object):
+    """Columnar results of a batch: one column per parameter and per recorded signal, one row per grid point.
+
+    Parameters
+    ----------
+    points : list of dict
+        Grid points, including the "format" of each point.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.signals = OrderedDict()
+        self.elapsed = np.full(len(points), np.nan)
+
+    def __len__(self):
+        return len(self.points)
+
+    def parameter(self, name):
+        """Column of a parameter (None where a point does not set it)."""
+        values = [point.get(name) for point in self.points]
+        if all(isinstance(value, str) for value in values):
+            return np.array(values)
+        try:
+            return np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            return np.array(values, dtype=object)
+
+    def add(self, index, recorded, elapsed):
+        for name, values in recorded.items():
+            column = self.signals.setdefault(name, [None] * len(self.points))
+            column[index] = values
+        self.elapsed[index] = elapsed
+
+    def signal(self, name):
+        """Column of a recorded signal, stacked into a 2D array when all rows have the same length."""
+        column = self.signals[name]
+        if all(row is not None for row in column) and len({row.shape for row in column}) == 1:
+            return np.stack(column)
+        stacked = np.empty(len(column), dtype=object)
+        stacked[:] = column
+        return stacked
+
+    def save(self, path: str):
+        """Save all columns to a .npz file, parameters as "param/<name>" and signals as "signal/<name>"."""
+        names = sorted({name for point in self.points for name in point})
+        columns = {"param/{}".format(name): self.parameter(name) for name in names}
+        columns.update({"signal/{}".format(name): self.signal(name) for name in self.signals})
+        columns["elapsed"] = self.elapsed
+        np.savez(path, **columns)
+
+
+def run_batch(
+    grid,
+    fmt="qam",
+    base_params=None,
+    outputs=("out",),
+    dut="iq_modulator_design:IQModulator",
+    dut_params=None,
+    layout_params=None,
+    model_params=None,
+    max_workers=None,
+    verbose=True,
+):
+    """Run a recipe on every point of a parameter grid, in parallel.
+
+    Parameters
+    ----------
+    grid : list of dict
+        Grid points, e.g. from parameter_grid. A "format" entry in a point overrides fmt for that point.
+    fmt : str
+        Modulation format, see RECIPES.
+    base_params : dict
+        Recipe parameters shared by all points.
+    outputs : tuple of str
+        Names of the signals to record (probes or sources of the testbench).
+    dut : str
+        Module and class of the DUT, see build_dut.
+    dut_params, layout_params, model_params : dict
+        Properties of the DUT, its layout and its circuit model.
+    max_workers : int
+        Number of worker processes. Defaults to the number of cores.
+    verbose : bool
+        If True, print the progress.
+
+    Returns
+    -------
+    BatchResults
+
+    """
+    points = []
+    for point in grid:
+        point = OrderedDict(point)
+        point.setdefault("format", fmt)
+        points.append(point)
+        params = dict(base_params or {}, **point)
+        if point["format"] in STATIC_MODES:
+            name, value = STATIC_MODES[point["format"]]
+            if params.get(name) == value:
+                raise ValueError("The {} recipe with {}={!r} returns no time-domain signals, run it directly instead "
+                                 "of in a batch".format(point["format"], name, value))
+    batch = BatchResults(points)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(dut, dut_params, layout_params, model_params, sorted({point["format"] for point in points})),
+    ) as executor:
+        futures = []
+        for index, point in enumerate(points):
+            params = dict(base_params or {})
+            params.update((key, value) for key, value in point.items() if key != "format")
+            futures.append(executor.submit(_run_point, index, point["format"], params, tuple(outputs)))
+        for done, future in enumerate(as_completed(futures), 1):
+            index, recorded, elapsed = future.result()
+            batch.add(index, recorded, elapsed)
+            if verbose:
+                print("[{}/{}] {} in {:.1f} s".format(done, len(points), dict(points[index]), elapsed))
+    return batch
+
+
+def _parse_assignments(items):
+    """Parse "name=value" items; values are Python literals, falling back to strings."""
+    parsed = OrderedDict()
+    for item in items or []:
+        name, value = item.split("=", 1)
+        try:
+            parsed[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed[name] = value
+    return parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run IQ modulator recipes over a grid of parameters.")
+    parser.add_argument("--format", nargs="+", default=["qam"], choices=sorted(RECIPES), help="modulation formats")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="grid axis as name=v1,v2,... (repeat for more axes)")
+    parser.add_argument("--set", nargs="*", default=[], help="fixed recipe parameters as name=value")
+    parser.add_argument("--dut", default="iq_modulator_design:IQModulator", help="DUT as module:class")
+    parser.add_argument("--dut-params", nargs="*", default=[], help="DUT properties as name=value")
+    parser.add_argument("--layout", nargs="*", default=[], help="layout properties as name=value")
+    parser.add_argument("--model", nargs="*", default=[], help="circuit model properties as name=value")
+    parser.add_argument("--outputs", nargs="+", default=["out"], help="signals to record")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--out", default="batch.npz", help="output .npz file")
+    args = parser.parse_args(argv)
+
+    axes = OrderedDict([("format", args.format)])
+    for axis in args.grid:
+        name, values = axis.split("=", 1)
+        axes[name] = [_parse_assignments(["v=" + value])["v"] for value in values.split(",")]
+
+    batch = run_batch(
+        parameter_grid(**axes),
+        base_params=_parse_assignments(args.set),
+        outputs=args.outputs,
+        dut=args.dut,
+        dut_params=_parse_assignments(args.dut_params),
+        layout_params=_parse_assignments(args.layout),
+        model_params=_parse_assignments(args.model),
+        max_workers=args.workers,
+    )
+    batch.save(args.out)
+    print("Saved {} runs to {}".format(len(batch), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Gray-coded symbol mapping of bit streams onto PAM, PSK and (rectangular) QAM constellations.
+
+The mapping is done in one vectorized pass over the bit stream, and the reference bits and symbols are kept next to
+the I and Q drive levels so that the received symbols can be compared against them (BER, SER, EVM).
+"""
+
+import numpy as np
+
+from .sources import hold_waveform
+
+MODULATIONS = ("pam", "psk", "qam")
+
+
+def gray_code(values):
+    """Binary reflected Gray code of integer values."""
+    return values ^ (values >> 1)
+
+
+def _bits_per_symbol(order: int) -> int:
+    bits_per_symbol = int(round(np.log2(order)))
+    if order < 2 or 2**bits_per_symbol != order:
+        raise ValueError("The modulation order must be a power of 2, got {}".format(order))
+    return bits_per_symbol
+
+
+def _pack_labels(bits: np.ndarray, bits_per_symbol: int) -> np.ndarray:
+    """Group the bits into integer labels, the first bit of every symbol being the most significant one."""
+    weights = 1 << np.arange(bits_per_symbol - 1, -1, -1)
+    return bits.reshape(-1, bits_per_symbol).astype(np.int64) @ weights
+
+
+def _gray_pam_levels(labels: np.ndarray, n_bits: int) -> np.ndarray:
+    """Levels between -1 and 1 of Gray-labelled PAM symbols, so that neighbouring levels differ in a single bit."""
+    if n_bits == 0:
+        return np.zeros(labels.shape[0])
+    n_levels = 2**n_bits
+    positions = np.empty(n_levels, dtype=np.int64)
+    positions[gray_code(np.arange(n_levels))] = np.arange(n_levels)
+    return 2.0 * positions[labels] / (n_levels - 1) - 1.0
+
+
+class SymbolStream(object):
+    """Reference bits and symbols of a modulated stream.
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        Transmitted bits (uint8), bits_per_symbol per symbol.
+    labels : np.ndarray
+        Integer label of every symbol.
+    symbols : np.ndarray
+        Complex constellation point of every symbol. The real and imaginary parts are the I and Q drive levels
+        between -1 and 1.
+    modulation : str
+        "pam", "psk" or "qam".
+    order : int
+        Number of constellation points.
+    """
+
+    def __init__(self, bits, labels, symbols, modulation, order):
+        self.bits = bits
+        self.labels = labels
+        self.symbols = symbols
+        self.modulation = modulation
+        self.order = order
+
+    def __len__(self):
+        return self.symbols.shape[0]
+
+    @property
+    def bits_per_symbol(self):
+        return _bits_per_symbol(self.order)
+
+    @property
+    def i(self):
+        """Drive levels of the I tributary."""
+        return self.symbols.real
+
+    @property
+    def q(self):
+        """Drive levels of the Q tributary."""
+        return self.symbols.imag
+
+    def drives(self, steps_per_bit: int, amplitude_i: float = 1.0, amplitude_q: float = 1.0):
+        """Zero-order hold I and Q drive waveforms, see hold_waveform.
+
+        Parameters
+        ----------
+        steps_per_bit : int
+            Number of time steps per symbol.
+        amplitude_i : float
+            Amplitude of the I drive.
+        amplitude_q : float
+            Amplitude of the Q drive.
+
+        Returns
+        -------
+        Tuple of the I and Q drive waveforms.
+
+        """
+        return (
+            amplitude_i * hold_waveform(self.i, steps_per_bit),
+            amplitude_q * hold_waveform(self.q, steps_per_bit),
+        )
+
+
+def map_bits(bits, modulation: str = "qam", order: int = 16, phase_offset: float = None) -> SymbolStream:
+    """Map a bit stream onto Gray-coded symbols.
+
+    For QAM the first floor(log2(order) / 2) bits of a symbol select the I level and the remaining bits the Q level,
+    which gives square constellations for even powers of 2 and rectangular ones (e.g. 4 x 8 for 32-QAM) otherwise.
+    The I and Q levels are both normalized to [-1, 1]. PSK symbols lie on the unit circle and PAM symbols are real.
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        Bit stream of 0/1 values. Trailing bits that do not fill a whole symbol are dropped.
+    modulation : str
+        "pam", "psk" or "qam".
+    order : int
+        Number of constellation points, a power of 2.
+    phase_offset : float
+        Phase of the first PSK symbol [rad]. Defaults to pi / 4 for QPSK, so that its symbols coincide with 4-QAM,
+        and 0 otherwise.
+
+    Returns
+    -------
+    SymbolStream with the reference bits, labels and symbols.
+
+    """
+    if modulation not in MODULATIONS:
+        raise ValueError("Unknown modulation {}, choose from {}".format(modulation, MODULATIONS))
+    bits_per_symbol = _bits_per_symbol(order)
+    bits = np.asarray(bits, dtype=np.uint8)
+    n_symbols = bits.shape[0] // bits_per_symbol
+    bits = bits[:n_symbols * bits_per_symbol]
+    labels = _pack_labels(bits, bits_per_symbol)
+
+    if modulation == "pam":
+        symbols = _gray_pam_levels(labels, bits_per_symbol).astype(complex)
+    elif modulation == "psk":
+        if phase_offset is None:
+            phase_offset = np.pi / 4 if order == 4 else 0.0
+        positions = np.empty(order, dtype=np.int64)
+        positions[gray_code(np.arange(order))] = np.arange(order)
+        symbols = np.exp(1j * (2 * np.pi * positions[labels] / order + phase_offset))
+    else:
+        bits_q = (bits_per_symbol + 1) // 2
+        bits_i = bits_per_symbol - bits_q
+        symbols = _gray_pam_levels(labels >> bits_q, bits_i) + 1j * _gray_pam_levels(labels & (2**bits_q - 1), bits_q)
+
+    return SymbolStream(bits=bits, labels=labels, symbols=symbols, modulation=modulation, order=order)
+
+
+def random_symbols(
+    n_symbols: int,
+    modulation: str = "qam",
+    order: int = 16,
+    rng: np.random.Generator = None,
+    prbs_order: int = None,
+    offset: int = 0,
+    phase_offset: float = None,
+) -> SymbolStream:
+    """Draw n_symbols Gray-coded symbols from random bits or from a PRBS.
+
+    Parameters
+    ----------
+    n_symbols : int
+        Number of symbols.
+    modulation : str
+        "pam", "psk" or "qam".
+    order : int
+        Number of constellation points, a power of 2.
+    rng : numpy.random.Generator
+        Generator of the random bits, e.g. NoiseBank(seed).generator("bits"). Defaults to a freshly seeded generator.
+    prbs_order : int
+        If given, the bits are taken from an ITU PRBS of this order instead.
+    offset : int
+        Offset in bits in the PRBS pattern.
+    phase_offset : float
+        Phase of the first PSK symbol [rad], see map_bits.
+
+    Returns
+    -------
+    SymbolStream with the reference bits, labels and symbols.
+
+    """
+    n_bits = n_symbols * _bits_per_symbol(order)
+    if prbs_order is not None:
+        from .prbs import prbs_window
+
+        sequence, offset = prbs_window(prbs_order, n_bits, offset)
+        bits = sequence.bits(n_bits, offset)
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+        bits = np.unpackbits(rng.integers(0, 256, -(-n_bits // 8), dtype=np.uint8))[:n_bits]
+    return map_bits(bits, modulation=modulation, order=order, phase_offset=phase_offset)
@@ -0,0 +1,132 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Reproducible noise for the testbenches.
+
+Every port gets its own counter-based random stream (Philox by default), keyed by the seed of the run, the name of
+the port and the index of the block of samples. The noise is generated in blocks of vectorized draws before the
+simulation and played back as an array excitation, instead of calling np.random.normal on the global NumPy state at
+every time step of the solver. Any window of samples can therefore be regenerated on its own, in any process, and
+gives the same values.
+"""
+
+import hashlib
+
+import numpy as np
+
+from .sources import sampled_waveform
+
+# Number of samples per independently keyed block
+NOISE_BLOCK_SIZE = 2**16
+
+_BIT_GENERATORS = {
+    "philox": np.random.Philox,
+    "pcg64": np.random.PCG64,
+}
+
+
+def _key_words(key: str):
+    """Stable 32-bit words identifying key, identical across processes and Python sessions (unlike hash())."""
+    digest = hashlib.sha256(str(key).encode("utf-8")).digest()
+    return tuple(int(word) for word in np.frombuffer(digest[:16], dtype="<u4"))
+
+
+class NoiseBank(object):
+    """Collection of independent, reproducible random streams keyed by port name.
+
+    Parameters
+    ----------
+    seed : int
+        Seed of the run. If None, fresh entropy is drawn; it is stored in the seed attribute so the run can be
+        reproduced afterwards.
+    bit_generator : str
+        "philox" or "pcg64".
+    """
+
+    def __init__(self, seed: int = None, bit_generator: str = "philox"):
+        if bit_generator not in _BIT_GENERATORS:
+            raise ValueError("Unknown bit generator {}, choose from {}".format(bit_generator, sorted(_BIT_GENERATORS)))
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.bit_generator = bit_generator
+
+    def generator(self, key: str, block: int = 0) -> np.random.Generator:
+        """Random generator of the given block of the stream named key.
+
+        Parameters
+        ----------
+        key : str
+            Name of the stream, usually the name of the port.
+        block : int
+            Index of the block.
+
+        Returns
+        -------
+        generator :
+            numpy.random.Generator
+
+        """
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=_key_words(key) + (block,))
+        return np.random.Generator(_BIT_GENERATORS[self.bit_generator](seed_sequence))
+
+    def normal(self, key: str, sigma: float, n_samples: int, offset: int = 0) -> np.ndarray:
+        """Gaussian noise samples offset to offset + n_samples of the stream named key.
+
+        Parameters
+        ----------
+        key : str
+            Name of the stream, usually the name of the port.
+        sigma : float
+            Standard deviation of the noise.
+        n_samples : int
+            Number of samples.
+        offset : int
+            Index of the first sample in the stream.
+
+        Returns
+        -------
+        noise :
+            Array of n_samples samples.
+
+        """
+        noise = np.empty(n_samples)
+        if not sigma:
+            noise[:] = 0.0
+            return noise
+        first_block = offset // NOISE_BLOCK_SIZE
+        last_block = (offset + n_samples - 1) // NOISE_BLOCK_SIZE
+        start = offset - first_block * NOISE_BLOCK_SIZE
+        filled = 0
+        for block in range(first_block, last_block + 1):
+            samples = self.generator(key, block).standard_normal(NOISE_BLOCK_SIZE)
+            stop = min(NOISE_BLOCK_SIZE, start + n_samples - filled)
+            noise[filled:filled + stop - start] = samples[start:stop]
+            filled += stop - start
+            start = 0
+        noise *= sigma
+        return noise
+
+    def source(self, key: str, sigma: float, n_samples: int, dt: float, mean: float = 0.0, t0: float = 0.0):
+        """Array-backed excitation function f(t) = mean + noise, sampled every dt starting at t0.
+
+        Parameters
+        ----------
+        key : str
+            Name of the stream, usually the name of the port.
+        sigma : float
+            Standard deviation of the noise.
+        n_samples : int
+            Number of samples.
+        dt : float
+            Time between two samples [s].
+        mean : float
+            Value the noise is added to.
+        t0 : float
+            Time of the first sample [s].
+
+        Returns
+        -------
+        f_wave :
+            Noisy waveform as a function of time.
+
+        """
+        return sampled_waveform(mean + self.normal(key, sigma, n_samples), dt, t0=t0)
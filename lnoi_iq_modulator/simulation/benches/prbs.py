@@ -0,0 +1,211 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Pseudo-random binary sequences (PRBS) following ITU-T O.150.
+
+The sequences are generated with a vectorized jump-ahead of the LFSR recurrence and stored bit-packed, so even a full
+PRBS31 pattern only takes 256 MiB. prbs_window only generates the part of the pattern that is used, and symbols are
+unpacked lazily from it.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# LFSR taps (n, m) of the generator polynomials x^n + x^m + 1
+PRBS_TAPS = {
+    7: (7, 6),
+    9: (9, 5),
+    11: (11, 9),
+    15: (15, 14),
+    23: (23, 18),
+    31: (31, 28),
+}
+
+
+def _lfsr_extend(data: np.ndarray, length: int, n: int, m: int) -> np.ndarray:
+    """Extend data, which holds at least the first n elements of the sequence, to length elements.
+
+    The recurrence b[k] = b[k - n] ^ b[k - m] also holds for the lags (2^j * n, 2^j * m), so every step fills a block
+    of 2^j * m elements at once and the number of steps only grows with the logarithm of the length. The same holds
+    for the bytes of the packed sequence once the first n bytes are known, as they hold the bits with lags 8 * n and
+    8 * m.
+    """
+    out = np.empty(length, dtype=data.dtype)
+    filled = min(data.shape[0], length)
+    out[:filled] = data[:filled]
+    jump = 1
+    while filled < length:
+        while 2 * jump * n <= filled:
+            jump *= 2
+        lag_n = jump * n
+        lag_m = jump * m
+        block = min(lag_m, length - filled)
+        np.bitwise_xor(out[filled - lag_n:filled - lag_n + block], out[filled - lag_m:filled - lag_m + block],
+                       out=out[filled:filled + block])
+        filled += block
+    return out
+
+
+def _taps(order: int):
+    if order not in PRBS_TAPS:
+        raise ValueError("Unsupported PRBS order {}, choose from {}".format(order, sorted(PRBS_TAPS)))
+    return PRBS_TAPS[order]
+
+
+class PRBSSequence(object):
+    """Bit-packed PRBS pattern.
+
+    Parameters
+    ----------
+    order : int
+        Order of the PRBS (7, 9, 11, 15, 23 or 31).
+    n_bits : int
+        Number of bits to generate. Defaults to one period (2^order - 1 bits).
+    seed : int
+        Initial state of the shift register, must be non-zero. Defaults to all ones.
+    """
+
+    def __init__(self, order: int, n_bits: int = None, seed: int = None):
+        n, m = _taps(order)
+        if seed is None:
+            seed = 2**n - 1
+        if seed % 2**n == 0:
+            raise ValueError("The seed of a PRBS{} must be non-zero modulo 2^{}".format(order, n))
+
+        self.order = order
+        self.period = 2**n - 1
+        self.n_bits = self.period if n_bits is None else int(n_bits)
+        self.seed = seed
+
+        # Unpacked start-up until the lags are a whole number of bytes, then continue on the packed bytes
+        head = np.array([(seed >> (n - 1 - k)) & 1 for k in range(n)], dtype=np.uint8)
+        head = _lfsr_extend(head, 8 * n, n, m)
+        n_bytes = max(-(-self.n_bits // 8), n)
+        self.packed = _lfsr_extend(np.packbits(head), n_bytes, n, m)
+
+    def __len__(self):
+        return self.n_bits
+
+    def bits(self, n_bits: int, offset: int = 0) -> np.ndarray:
+        """Unpack n_bits bits starting at offset.
+
+        The bits wrap around at the LFSR period 2^order - 1 when the pattern holds at least one period, like the
+        output of the shift register itself. A pattern shorter than one period (n_bits of the constructor) wraps
+        around at its own end instead.
+
+        Parameters
+        ----------
+        n_bits : int
+        offset : int
+
+        Returns
+        -------
+        bits :
+            Array of 0/1 values (uint8), empty for n_bits=0.
+
+        """
+        if n_bits <= 0:
+            return np.zeros(0, dtype=np.uint8)
+        length = min(self.n_bits, self.period)
+        offset %= length
+        chunks = []
+        while n_bits > 0:
+            stop = min(offset + n_bits, length)
+            first_byte = offset // 8
+            chunk = np.unpackbits(self.packed[first_byte:-(-stop // 8)])
+            chunks.append(chunk[offset - 8 * first_byte:stop - 8 * first_byte])
+            n_bits -= stop - offset
+            offset = 0
+        return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+    def symbols(self, bits_per_symbol: int, n_symbols: int, offset: int = 0) -> np.ndarray:
+        """Group consecutive bits into integer symbols, the first bit being the most significant one.
+
+        Parameters
+        ----------
+        bits_per_symbol : int
+        n_symbols : int
+        offset : int
+            Offset in bits.
+
+        Returns
+        -------
+        symbols :
+            Array of n_symbols integers between 0 and 2^bits_per_symbol - 1.
+
+        """
+        bits = self.bits(bits_per_symbol * n_symbols, offset).reshape(n_symbols, bits_per_symbol)
+        weights = 1 << np.arange(bits_per_symbol - 1, -1, -1)
+        return bits.astype(np.int64) @ weights
+
+
+@lru_cache(maxsize=4)
+def prbs_sequence(order: int, n_bits: int = None, seed: int = None) -> PRBSSequence:
+    """Cached PRBSSequence, so repeated simulations reuse the same packed pattern."""
+    return PRBSSequence(order, n_bits=n_bits, seed=seed)
+
+
+def prbs_window(order: int, n_bits: int, offset: int = 0, seed: int = None):
+    """Cached PRBSSequence generated just far enough to read n_bits bits from offset.
+
+    The pattern is cut at offset + n_bits, or at one period if the bits wrap around, so a short stream of a PRBS31
+    takes a few bytes instead of the 256 MiB of a full period.
+
+    Parameters
+    ----------
+    order : int
+        Order of the PRBS.
+    n_bits : int
+        Number of bits that are read.
+    offset : int
+        Offset in bits in the PRBS pattern.
+    seed : int
+        Initial state of the shift register.
+
+    Returns
+    -------
+    Tuple (PRBSSequence, offset in it) to pass to bits or symbols.
+
+    """
+    period = 2**_taps(order)[0] - 1
+    offset %= period
+    return prbs_sequence(order, n_bits=min(offset + max(n_bits, 0), period), seed=seed), offset
+
+
+def prbs_levels(order: int, n_symbols: int, n_levels=(2,), offset: int = 0, seed: int = None):
+    """Map a PRBS onto one or more tributaries of equally spaced levels between -1 and 1.
+
+    Every symbol takes log2(n_levels) consecutive bits per tributary, e.g. n_levels=(2,) gives an NRZ (OOK) stream,
+    (4,) a PAM4 stream and (4, 4) the I and Q levels of a 16QAM stream.
+
+    Parameters
+    ----------
+    order : int
+        Order of the PRBS.
+    n_symbols : int
+        Number of symbols.
+    n_levels : tuple of int
+        Number of levels of every tributary, each a power of 2.
+    offset : int
+        Offset in bits in the PRBS pattern.
+    seed : int
+        Initial state of the shift register.
+
+    Returns
+    -------
+    Tuple with an array of n_symbols levels per tributary.
+
+    """
+    bits_per_level = [int(np.log2(levels)) for levels in n_levels]
+    if any(2**k != levels for k, levels in zip(bits_per_level, n_levels)):
+        raise ValueError("The number of levels must be powers of 2, got {}".format(n_levels))
+
+    sequence, offset = prbs_window(order, sum(bits_per_level) * n_symbols, offset, seed)
+    symbols = sequence.symbols(sum(bits_per_level), n_symbols, offset)
+    shift = sum(bits_per_level)
+    tributaries = []
+    for k, levels in zip(bits_per_level, n_levels):
+        shift -= k
+        tributaries.append(2 * ((symbols >> shift) & (levels - 1)) / (levels - 1) - 1.0)
+    return tuple(tributaries)
@@ -0,0 +1,189 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Band-limited DAC/driver waveforms.
+
+The symbol stream is upsampled to the simulation time base and shaped with a raised-cosine or root-raised-cosine
+pulse (overlap-add FFT convolution) and/or a Bessel-Thomson driver response (applied in the frequency domain). The
+result is an array with the same length as hold_waveform, ready to be played back with sampled_waveform, so the
+shaping costs nothing inside the solver loop.
+"""
+
+import numpy as np
+from scipy import signal
+from scipy.fft import irfft, next_fast_len, rfft, rfftfreq
+
+from .sources import hold_waveform
+
+PULSE_SHAPES = ("nrz", "rc", "rrc")
+
+
+def raised_cosine_taps(roll_off: float, samples_per_symbol: int, span: int) -> np.ndarray:
+    """Raised-cosine impulse response, normalized to 1 at t = 0 so the symbol values are kept at the symbol centres.
+
+    Parameters
+    ----------
+    roll_off : float
+        Roll-off factor (0 to 1).
+    samples_per_symbol : int
+    span : int
+        Length of the response in symbols.
+
+    Returns
+    -------
+    taps :
+        Array of span * samples_per_symbol + 1 taps, centred on the middle tap.
+
+    """
+    t = np.arange(-(span * samples_per_symbol // 2), span * samples_per_symbol // 2 + 1) / samples_per_symbol
+    denominator = 1.0 - (2.0 * roll_off * t) ** 2
+    singular = np.isclose(denominator, 0.0)
+    taps = np.sinc(t) * np.cos(np.pi * roll_off * t) / np.where(singular, 1.0, denominator)
+    if roll_off > 0:
+        taps[singular] = np.pi / 4 * np.sinc(1.0 / (2 * roll_off))
+    return taps
+
+
+def root_raised_cosine_taps(roll_off: float, samples_per_symbol: int, span: int) -> np.ndarray:
+    """Root-raised-cosine impulse response, normalized so that two cascaded filters give a unit peak.
+
+    Parameters
+    ----------
+    roll_off : float
+        Roll-off factor (0 to 1).
+    samples_per_symbol : int
+    span : int
+        Length of the response in symbols.
+
+    Returns
+    -------
+    taps :
+        Array of span * samples_per_symbol + 1 taps, centred on the middle tap.
+
+    """
+    t = np.arange(-(span * samples_per_symbol // 2), span * samples_per_symbol // 2 + 1) / samples_per_symbol
+    if roll_off == 0:
+        taps = np.sinc(t)
+    else:
+        denominator = np.pi * t * (1.0 - (4.0 * roll_off * t) ** 2)
+        singular = np.isclose(denominator, 0.0)
+        numerator = np.sin(np.pi * t * (1 - roll_off)) + 4 * roll_off * t * np.cos(np.pi * t * (1 + roll_off))
+        taps = numerator / np.where(singular, 1.0, denominator)
+        taps[np.isclose(t, 0.0)] = 1.0 - roll_off + 4 * roll_off / np.pi
+        edge = singular & ~np.isclose(t, 0.0)
+        taps[edge] = roll_off / np.sqrt(2) * (
+            (1 + 2 / np.pi) * np.sin(np.pi / (4 * roll_off)) + (1 - 2 / np.pi) * np.cos(np.pi / (4 * roll_off))
+        )
+    return taps / np.sqrt(np.sum(taps**2) / samples_per_symbol)
+
+
+def bessel_thomson_filter(waveform: np.ndarray, dt: float, bandwidth: float, order: int = 4) -> np.ndarray:
+    """Filter a waveform with an analog Bessel-Thomson low-pass response, evaluated on the FFT grid.
+
+    The waveform is padded with its edge values before the FFT so that the circular convolution does not wrap the
+    end of the waveform onto its start.
+
+    Parameters
+    ----------
+    waveform : np.ndarray
+        Waveform sampled every dt.
+    dt : float
+        Time step [s].
+    bandwidth : float
+        3 dB bandwidth [Hz].
+    order : int
+        Order of the filter.
+
+    Returns
+    -------
+    filtered :
+        Filtered waveform with the same length.
+
+    """
+    b, a = signal.bessel(order, 2 * np.pi * bandwidth, analog=True, norm="mag")
+    n_pad = int(np.ceil(10.0 * order / (2 * np.pi * bandwidth * dt)))
+    padded = np.pad(waveform, (n_pad, n_pad), mode="edge")
+    n_fft = next_fast_len(padded.shape[0], real=True)
+    freqs = rfftfreq(n_fft, dt)
+    _, response = signal.freqs(b, a, worN=2 * np.pi * freqs)
+    filtered = irfft(rfft(padded - padded[0], n_fft, workers=-1) * response, n_fft, workers=-1) + padded[0]
+    return filtered[n_pad:n_pad + waveform.shape[0]]
+
+
+class PulseShape(object):
+    """Pulse shape of the DAC/driver.
+
+    Parameters
+    ----------
+    shape : str
+        "nrz" (zero-order hold), "rc" (raised cosine) or "rrc" (root raised cosine).
+    roll_off : float
+        Roll-off factor of the (root) raised cosine.
+    span : int
+        Length of the (root) raised-cosine response in symbols.
+    bandwidth : float
+        If given, 3 dB bandwidth [Hz] of a Bessel-Thomson driver response applied after the pulse shaping.
+    order : int
+        Order of the Bessel-Thomson response.
+    """
+
+    def __init__(self, shape: str = "rc", roll_off: float = 0.35, span: int = 16, bandwidth: float = None,
+                 order: int = 4):
+        if shape not in PULSE_SHAPES:
+            raise ValueError("Unknown pulse shape {}, choose from {}".format(shape, PULSE_SHAPES))
+        self.shape = shape
+        self.roll_off = roll_off
+        self.span = span
+        self.bandwidth = bandwidth
+        self.order = order
+
+    def taps(self, samples_per_symbol: int) -> np.ndarray:
+        if self.shape == "rc":
+            return raised_cosine_taps(self.roll_off, samples_per_symbol, self.span)
+        return root_raised_cosine_taps(self.roll_off, samples_per_symbol, self.span)
+
+    def waveform(self, symbol_values: np.ndarray, samples_per_symbol: int, symbol_rate: float = None) -> np.ndarray:
+        """Shaped waveform of the symbol stream, with the same length and symbol timing as hold_waveform.
+
+        The pulses are centred in the middle of their symbol slot.
+
+        Parameters
+        ----------
+        symbol_values : np.ndarray
+            Value of each symbol.
+        samples_per_symbol : int
+            Number of samples per symbol.
+        symbol_rate : float
+            Symbol rate [Hz], needed for the Bessel-Thomson response.
+
+        Returns
+        -------
+        waveform :
+            Array of len(symbol_values) * samples_per_symbol + 1 samples.
+
+        """
+        symbol_values = np.asarray(symbol_values)
+        n_samples = symbol_values.shape[0] * samples_per_symbol + 1
+        if self.shape == "nrz":
+            waveform = hold_waveform(symbol_values, samples_per_symbol)
+        else:
+            impulses = np.zeros(n_samples, dtype=symbol_values.dtype)
+            impulses[samples_per_symbol // 2:-1:samples_per_symbol] = symbol_values
+            taps = self.taps(samples_per_symbol)
+            half = taps.shape[0] // 2
+            waveform = signal.oaconvolve(impulses, taps)[half:half + n_samples]
+
+        if self.bandwidth is not None:
+            if symbol_rate is None:
+                raise ValueError("The symbol rate is needed to apply the Bessel-Thomson response")
+            waveform = bessel_thomson_filter(waveform, 1.0 / (symbol_rate * samples_per_symbol), self.bandwidth,
+                                             self.order)
+        return waveform
+
+
+def shape_drive(symbol_values: np.ndarray, samples_per_symbol: int, pulse_shape: PulseShape = None,
+                symbol_rate: float = None) -> np.ndarray:
+    """Drive waveform of a symbol stream: zero-order hold if pulse_shape is None, else the shaped waveform."""
+    if pulse_shape is None:
+        return hold_waveform(symbol_values, samples_per_symbol)
+    return pulse_shape.waveform(symbol_values, samples_per_symbol, symbol_rate)
@@ -54,6 +54,43 @@ def random_bitsource(bitrate: float, amplitude: float, n_bytes: int = 100, seed=
     return f_rbs
 
 
+def prbs_bitsource(bitrate: float, amplitude: float, order: int = 7, n_bytes: int = 100, offset: int = 0):
+    """Create a PRBS bit source function f(t) with a given bitrate, PRBS order and amplitude.
+
+    Parameters
+    ----------
+    bitrate : float
+        Bitrate [bit/s].
+    amplitude : float
+    order : int
+        Order of the ITU PRBS (7, 9, 11, 15, 23 or 31).
+    n_bytes : int
+    offset : int
+        Offset in bits in the PRBS pattern.
+
+    Returns
+    -------
+    f_prbs :
+        PRBS function as a function of time.
+
+    """
+    from numba import njit
+    from .prbs import prbs_window
+
+    # Only the bits that are played back are generated and unpacked
+    sequence, offset = prbs_window(order, n_bytes, offset)
+    data = 2.0 * sequence.bits(n_bytes, offset) - 1.0
+
+    @njit()
+    def f_prbs(t):
+        idx = int(t * bitrate)
+        if idx >= n_bytes:
+            idx = n_bytes - 1
+        return amplitude * data[idx]
+
+    return f_prbs
+
+
 def step_function(amplitude_0: float, amplitude_1: float, t_step: float) -> Callable[[float], float]:
     """Create a step function f_step(t) between amplitude_0 and amplitude_1 at t_step.
 
@@ -78,6 +115,28 @@ def step_function(amplitude_0: float, amplitude_1: float, t_step: float) -> Call
     return f_step
 
 
+def constant_source(value: float) -> Callable[[float], float]:
+    """Create a constant function f(t) = value, e.g. to tie a DC bias or a ground.
+
+    Parameters
+    ----------
+    value : float
+
+    Returns
+    -------
+    f_const :
+        Constant as a function of time.
+
+    """
+    from numba import njit
+
+    @njit()
+    def f_const(t):
+        return value
+
+    return f_const
+
+
 def rand_normal() -> Callable[[float], float]:
     """Returns a numba jitted function that returns a float based on a normal distribution.
 
@@ -98,3 +157,110 @@ def rand_normal() -> Callable[[float], float]:
         return np.random.normal(0, sigma)
 
     return rand_normal_jitted
+
+
+def random_levels(n_bytes: int, n_levels: int = 2, seed=None, rng=None) -> np.ndarray:
+    """Draw n_bytes random symbols with n_levels equally spaced levels between -1 and 1.
+
+    Parameters
+    ----------
+    n_bytes : int
+        Number of symbols.
+    n_levels : int
+        Number of levels (2 gives an NRZ bit stream of -1/+1).
+    seed : int
+        Seed used for random number generation.
+    rng : numpy.random.Generator
+        Generator to draw from, e.g. from a NoiseBank. If None, the global NumPy random state is used.
+
+    Returns
+    -------
+    levels :
+        Array of n_bytes levels.
+
+    """
+    if rng is not None:
+        return (2 * rng.integers(0, n_levels, n_bytes)) / (n_levels - 1) - 1.0
+
+    if seed is not None:
+        np.random.seed(seed)
+
+    return (2 * np.random.randint(0, n_levels, n_bytes)) / (n_levels - 1) - 1.0
+
+
+def hold_waveform(symbol_values: np.ndarray, samples_per_symbol: int) -> np.ndarray:
+    """Hold each symbol value for samples_per_symbol samples (zero-order hold).
+
+    One extra sample repeating the last symbol is appended so the waveform also covers the end time of the simulation.
+
+    Parameters
+    ----------
+    symbol_values : np.ndarray
+        Value of each symbol.
+    samples_per_symbol : int
+        Number of samples per symbol.
+
+    Returns
+    -------
+    waveform :
+        Array of len(symbol_values) * samples_per_symbol + 1 samples.
+
+    """
+    symbol_values = np.asarray(symbol_values)
+    waveform = np.empty(symbol_values.shape[0] * samples_per_symbol + 1, dtype=symbol_values.dtype)
+    waveform[:-1] = np.repeat(symbol_values, samples_per_symbol)
+    waveform[-1] = symbol_values[-1]
+    return waveform
+
+
+def sampled_waveform(values: np.ndarray, dt: float, t0: float = 0.0, interpolate: bool = False):
+    """Create a function f(t) that plays back a precomputed waveform sampled every dt starting at t0.
+
+    The waveform (drive plus noise) is built once with vectorized code, so the excitation function only does an index
+    lookup (or a linear interpolation) at every time step of the solver. Times outside the waveform are clamped to
+    the first and last sample.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Waveform samples, real or complex.
+    dt : float
+        Time between two samples [s].
+    t0 : float
+        Time of the first sample [s].
+    interpolate : bool
+        If True, linearly interpolate between samples, else return the nearest sample.
+
+    Returns
+    -------
+    f_wave :
+        Waveform as a function of time.
+
+    """
+    from numba import njit
+
+    data = np.ascontiguousarray(values)
+    n_samples = data.shape[0]
+    inv_dt = 1.0 / dt
+
+    if interpolate:
+        @njit()
+        def f_wave(t):
+            x = (t - t0) * inv_dt
+            if x <= 0.0:
+                return data[0]
+            idx = int(x)
+            if idx >= n_samples - 1:
+                return data[n_samples - 1]
+            return data[idx] + (x - idx) * (data[idx + 1] - data[idx])
+    else:
+        @njit()
+        def f_wave(t):
+            idx = int((t - t0) * inv_dt + 0.5)
+            if idx < 0:
+                idx = 0
+            elif idx >= n_samples:
+                idx = n_samples - 1
+            return data[idx]
+
+    return f_wave
@@ -0,0 +1,160 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Bias-point solver: null, peak and quadrature wavelengths of a modulator with unbalanced arms.
+
+Instead of sampling the S-matrix on a dense wavelength grid, one FSR (from IQModulator.fsr_nm) around the centre
+wavelength is bracketed with a few single-wavelength evaluations. A sinusoidal fit of those samples gives the first
+estimates, which are then refined with Brent's method. Results are cached on a hash of the DUT class and of its
+layout and model parameters (see testbench.dut_parameters), like the heater calibrations.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+
+import numpy as np
+from scipy.optimize import brentq, minimize_scalar
+
+from .result_cache import canonical
+from .testbench import dut_parameters
+
+_bias_points = {}
+
+
+class BiasPoint(object):
+    """Null, peak and quadrature of the transmission of a modulator.
+
+    Attributes
+    ----------
+    null, peak, quadrature : float
+        Wavelengths [um] of the minimum, the maximum and the mid-point (on the rising edge from null to peak) of the
+        transmission.
+    t_null, t_peak, t_quadrature : float
+        Power transmission at those wavelengths.
+    n_evaluations : int
+        Number of S-matrix evaluations used to find them.
+    """
+
+    def __init__(self, null, peak, quadrature, t_null, t_peak, t_quadrature, n_evaluations):
+        self.null = null
+        self.peak = peak
+        self.quadrature = quadrature
+        self.t_null = t_null
+        self.t_peak = t_peak
+        self.t_quadrature = t_quadrature
+        self.n_evaluations = n_evaluations
+
+    @property
+    def extinction_ratio_db(self):
+        return 10 * np.log10(self.t_peak / max(self.t_null, 1e-30))
+
+    def __repr__(self):
+        return "BiasPoint(null={:.7f} um, quadrature={:.7f} um, peak={:.7f} um, ER={:.1f} dB)".format(
+            self.null, self.quadrature, self.peak, self.extinction_ratio_db
+        )
+
+
+class _Transmission(object):
+    """Power transmission of one S-matrix term at single wavelengths, counting the evaluations."""
+
+    def __init__(self, circuit_model, out_port, in_port):
+        self.circuit_model = circuit_model
+        self.out_port = out_port
+        self.in_port = in_port
+        self.n_evaluations = 0
+
+    def __call__(self, wavelength):
+        self.n_evaluations += 1
+        smatrix = self.circuit_model.get_smatrix(wavelengths=np.array([wavelength]))
+        return float(np.abs(smatrix[self.out_port, self.in_port][0]) ** 2)
+
+
+def _bias_point_key(cell, center_wavelength, fsr_nm, out_port, in_port):
+    params = OrderedDict([("cell", type(cell).__name__), ("center_wavelength", center_wavelength),
+                          ("fsr_nm", fsr_nm), ("out_port", out_port), ("in_port", in_port)])
+    params.update(dut_parameters(cell))
+    return hashlib.sha1(json.dumps(canonical(params), sort_keys=True).encode()).hexdigest()
+
+
+def find_bias_point(
+    cell,
+    center_wavelength: float = 1.55,
+    fsr_nm: float = None,
+    out_port: str = "out",
+    in_port: str = "in",
+    n_bracket: int = 4,
+    xtol: float = 1e-7,
+    use_cache: bool = True,
+) -> BiasPoint:
+    """Find the null, peak and quadrature wavelengths in the FSR around center_wavelength.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT, e.g. an IQModulator with delays.
+    center_wavelength : float
+        Wavelength [um] around which to search.
+    fsr_nm : float
+        FSR [nm] of the transmission. Defaults to the fsr_nm property of the DUT.
+    out_port, in_port : str
+        Ports of the S-matrix term.
+    n_bracket : int
+        Number of equally spaced samples over one FSR used for the first estimates (at least 3).
+    xtol : float
+        Wavelength tolerance [um] of the refinement (1e-7 um = 0.1 pm).
+    use_cache : bool
+        If True, reuse a previous result for a DUT of the same class, layout and model parameters.
+
+    Returns
+    -------
+    BiasPoint
+
+    """
+    if n_bracket < 3:
+        raise ValueError("The sinusoidal fit needs n_bracket >= 3 samples, got {}".format(n_bracket))
+    if fsr_nm is None:
+        fsr_nm = getattr(cell, "fsr_nm", None)
+        if fsr_nm is None:
+            raise ValueError("{} has no fsr_nm, pass the FSR explicitly".format(cell.name))
+    fsr = fsr_nm * 1e-3
+    key = _bias_point_key(cell, center_wavelength, fsr_nm, out_port, in_port)
+    if use_cache and key in _bias_points:
+        return _bias_points[key]
+
+    transmission = _Transmission(cell.CircuitModel(), out_port, in_port)
+
+    # Sinusoidal fit t = a + b cos(phi) + c sin(phi) of n_bracket samples over one FSR
+    phases = 2 * np.pi * np.arange(n_bracket) / n_bracket
+    wavelengths = center_wavelength + fsr * (phases / (2 * np.pi) - 0.5)
+    samples = np.array([transmission(wl) for wl in wavelengths])
+    fit = np.linalg.lstsq(np.stack([np.ones(n_bracket), np.cos(phases), np.sin(phases)], axis=1), samples,
+                          rcond=None)[0]
+    phase_peak = np.arctan2(fit[2], fit[1]) % (2 * np.pi)
+    peak_guess = wavelengths[0] + fsr * phase_peak / (2 * np.pi)
+    null_guess = peak_guess - fsr / 2 if peak_guess - fsr / 2 >= wavelengths[0] else peak_guess + fsr / 2
+
+    def refine(guess, sign):
+        result = minimize_scalar(
+            lambda wl: sign * transmission(wl),
+            bounds=(guess - fsr / 8, guess + fsr / 8),
+            method="bounded",
+            options={"xatol": xtol},
+        )
+        return result.x, sign * result.fun
+
+    null, t_null = refine(null_guess, 1.0)
+    peak, t_peak = refine(peak_guess, -1.0)
+
+    # Quadrature on the rising edge: from the null towards the next peak
+    if peak < null:
+        peak += fsr
+    t_quadrature = 0.5 * (t_null + t_peak)
+    quadrature = brentq(lambda wl: transmission(wl) - t_quadrature, null, peak, xtol=xtol)
+    if quadrature > center_wavelength + fsr / 2:
+        quadrature -= fsr
+    peak = peak - fsr if peak > center_wavelength + fsr / 2 else peak
+
+    bias_point = BiasPoint(null, peak, quadrature, t_null, t_peak, t_quadrature, transmission.n_evaluations)
+    _bias_points[key] = bias_point
+    return bias_point
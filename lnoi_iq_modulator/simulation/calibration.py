@@ -0,0 +1,282 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Heater-bias calibration of the IQ modulator: solves the six phase-shifter voltages that put both child MZMs at their
+null and the I and Q tributaries 90 degrees apart, from S-matrix evaluations at a single wavelength.
+
+At a fixed wavelength the field at the output is a sum of one complex coefficient per arm, each rotated by the phase
+of the phase shifters and of the RF electrode on that arm. The static voltages of the RF electrodes (voltage_top and
+voltage_bottom of the CircuitModel) shift the arms of each MZM in push-pull, so a few S-matrix evaluations at
+different electrode voltages identify the four arm coefficients in a single linear least-squares fit. The bias
+voltages then follow in closed form, and are stored in a calibration cache keyed on the layout and model parameters.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import ipkiss3.all as i3
+
+from .result_cache import canonical
+from .testbench import dut_parameters
+
+# Vpi [V] of the DC phase shifters: VpiL (0.1 V.cm) times the length of the phase shifter (200 um)
+PS_VPI = 0.1 / (200 / 10000)
+
+# File of the calibration cache, relative to the working directory
+CALIBRATION_CACHE = "iq_modulator_calibration.json"
+
+_calibrations = {}
+
+
+class HeaterCalibration(object):
+    """Bias voltages of the six phase shifters of an IQ modulator.
+
+    Attributes
+    ----------
+    voltages : OrderedDict
+        Voltages [V] keyed on the arguments of the simulation recipes (v_heater_i, v_heater_q, v_mzm_left1,
+        v_mzm_left2, v_mzm_right1, v_mzm_right2), so they can be passed as simulate_modulation_QAM(**voltages).
+    arms : np.ndarray
+        Complex field coefficients of the four arms (MZM 1 top and bottom, MZM 2 top and bottom) with all the phase
+        shifters at 0 V.
+    wavelength : float
+        Wavelength [um] of the calibration.
+    residual : float
+        RMS residual of the least-squares fit of the S-matrix samples.
+    n_evaluations : int
+        Number of S-matrix evaluations used (0 when read from the cache).
+    """
+
+    def __init__(self, voltages, arms, wavelength, residual, n_evaluations):
+        self.voltages = voltages
+        self.arms = arms
+        self.wavelength = wavelength
+        self.residual = residual
+        self.n_evaluations = n_evaluations
+
+    @property
+    def biases(self):
+        """Voltages keyed on the bias names of PreparedSimulation (see IQ_MODULATOR_BIASES)."""
+        names = ("ht_i", "ht_q", "mzm_left1", "mzm_left2", "mzm_right1", "mzm_right2")
+        return OrderedDict(zip(names, self.voltages.values()))
+
+    def to_json(self):
+        return {
+            "voltages": self.voltages,
+            "arms": [[arm.real, arm.imag] for arm in self.arms],
+            "wavelength": self.wavelength,
+            "residual": self.residual,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        arms = np.array([complex(re, im) for re, im in data["arms"]])
+        return cls(OrderedDict(data["voltages"]), arms, data["wavelength"], data["residual"], 0)
+
+    def __repr__(self):
+        return "HeaterCalibration({})".format(", ".join("{}={:.4f}".format(k, v) for k, v in self.voltages.items()))
+
+
+def _calibration_key(cell, wavelength, ps_vpi, iq_phase):
+    params = OrderedDict([("cell", type(cell).__name__), ("wavelength", wavelength), ("ps_vpi", ps_vpi),
+                          ("iq_phase", iq_phase)])
+    params.update(dut_parameters(cell))
+    return hashlib.sha1(json.dumps(canonical(params), sort_keys=True).encode()).hexdigest()
+
+
+def _load_cache(cache_path):
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def _split_phase(phase, ps_vpi):
+    """Voltages on a pair of phase shifters that delay the first path by phase with respect to the second.
+
+    The phase is wrapped to [0, 2 pi) and applied to the first phase shifter up to pi, and as 2 pi - phase to the
+    second one beyond pi, so no phase shifter needs more than its Vpi.
+    """
+    phase = np.mod(phase, 2 * np.pi)
+    first = np.where(phase <= np.pi, phase, 0.0)
+    second = np.where(phase > np.pi, 2 * np.pi - phase, 0.0)
+    return first * ps_vpi / np.pi, second * ps_vpi / np.pi
+
+
+def electrode_volts_per_rad(cell) -> float:
+    """Static voltage [V] on an RF electrode of an IQ modulator that shifts each of its arms by 1 rad, see
+    CustomPushPullModulatorModel."""
+    layout = cell.get_default_view(i3.LayoutView)
+    return cell.CircuitModel().vpi_l * 1e4 / (np.pi * layout.electrode_length)
+
+
+def fit_arms(cell, wavelength, n_phases: int = 3, out_ports=None, in_port: str = "in"):
+    """Identify the complex field coefficients of the four arms of an IQ modulator.
+
+    The RF electrode voltages are stepped over an n_phases x n_phases grid of push-pull phases, evenly spread over
+    2 pi, and the output fields are fitted with out = a1 exp(j t) + a2 exp(-j t) + a3 exp(j b) + a4 exp(-j b), where
+    t and b are the phases of the top and bottom electrodes. All the wavelengths and outputs are fitted at once. With
+    several outputs (e.g. top_out and bottom_out), their coefficients are summed, as if the outputs were combined.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+    wavelength : float or np.ndarray
+        Wavelength(s) [um].
+    n_phases : int
+        Number of electrode phases per electrode (at least 3).
+    out_ports : list of str
+        Optical outputs. Defaults to "out", or "top_out" and "bottom_out" if the DUT has no combined output.
+    in_port : str
+        Optical input.
+
+    Returns
+    -------
+    Tuple of the arm coefficients (shape (4,) for a single wavelength, else (4, n_wavelengths)), the RMS fit
+    residual and the number of S-matrix evaluations.
+
+    """
+    if out_ports is None:
+        port_names = [port.name for port in cell.get_default_view(i3.LayoutView).ports]
+        out_ports = ["out"] if "out" in port_names else ["top_out", "bottom_out"]
+    wavelengths = np.atleast_1d(np.asarray(wavelength, dtype=float))
+    cm = cell.CircuitModel()
+    volts_per_rad = electrode_volts_per_rad(cell)
+
+    phases = 2 * np.pi * np.arange(n_phases) / n_phases
+    phase_top, phase_bottom = [p.ravel() for p in np.meshgrid(phases, phases, indexing="ij")]
+    voltage_top, voltage_bottom = cm.voltage_top, cm.voltage_bottom
+    samples = np.empty((phase_top.shape[0], len(out_ports), wavelengths.shape[0]), dtype=complex)
+    try:
+        for k, (t, b) in enumerate(zip(phase_top, phase_bottom)):
+            cm.voltage_top = t * volts_per_rad
+            cm.voltage_bottom = b * volts_per_rad
+            smatrix = cm.get_smatrix(wavelengths=wavelengths)
+            samples[k] = [smatrix[port, in_port] for port in out_ports]
+    finally:
+        cm.voltage_top, cm.voltage_bottom = voltage_top, voltage_bottom
+
+    design = np.exp(1j * np.stack([phase_top, -phase_top, phase_bottom, -phase_bottom], axis=1))
+    samples = samples.reshape(phase_top.shape[0], -1)
+    coefficients, _, _, _ = np.linalg.lstsq(design, samples, rcond=None)
+    residual = np.sqrt(np.mean(np.abs(design @ coefficients - samples) ** 2))
+    arms = coefficients.reshape(4, len(out_ports), wavelengths.shape[0]).sum(axis=1)
+    if np.ndim(wavelength) == 0:
+        arms = arms[:, 0]
+    return arms, float(residual), phase_top.shape[0]
+
+
+def output_field(arms, voltages, voltage_top=0.0, voltage_bottom=0.0, ps_vpi: float = PS_VPI,
+                 volts_per_rad: float = 1.0):
+    """Output field of an IQ modulator from its arm coefficients, see fit_arms.
+
+    All the arguments broadcast against each other, so the field of a whole grid of bias voltages and wavelengths is
+    evaluated in one pass.
+
+    Parameters
+    ----------
+    arms : np.ndarray
+        Arm coefficients, with the arms along the first axis.
+    voltages : dict
+        Phase-shifter voltages [V] keyed on the arguments of the recipes, see HeaterCalibration.voltages. Missing
+        voltages are 0 V.
+    voltage_top, voltage_bottom : float or np.ndarray
+        Static voltages [V] on the RF electrodes.
+    ps_vpi : float
+        Vpi [V] of the phase shifters.
+    volts_per_rad : float
+        Electrode voltage per radian of phase of an arm, see electrode_volts_per_rad.
+
+    Returns
+    -------
+    Complex output field.
+
+    """
+    def phase(name):
+        return np.pi * np.asarray(voltages.get(name, 0.0)) / ps_vpi
+
+    theta_top = np.asarray(voltage_top) / volts_per_rad
+    theta_bottom = np.asarray(voltage_bottom) / volts_per_rad
+    field_i = arms[0] * np.exp(1j * (phase("v_mzm_left1") + theta_top)) + \
+        arms[1] * np.exp(1j * (phase("v_mzm_left2") - theta_top))
+    field_q = arms[2] * np.exp(1j * (phase("v_mzm_right1") + theta_bottom)) + \
+        arms[3] * np.exp(1j * (phase("v_mzm_right2") - theta_bottom))
+    return field_i * np.exp(1j * phase("v_heater_i")) + field_q * np.exp(1j * phase("v_heater_q"))
+
+
+def calibrate_heaters(
+    cell,
+    center_wavelength: float = 1.55,
+    ps_vpi: float = PS_VPI,
+    iq_phase: float = np.pi / 2,
+    cache_path: str = CALIBRATION_CACHE,
+    use_cache: bool = True,
+) -> HeaterCalibration:
+    """Solve the bias voltages of the six phase shifters of an IQ modulator.
+
+    Both child MZMs are biased at their null, and the output phase shifters are set so that the field of the bottom
+    MZM (Q) leads the field of the top MZM (I) by iq_phase when both are driven with the same positive voltage.
+    Every phase shifter is assumed to add a phase of pi * V / ps_vpi to its arm, and the voltages are kept between 0
+    and ps_vpi.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+    center_wavelength : float
+        Operating wavelength [um].
+    ps_vpi : float
+        Vpi [V] of the phase shifters.
+    iq_phase : float
+        Phase [rad] between the Q and the I tributaries.
+    cache_path : str
+        JSON file of the calibration cache. None keeps the cache in memory only.
+    use_cache : bool
+        If True, reuse a previous calibration of the same layout and model parameters.
+
+    Returns
+    -------
+    HeaterCalibration
+
+    """
+    key = _calibration_key(cell, center_wavelength, ps_vpi, iq_phase)
+    if use_cache:
+        if key not in _calibrations:
+            cached = _load_cache(cache_path).get(key)
+            if cached is not None:
+                _calibrations[key] = HeaterCalibration.from_json(cached)
+        if key in _calibrations:
+            return _calibrations[key]
+
+    arms, residual, n_evaluations = fit_arms(cell, center_wavelength)
+    arg = np.angle(arms)
+
+    # Null of each MZM: its two arms in anti-phase. Pairs of phase shifters: MZM 1 top/bottom, MZM 2 top/bottom
+    v_top, v_bottom = _split_phase(np.pi + arg[[1, 3]] - arg[[0, 2]], ps_vpi)
+    # Around the null, the field of an MZM follows its top arm (times 2j sin of the drive phase)
+    v_heater_q, v_heater_i = _split_phase(iq_phase + arg[0] + np.pi * v_top[0] / ps_vpi
+                                          - arg[2] - np.pi * v_top[1] / ps_vpi, ps_vpi)
+
+    voltages = OrderedDict(
+        [
+            ("v_heater_i", float(v_heater_i)),
+            ("v_heater_q", float(v_heater_q)),
+            ("v_mzm_left1", float(v_top[0])),
+            ("v_mzm_left2", float(v_bottom[0])),
+            ("v_mzm_right1", float(v_top[1])),
+            ("v_mzm_right2", float(v_bottom[1])),
+        ]
+    )
+    calibration = HeaterCalibration(voltages, arms, center_wavelength, residual, n_evaluations)
+    _calibrations[key] = calibration
+    if cache_path is not None:
+        cache = _load_cache(cache_path)
+        cache[key] = calibration.to_json()
+        with open(cache_path, "w") as f:
+            json.dump(cache, f, indent=2)
+    return calibration
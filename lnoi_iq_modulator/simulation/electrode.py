@@ -0,0 +1,258 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Travelling-wave model of the modulator electrode, as a precomputed FIR filter.
+
+The CircuitModel of CPWElectrodeWithWaveguides reduces the electrode to a single RC pole (bandwidth). On a long
+electrode the RF wave travels along the waveguides: it is attenuated by the conductor loss, which grows with the square
+root of the frequency, it walks off the light when its index n_rf differs from the group index n_g, and it is
+reflected at the source and at the load when their impedance differs from the one of the line. The voltage seen by
+the light, averaged over the electrode length L, is then for a drive of frequency f
+
+    H(f) = t_s (F(u_f) + Gamma_L exp(-2 gamma L) F(-u_b)) / (1 - Gamma_S Gamma_L exp(-2 gamma L))
+
+with gamma = alpha_rf(f) + 2j pi f n_rf / c the propagation constant of the line (alpha_rf the complex loss of
+rf_loss), F(u) = (1 - exp(-u)) / u, u_f = (gamma - 2j pi f n_g / c) L for the co-propagating wave and
+u_b = (gamma + 2j pi f n_g / c) L for the wave reflected at the load, t_s = 2 Z / (Z + Z_S) and
+Gamma_X = (Z_X - Z) / (Z_X + Z). A matched line without loss or walk-off has H = 1.
+
+H only depends on the parameters of the electrode, so electrode_taps samples it once into the taps of an FIR filter for
+the time step of the simulation, and apply_fir filters whole drive arrays with it by overlap-add block convolution
+instead of integrating an ODE on every time step:
+
+    taps = electrode_fir(iq_mod, dt)
+    voltage = apply_fir(drive, taps)
+
+The fast path uses it with simulate_modulation_QAM_fast(..., travelling_wave=True). The circuit solver keeps the RC
+pole of CustomPushPullModulatorModel, which has no way to convolve over past time steps, so the testbenches warn when
+the RF parameters of the DUT differ from ELECTRODE_DEFAULTS (see warn_ignored_electrode). Only the IQModulator of
+iq_modulator_design, the DUT of the fast path, has these parameters.
+"""
+
+import hashlib
+import json
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+from scipy.constants import speed_of_light
+from scipy.signal import oaconvolve
+
+import ipkiss3.all as i3
+
+from .result_cache import canonical
+
+# Conversion from dB to Np, for the RF loss
+NP_PER_DB = np.log(10) / 20.0
+# Default kernel length: the walk-off plus N_ROUND_TRIPS round trips of the reflected wave, and at least
+# MIN_KERNEL_DURATION [s] for the slow tail of the skin-effect loss
+N_ROUND_TRIPS = 4
+MIN_KERNEL_DURATION = 2e-9
+# Samples by which the kernel is delayed, on top of the walk-off, to keep the ringing of its edges causal
+GUARD_SAMPLES = 16
+# Number of kernels kept by electrode_taps
+TAPS_CACHE_SIZE = 32
+# RF parameters of the CircuitModel of the IQModulator and their defaults, for which the travelling-wave response
+# is close to the RC pole of the circuit solver
+ELECTRODE_DEFAULTS = OrderedDict(
+    [("n_rf", 2.2), ("alpha_rf", 0.5), ("z_electrode", 50.0), ("z_source", 50.0), ("z_load", 50.0)]
+)
+
+_taps = OrderedDict()
+
+
+def _averaged_wave(u):
+    """(1 - exp(-u)) / u, with its limit 1 at u = 0."""
+    u = np.asarray(u, dtype=complex)
+    small = np.abs(u) < 1e-8
+    safe = np.where(small, 1.0, u)
+    return np.where(small, 1.0 - u / 2.0, -np.expm1(-safe) / safe)
+
+
+def rf_loss(frequencies, alpha_rf) -> np.ndarray:
+    """RF loss [Np/m] of the electrode, as the complex contribution to its propagation constant.
+
+    A loss proportional to sqrt(f) on its own has an impulse response that starts before the drive. The skin effect
+    that causes it also slows the RF wave down by the same amount, in rad/m, so a loss coefficient comes with the
+    causal term (1 + 1j) alpha sqrt(f).
+
+    Parameters
+    ----------
+    frequencies : array-like
+        Frequencies [Hz], non-negative.
+    alpha_rf : float or callable
+        Conductor loss in dB/(cm sqrt(GHz)), scaled with the square root of the frequency, or a function of the
+        frequency [Hz] returning the loss in dB/cm, used as is.
+
+    Returns
+    -------
+    Complex loss of the RF wave amplitude [Np/m] at every frequency.
+
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    if callable(alpha_rf):
+        loss_dB_cm = np.asarray(alpha_rf(frequencies), dtype=complex)
+    else:
+        loss_dB_cm = (1 + 1j) * alpha_rf * np.sqrt(frequencies * 1e-9)
+    return loss_dB_cm * 1e2 * NP_PER_DB
+
+
+def travelling_wave_response(frequencies, electrode_length: float, n_rf: float, n_g: float, alpha_rf=0.0,
+                             z_electrode: float = 50.0, z_source: float = 50.0, z_load: float = 50.0) -> np.ndarray:
+    """Frequency response of a travelling-wave electrode, from the drive voltage to the voltage seen by the light.
+
+    Parameters
+    ----------
+    frequencies : array-like
+        Frequencies [Hz], non-negative.
+    electrode_length : float
+        Length of the electrode [um].
+    n_rf : float
+        Effective index of the RF wave.
+    n_g : float
+        Group index of the optical waveguides.
+    alpha_rf : float or callable
+        RF loss, see rf_loss.
+    z_electrode, z_source, z_load : float
+        Characteristic impedance of the electrode, and impedance of the source and of the termination [Ohm]. The
+        drive is the voltage the source delivers to a matched load.
+
+    Returns
+    -------
+    Complex response at every frequency, 1 at 0 Hz for a matched electrode.
+
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    length = electrode_length * 1e-6
+    omega = 2 * np.pi * frequencies
+    gamma = rf_loss(frequencies, alpha_rf) + 1j * omega * n_rf / speed_of_light
+    k_g = 1j * omega * n_g / speed_of_light
+    gamma_source = (z_source - z_electrode) / (z_source + z_electrode)
+    gamma_load = (z_load - z_electrode) / (z_load + z_electrode)
+    round_trip = np.exp(-2 * gamma * length)
+    forward = _averaged_wave((gamma - k_g) * length)
+    # The reflected wave, Gamma_L exp(-gamma (2 L - z)), travels against the light
+    backward = gamma_load * round_trip * _averaged_wave(-(gamma + k_g) * length)
+    transmission = 2 * z_electrode / (z_electrode + z_source)
+    return transmission * (forward + backward) / (1 - gamma_source * gamma_load * round_trip)
+
+
+def electrode_taps(dt: float, electrode_length: float, n_rf: float, n_g: float, alpha_rf=0.0,
+                   z_electrode: float = 50.0, z_source: float = 50.0, z_load: float = 50.0,
+                   n_taps: int = None) -> np.ndarray:
+    """Taps of the FIR filter of a travelling-wave electrode, see travelling_wave_response.
+
+    The response is sampled on a frequency grid up to the Nyquist frequency of dt, tapered to 0 over the upper half
+    of the band, transformed to the impulse response and truncated to n_taps samples. The kernel is delayed by
+    GUARD_SAMPLES samples, and by the walk-off when the RF wave is faster than the light (n_rf < n_g), so that the
+    ringing of its edges stays causal: the voltage lags the drive by this fixed delay. Results are cached on the
+    arguments (alpha_rf through result_cache.canonical, so an equivalent function or an array is found again), and
+    repeated simulations with the same electrode reuse the taps.
+
+    Parameters
+    ----------
+    dt : float
+        Time step of the drive samples [s].
+    electrode_length, n_rf, n_g, alpha_rf, z_electrode, z_source, z_load :
+        Electrode parameters, see travelling_wave_response.
+    n_taps : int
+        Length of the kernel, see N_ROUND_TRIPS and MIN_KERNEL_DURATION for the default.
+
+    Returns
+    -------
+    Real array of taps, to filter the drive with apply_fir.
+
+    """
+    arguments = [dt, electrode_length, n_rf, n_g, alpha_rf, z_electrode, z_source, z_load, n_taps]
+    key = hashlib.sha1(json.dumps(canonical(arguments)).encode()).hexdigest()
+    taps = _taps.get(key)
+    if taps is None:
+        taps = _electrode_taps(*arguments)
+        _taps[key] = taps
+        while len(_taps) > TAPS_CACHE_SIZE:
+            _taps.popitem(last=False)
+    _taps.move_to_end(key)
+    return taps
+
+
+def _electrode_taps(dt, electrode_length, n_rf, n_g, alpha_rf, z_electrode, z_source, z_load, n_taps):
+    length = electrode_length * 1e-6
+    walk_off = (n_rf - n_g) * length / speed_of_light
+    lead = int(np.ceil(max(0.0, -walk_off) / dt)) + GUARD_SAMPLES
+    if n_taps is None:
+        duration = max(abs(walk_off) + N_ROUND_TRIPS * 2 * n_rf * length / speed_of_light, MIN_KERNEL_DURATION)
+        n_taps = lead + GUARD_SAMPLES + int(np.ceil(duration / dt))
+    # Zero-pad the frequency grid so that the impulse response does not wrap around onto the kept taps
+    n_fft = 2 ** int(np.ceil(np.log2(8 * n_taps)))
+    frequencies = np.fft.rfftfreq(n_fft, dt)
+    response = travelling_wave_response(frequencies, electrode_length, n_rf, n_g, alpha_rf, z_electrode, z_source,
+                                        z_load)
+    taper = np.clip(2 * frequencies / frequencies[-1] - 1, 0.0, 1.0)
+    response = response * np.exp(-2j * np.pi * frequencies * lead * dt) * np.cos(np.pi * taper / 2) ** 2
+    taps = np.fft.irfft(response, n_fft)[:n_taps]
+    taps.flags.writeable = False
+    return taps
+
+
+def apply_fir(drive, taps) -> np.ndarray:
+    """Voltage seen by the light for a sampled drive, by overlap-add block convolution with the taps of electrode_taps.
+
+    The output has the length of the drive, with the drive taken as 0 V before its first sample.
+    """
+    drive = np.asarray(drive, dtype=float)
+    return oaconvolve(drive, taps)[:drive.shape[0]]
+
+
+def electrode_fir(cell, dt: float, n_taps: int = None) -> np.ndarray:
+    """Taps of the travelling-wave electrode of an IQ modulator, from its layout and CircuitModel.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator. The RF parameters (n_rf, alpha_rf, z_electrode, z_source, z_load) are read from its
+        CircuitModel, the electrode length from the layout of its phase modulator and n_g from its waveguide model.
+    dt : float
+        Time step of the drive samples [s].
+    n_taps : int
+        Length of the kernel, see electrode_taps.
+
+    Returns
+    -------
+    Real array of taps, to filter the drive with apply_fir.
+
+    """
+    cm = cell.CircuitModel()
+    phase_modulator = cell.phase_modulator
+    wg_tmpl_cm = phase_modulator.trace_template.get_default_view(i3.CircuitModelView)
+    electrode_length = phase_modulator.get_default_view(i3.LayoutView).electrode_length
+    return electrode_taps(float(dt), float(electrode_length), float(cm.n_rf), float(wg_tmpl_cm.n_g), cm.alpha_rf,
+                          float(cm.z_electrode), float(cm.z_source), float(cm.z_load), n_taps)
+
+
+def warn_ignored_electrode(cell):
+    """Warn that the circuit solver ignores the RF parameters of the DUT that differ from ELECTRODE_DEFAULTS.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT of a testbench.
+
+    Returns
+    -------
+    List of the names of the ignored parameters.
+
+    """
+    cm = cell.get_default_view(i3.CircuitModelView)
+    ignored = []
+    for name, default in ELECTRODE_DEFAULTS.items():
+        value = getattr(cm, name, default)
+        if callable(value) or np.ndim(value) != 0 or value != default:
+            ignored.append(name)
+    if ignored:
+        warnings.warn(
+            "The circuit solver models the electrode of {} as an RC pole and ignores {}; use "
+            "simulate_modulation_QAM_fast(..., travelling_wave=True) for the travelling-wave electrode".format(
+                cell.name, ", ".join(ignored)),
+            stacklevel=3,
+        )
+    return ignored
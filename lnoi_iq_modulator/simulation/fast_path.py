@@ -0,0 +1,263 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Linear fast path of the IQ modulator time-domain simulation, in numpy instead of the circuit solver.
+
+The electrical part of the modulator is a first-order low-pass per electrode (calculate_dydt of
+CustomPushPullModulatorModel) and the optical part is a memoryless phase modulation of four arms with fixed delays
+(see IQModulatorSurrogateModel). So the whole response follows from the drive arrays in a few vectorized passes:
+
+1. the electrode voltages are the drives filtered by the low-pass, solved exactly for the sample-and-hold playback
+   of the excitations (scipy.signal.lfilter, linear in the number of samples);
+2. every arm applies exp(1j * phase(V)) to the optical input;
+3. the optical input is delayed by the group delay of every arm, interpolated between the samples.
+
+With travelling_wave=True the low-pass of step 1 is replaced by the travelling-wave response of the electrode (RF
+loss, walk-off and reflections, see electrode.py), precomputed once as an FIR kernel and applied to the drives by
+block convolution.
+
+simulate_modulation_QAM_fast takes the arguments of simulate_modulation_QAM and returns the same signals, computed on
+the surrogate arms of the DUT (fitted with surrogate.fit_surrogate if the CircuitModel has none). cross_check runs
+both on a short pattern and returns the deviation of the fast path from get_time_response:
+
+    cross_check(iq_mod, tolerance=1e-2, n_bytes=2**8, **recipe_arguments)
+    results = simulate_modulation_QAM_fast(iq_mod, n_bytes=2**20, **recipe_arguments)
+"""
+
+import numpy as np
+from scipy.signal import lfilter
+
+from .electrode import apply_fir, electrode_fir
+from .simulate_iq_mod_QAM import qam_waveforms, simulate_modulation_QAM
+from .surrogate import fit_surrogate
+
+# Drive, phase shifter and output phase shifter of every arm of IQModulatorSurrogateModel
+ARMS = (
+    ("i", "v_mzm_left1", "v_heater_i"),
+    ("i", "v_mzm_left2", "v_heater_i"),
+    ("q", "v_mzm_right1", "v_heater_q"),
+    ("q", "v_mzm_right2", "v_heater_q"),
+)
+
+
+class FastResults(object):
+    """Signals of a fast-path simulation, indexed like the results of get_time_response.
+
+    Parameters
+    ----------
+    signals : dict
+        Samples keyed on the signal name.
+    timesteps : np.ndarray
+        Time [s] of the samples.
+    """
+
+    def __init__(self, signals, timesteps):
+        self.signals = signals
+        self.timesteps = timesteps
+
+    def __getitem__(self, name):
+        return self.signals[name]
+
+    def __contains__(self, name):
+        return name in self.signals
+
+    def keys(self):
+        return self.signals.keys()
+
+
+def electrode_response(drive: np.ndarray, dt: float, bandwidth: float) -> np.ndarray:
+    """Voltage over an electrode with time constant 1 / (2 pi bandwidth), driven by a sampled waveform.
+
+    The excitations play back the nearest sample (see testbench.SampleSlotModel), so between two samples the
+    drive steps half-way. For this piecewise constant drive the solution of dV/dt = (drive - V) / tau starting from
+    0 V is exact:
+
+        V[n + 1] = a V[n] + (sqrt(a) - a) drive[n] + (1 - sqrt(a)) drive[n + 1],  with a = exp(-dt / tau)
+
+    Parameters
+    ----------
+    drive : np.ndarray
+        Drive samples [V].
+    dt : float
+        Time between two samples [s].
+    bandwidth : float
+        Bandwidth of the electrode [Hz].
+
+    Returns
+    -------
+    Electrode voltage at the samples [V].
+
+    """
+    drive = np.asarray(drive, dtype=float)
+    decay = np.exp(-2 * np.pi * bandwidth * dt)
+    half_decay = np.sqrt(decay)
+    voltage = np.zeros_like(drive)
+    # V[n + 1] only depends on the drive up to n + 1, so filter drive[1:] with the previous sample as second tap
+    voltage[1:] = lfilter([1 - half_decay, half_decay - decay], [1.0, -decay], drive[1:],
+                          zi=[(half_decay - decay) * drive[0]])[0]
+    return voltage
+
+
+def delayed(values: np.ndarray, dt: float, delay: float) -> np.ndarray:
+    """Samples of a signal delayed by delay [s], linearly interpolated between the samples and 0 before the start."""
+    shift = delay / dt
+    whole = int(np.floor(shift))
+    fraction = shift - whole
+    shifted = np.zeros_like(values)
+    if whole < values.shape[0]:
+        shifted[whole:] = values[:values.shape[0] - whole]
+    if fraction > 0:
+        previous = np.zeros_like(values)
+        if whole + 1 < values.shape[0]:
+            previous[whole + 1:] = values[:values.shape[0] - whole - 1]
+        shifted = (1 - fraction) * shifted + fraction * previous
+    return shifted
+
+
+def fast_time_response(surrogate, opt_in, drive_i, drive_q, dt: float, bandwidth: float,
+                       center_wavelength: float, biases=None, electrode_taps=None) -> np.ndarray:
+    """Optical output of an IQ modulator for sampled inputs, see IQModulatorSurrogateModel.
+
+    Parameters
+    ----------
+    surrogate : dict
+        Fitted arm parameters, see surrogate.fit_surrogate.
+    opt_in, drive_i, drive_q : np.ndarray
+        Samples of the optical input and of the I and Q drives [V] on the simulation time base.
+    dt : float
+        Time between two samples [s].
+    bandwidth : float
+        Bandwidth of the electrodes [Hz].
+    center_wavelength : float
+        Wavelength [um] of the optical carrier.
+    biases : dict
+        Phase-shifter voltages [V] keyed on the arguments of the recipes (v_heater_i, ..., v_mzm_right2). Missing or
+        None voltages are 0 V.
+    electrode_taps : np.ndarray
+        FIR taps of a travelling-wave electrode (see electrode.electrode_fir) that replace the low-pass of bandwidth.
+
+    Returns
+    -------
+    Complex samples of the optical output.
+
+    """
+    biases = biases or {}
+    opt_in = np.asarray(opt_in, dtype=complex)
+    if electrode_taps is None:
+        voltages = {"i": electrode_response(drive_i, dt, bandwidth), "q": electrode_response(drive_q, dt, bandwidth)}
+    else:
+        voltages = {"i": apply_fir(drive_i, electrode_taps), "q": apply_fir(drive_q, electrode_taps)}
+    inv_wavelength = 1.0 / center_wavelength
+    out = np.zeros(opt_in.shape[0], dtype=complex)
+    for k, (electrode, phase_shifter, heater) in enumerate(ARMS, start=1):
+        bias_phase = surrogate["ps_phase"] * ((biases.get(phase_shifter) or 0.0) + (biases.get(heater) or 0.0))
+        static_phase = surrogate["phase_lambda_{}".format(k)] * inv_wavelength + surrogate["phase_0_{}".format(k)]
+        phase_per_volt = surrogate["phase_v_{}".format(k)] * inv_wavelength
+        phase = (static_phase + bias_phase) + phase_per_volt * voltages[electrode]
+        out += surrogate["amplitude_{}".format(k)] * np.exp(1j * phase) \
+            * delayed(opt_in, dt, surrogate["delay_{}".format(k)])
+    return out
+
+
+def simulate_modulation_QAM_fast(
+    cell,
+    mod_amplitude_i=None,
+    mod_noise_i=None,
+    mod_amplitude_q=None,
+    mod_noise_q=None,
+    opt_amplitude=None,
+    opt_noise=None,
+    v_heater_i=None,
+    v_heater_q=None,
+    v_mzm_left1=None,
+    v_mzm_left2=None,
+    v_mzm_right1=None,
+    v_mzm_right2=None,
+    bit_rate=10e9,
+    n_bytes=100,
+    steps_per_bit=50,
+    center_wavelength=1.5,
+    debug=False,
+    qam_level=16,
+    prbs_order=None,
+    seed=None,
+    symbols=None,
+    pulse_shape=None,
+    surrogate=None,
+    travelling_wave=False,
+):
+    """Fast-path counterpart of simulate_modulation_QAM, see its parameters.
+
+    The waveforms are the same as those of simulate_modulation_QAM for the same arguments. debug is ignored.
+
+    Parameters
+    ----------
+    surrogate : dict
+        Fitted arm parameters of the DUT. Defaults to the surrogate of its CircuitModel, or to a new fit at
+        center_wavelength (see surrogate.fit_surrogate).
+    travelling_wave : bool
+        Model the electrode as a travelling-wave line with the RF parameters of the CircuitModel (see
+        electrode.electrode_fir) instead of a low-pass of its bandwidth.
+
+    Returns
+    -------
+    FastResults with the signals src_in, sig_i, sig_q and out.
+
+    """
+    dt, t1, opt_in, drive_i, drive_q = qam_waveforms(
+        mod_amplitude_i=mod_amplitude_i,
+        mod_noise_i=mod_noise_i,
+        mod_amplitude_q=mod_amplitude_q,
+        mod_noise_q=mod_noise_q,
+        opt_amplitude=opt_amplitude,
+        opt_noise=opt_noise,
+        bit_rate=bit_rate,
+        n_bytes=n_bytes,
+        steps_per_bit=steps_per_bit,
+        qam_level=qam_level,
+        prbs_order=prbs_order,
+        seed=seed,
+        symbols=symbols,
+        pulse_shape=pulse_shape,
+    )
+    cm = cell.CircuitModel()
+    if surrogate is None:
+        surrogate = cm.surrogate or fit_surrogate(cell, center_wavelength)
+    biases = dict(v_heater_i=v_heater_i, v_heater_q=v_heater_q, v_mzm_left1=v_mzm_left1, v_mzm_left2=v_mzm_left2,
+                  v_mzm_right1=v_mzm_right1, v_mzm_right2=v_mzm_right2)
+    electrode_taps = electrode_fir(cell, dt) if travelling_wave else None
+    out = fast_time_response(surrogate, opt_in, drive_i, drive_q, dt, cm.bandwidth, center_wavelength, biases,
+                             electrode_taps)
+    signals = {"src_in": opt_in, "sig_i": drive_i, "sig_q": drive_q, "out": out}
+    return FastResults(signals, dt * np.arange(out.shape[0]))
+
+
+def cross_check(cell, tolerance: float = 1e-2, skip_time: float = 0.0, **recipe_arguments) -> float:
+    """Compare the fast path with the circuit simulation of the same recipe.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator with a combined output.
+    tolerance : float
+        Largest accepted deviation.
+    skip_time : float
+        Time [s] at the start of the signals that is left out of the comparison.
+    recipe_arguments :
+        Arguments of simulate_modulation_QAM, e.g. a short pattern with n_bytes=2**8.
+
+    Returns
+    -------
+    RMS deviation of the optical output of the fast path from get_time_response, relative to the RMS of the output.
+
+    """
+    reference = np.asarray(simulate_modulation_QAM(cell, **recipe_arguments)["out"])
+    fast = simulate_modulation_QAM_fast(cell, **recipe_arguments)
+    start = int(np.searchsorted(fast.timesteps, skip_time))
+    n_samples = min(reference.shape[0], fast["out"].shape[0])
+    reference, out = reference[start:n_samples], fast["out"][start:n_samples]
+    deviation = float(np.sqrt(np.mean(np.abs(out - reference) ** 2) / np.mean(np.abs(reference) ** 2)))
+    if deviation > tolerance:
+        raise RuntimeError("The fast path deviates by {:.3g} from the circuit simulation, more than {:.3g}".format(
+            deviation, tolerance))
+    return deviation
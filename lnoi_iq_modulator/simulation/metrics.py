@@ -0,0 +1,307 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Figures of merit of a modulated link: BER, SER, EVM, MER, SNR and Q-factor.
+
+The received symbols (one sample per symbol, see sampling.sample_symbols) are compared with the transmitted symbols
+(the SymbolStream passed to the recipes, see benches.mapping):
+
+1. the latency is found by cross-correlating the received and transmitted symbols (FFT based), including the
+   mirrored constellation that a -90 degree I/Q phase gives;
+2. the complex gain and offset of the link are removed with a least-squares fit on the aligned symbols;
+3. the symbols are decided with Gray slicers (PAM, QAM, PSK) and compared with the reference. nearest_symbols gives
+   minimum-distance decisions for other constellations.
+
+Everything is vectorized over the symbols and over a batch of runs, so a sweep can be scored in one call:
+
+    symbols = random_symbols(n_symbols, "qam", 16, rng=NoiseBank(seed).generator("bits"))
+    results = simulate_modulation_QAM(cell=iq_mod, symbols=symbols, ...)
+    metrics = link_metrics(sample_symbols(results["out"], samples_per_symbol, None), symbols)
+    print(metrics.ber, metrics.evm_rms, metrics.q_factor)
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .benches.mapping import MODULATIONS, _bits_per_symbol, gray_code, map_bits
+
+DECISION_CHUNK = 2**16
+
+
+def constellation(modulation: str = "qam", order: int = 16, phase_offset: float = None) -> np.ndarray:
+    """Constellation points of a modulation, indexed by their Gray label, see benches.mapping.map_bits."""
+    bits_per_symbol = _bits_per_symbol(order)
+    labels = np.arange(order)
+    bits = (labels[:, None] >> np.arange(bits_per_symbol - 1, -1, -1)) & 1
+    return map_bits(bits.ravel(), modulation=modulation, order=order, phase_offset=phase_offset).symbols
+
+
+def _slice_pam(values, n_bits):
+    """Gray labels of the nearest of the 2**n_bits levels between -1 and 1."""
+    n_levels = 2**n_bits
+    positions = np.clip(np.rint((values + 1.0) * (n_levels - 1) / 2.0), 0, n_levels - 1).astype(np.int64)
+    return gray_code(positions)
+
+
+def decide(samples, modulation: str = "qam", order: int = 16, phase_offset: float = None) -> np.ndarray:
+    """Gray labels of the decided symbols, with per-axis slicers for PAM and QAM and a phase slicer for PSK.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        Received symbols, normalized to the constellation of map_bits.
+    modulation : str
+        "pam", "psk" or "qam".
+    order : int
+        Number of constellation points.
+    phase_offset : float
+        Phase of the first PSK symbol [rad], see map_bits.
+
+    Returns
+    -------
+    Integer array of labels, of the shape of samples.
+
+    """
+    if modulation not in MODULATIONS:
+        raise ValueError("Unknown modulation {}, choose from {}".format(modulation, MODULATIONS))
+    samples = np.asarray(samples)
+    bits_per_symbol = _bits_per_symbol(order)
+    if modulation == "pam":
+        return _slice_pam(samples.real, bits_per_symbol)
+    if modulation == "psk":
+        if phase_offset is None:
+            phase_offset = np.pi / 4 if order == 4 else 0.0
+        positions = np.rint((np.angle(samples) - phase_offset) * order / (2 * np.pi)).astype(np.int64) % order
+        return gray_code(positions)
+    bits_q = (bits_per_symbol + 1) // 2
+    return (_slice_pam(samples.real, bits_per_symbol - bits_q) << bits_q) | _slice_pam(samples.imag, bits_q)
+
+
+def nearest_symbols(samples, points) -> np.ndarray:
+    """Index of the nearest constellation point of every sample (minimum-distance decision), for any
+    constellation. The distances are computed in chunks of DECISION_CHUNK samples."""
+    samples = np.asarray(samples)
+    points = np.asarray(points)
+    flat = samples.ravel()
+    indices = np.empty(flat.shape[0], dtype=np.int64)
+    for start in range(0, flat.shape[0], DECISION_CHUNK):
+        chunk = flat[start:start + DECISION_CHUNK]
+        indices[start:start + DECISION_CHUNK] = np.argmin(np.abs(chunk[:, None] - points[None, :]), axis=1)
+    return indices.reshape(samples.shape)
+
+
+def align_symbols(received, reference, max_lag: int = None):
+    """Latency and orientation of the received symbols, from their cross-correlation with the reference.
+
+    Parameters
+    ----------
+    received : np.ndarray
+        Received symbols, of shape (n_symbols,) or (n_runs, n_symbols).
+    reference : np.ndarray
+        Transmitted symbols.
+    max_lag : int
+        Largest latency searched for [symbols], in both directions. Defaults to any overlap.
+
+    Returns
+    -------
+    Tuple of the lag of every run (received[k] is reference[k - lag]) and whether its constellation is mirrored
+    (the conjugate of the reference).
+
+    """
+    received = np.atleast_2d(received)
+    reference = np.asarray(reference)
+    n_fft = 1 << int(np.ceil(np.log2(received.shape[1] + reference.shape[0] - 1)))
+    spectrum = np.fft.fft(received - received.mean(axis=1, keepdims=True), n_fft, axis=1)
+    centered = reference - reference.mean()
+    correlations = np.stack([
+        np.abs(np.fft.ifft(spectrum * np.conj(np.fft.fft(centered, n_fft)), axis=1)),
+        np.abs(np.fft.ifft(spectrum * np.conj(np.fft.fft(np.conj(centered), n_fft)), axis=1)),
+    ])
+    lags = np.arange(n_fft)
+    lags = np.where(lags > n_fft // 2, lags - n_fft, lags)
+    if max_lag is not None:
+        correlations[:, :, np.abs(lags) > max_lag] = 0.0
+    mirrored, best = np.unravel_index(
+        np.argmax(correlations.transpose(1, 0, 2).reshape(received.shape[0], -1), axis=1), (2, n_fft)
+    )
+    return lags[best], mirrored.astype(bool)
+
+
+def _labels_to_bits(labels, bits_per_symbol):
+    return (labels[..., None] >> np.arange(bits_per_symbol - 1, -1, -1)) & 1
+
+
+class LinkMetrics(object):
+    """Figures of merit of one run, or of every run of a batch (then every attribute is an array).
+
+    Attributes
+    ----------
+    ber : float
+        Bit error ratio.
+    ser : float
+        Symbol error ratio.
+    evm_rms : float
+        RMS error vector to the transmitted symbols, relative to the RMS amplitude of the constellation.
+    evm_peak : float
+        Largest error vector, relative to the peak amplitude of the constellation.
+    mer_db : float
+        Modulation error ratio [dB]: power of the decided symbols over the power of the error to them.
+    snr_db : float
+        Data-aided SNR [dB]: power of the transmitted symbols over the power of the error to them.
+    q_factor : float
+        Smallest Q-factor, (mu_1 - mu_0) / (sigma_1 + sigma_0), over the neighbouring levels of the I and Q axes
+        (NaN for PSK beyond QPSK).
+    lag : int
+        Latency of the received symbols [symbols], see align_symbols.
+    mirrored : bool
+        Whether the received constellation is mirrored.
+    gain : complex
+        Complex gain of the link, removed before the decisions.
+    n_symbols : int
+        Number of compared symbols.
+    n_bit_errors : int
+        Number of bit errors.
+    """
+
+    FIELDS = ("ber", "ser", "evm_rms", "evm_peak", "mer_db", "snr_db", "q_factor", "lag", "mirrored", "gain",
+              "n_symbols", "n_bit_errors")
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields[name])
+
+    def to_dict(self):
+        return OrderedDict((name, getattr(self, name)) for name in self.FIELDS)
+
+    def __repr__(self):
+        return "LinkMetrics(ber={}, ser={}, evm_rms={}, mer_db={}, q_factor={})".format(
+            self.ber, self.ser, self.evm_rms, self.mer_db, self.q_factor
+        )
+
+
+def _q_factor(values, levels, weights):
+    """Smallest Q-factor between neighbouring reference levels, per run. values, levels and weights are
+    (n_runs, n_symbols) arrays; levels are the reference values of the axis."""
+    # PSK levels computed with exp() differ in the last digits
+    levels = np.round(levels, 9)
+    unique = np.unique(levels[weights > 0])
+    if unique.shape[0] < 2:
+        return np.full(values.shape[0], np.nan)
+    index = np.searchsorted(unique, levels) + unique.shape[0] * np.arange(values.shape[0])[:, None]
+    n_bins = unique.shape[0] * values.shape[0]
+    count = np.bincount(index.ravel(), weights.ravel(), n_bins)
+    mean = np.bincount(index.ravel(), (weights * values).ravel(), n_bins) / np.maximum(count, 1)
+    square = np.bincount(index.ravel(), (weights * values**2).ravel(), n_bins) / np.maximum(count, 1)
+    mean = mean.reshape(values.shape[0], -1)
+    sigma = np.sqrt(np.maximum(square.reshape(values.shape[0], -1) - mean**2, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        q = np.diff(mean, axis=1) / (sigma[:, 1:] + sigma[:, :-1])
+    return np.min(q, axis=1)
+
+
+def link_metrics(
+    received,
+    reference,
+    modulation: str = None,
+    order: int = None,
+    phase_offset: float = None,
+    max_lag: int = None,
+) -> LinkMetrics:
+    """BER, SER, EVM, MER, SNR and Q-factor of received symbols.
+
+    Parameters
+    ----------
+    received : np.ndarray
+        Received symbols, one sample per symbol, of shape (n_symbols,) or (n_runs, n_symbols) for a batch of runs
+        with the same transmitted symbols.
+    reference : SymbolStream or np.ndarray
+        Transmitted symbols. With a SymbolStream, its modulation, order and bits are used. With an array of
+        constellation points, modulation and order must be given.
+    modulation : str
+        "pam", "psk" or "qam".
+    order : int
+        Number of constellation points.
+    phase_offset : float
+        Phase of the first PSK symbol [rad], see benches.mapping.map_bits.
+    max_lag : int
+        Largest latency searched for [symbols], see align_symbols.
+
+    Returns
+    -------
+    LinkMetrics, with arrays of one value per run for 2D received symbols.
+
+    """
+    if hasattr(reference, "symbols"):
+        modulation = modulation or reference.modulation
+        order = order or reference.order
+        reference_labels = reference.labels
+        reference = reference.symbols
+    else:
+        if modulation is None or order is None:
+            raise ValueError("The modulation and order are needed when the reference is an array of symbols")
+        reference = np.asarray(reference)
+        reference_labels = decide(reference, modulation, order, phase_offset)
+    batch = np.ndim(received) == 2
+    received = np.atleast_2d(np.asarray(received))
+    points = constellation(modulation, order, phase_offset)
+    bits_per_symbol = _bits_per_symbol(order)
+
+    # Align every run on the reference; symbols outside the overlap get a zero weight
+    lag, mirrored = align_symbols(received, reference, max_lag)
+    index = np.arange(received.shape[1])[None, :] - lag[:, None]
+    weights = ((index >= 0) & (index < reference.shape[0])).astype(float)
+    index = np.clip(index, 0, reference.shape[0] - 1)
+    expected = np.where(mirrored[:, None], np.conj(reference[index]), reference[index])
+    expected_labels = reference_labels[index]
+
+    # Least-squares fit of received = gain * expected + offset, then normalize
+    n = weights.sum(axis=1)
+    s_rr = np.sum(weights * np.abs(expected) ** 2, axis=1)
+    s_r = np.sum(weights * expected, axis=1)
+    s_xr = np.sum(weights * received * np.conj(expected), axis=1)
+    s_x = np.sum(weights * received, axis=1)
+    determinant = s_rr * n - np.abs(s_r) ** 2
+    gain = (s_xr * n - s_x * np.conj(s_r)) / determinant
+    offset = (s_x - gain * s_r) / n
+    normalized = (received - offset[:, None]) / gain[:, None]
+    normalized = np.where(mirrored[:, None], np.conj(normalized), normalized)
+    expected = np.where(mirrored[:, None], np.conj(expected), expected)
+
+    labels = decide(normalized, modulation, order, phase_offset)
+    symbol_errors = np.sum(weights * (labels != expected_labels), axis=1)
+    wrong_bits = _labels_to_bits(labels, bits_per_symbol) != _labels_to_bits(expected_labels, bits_per_symbol)
+    bit_errors = np.sum(weights[:, :, None] * wrong_bits, axis=(1, 2))
+
+    reference_power = np.sum(weights * np.abs(expected) ** 2, axis=1) / n
+    error = np.abs(normalized - expected)
+    error_power = np.sum(weights * error**2, axis=1) / n
+    decided = points[labels]
+    decision_error_power = np.sum(weights * np.abs(normalized - decided) ** 2, axis=1) / n
+    decided_power = np.sum(weights * np.abs(decided) ** 2, axis=1) / n
+
+    if modulation == "psk" and order > 4:
+        q_factor = np.full(received.shape[0], np.nan)
+    else:
+        q_factor = _q_factor(normalized.real, expected.real, weights)
+        if modulation != "pam":
+            q_factor = np.fmin(q_factor, _q_factor(normalized.imag, expected.imag, weights))
+
+    with np.errstate(divide="ignore"):
+        fields = dict(
+            ber=bit_errors / (n * bits_per_symbol),
+            ser=symbol_errors / n,
+            evm_rms=np.sqrt(error_power / reference_power),
+            evm_peak=np.max(weights * error, axis=1) / np.max(np.abs(points)),
+            mer_db=10 * np.log10(decided_power / decision_error_power),
+            snr_db=10 * np.log10(reference_power / error_power),
+            q_factor=q_factor,
+            lag=lag,
+            mirrored=mirrored,
+            gain=gain,
+            n_symbols=n.astype(np.int64),
+            n_bit_errors=bit_errors.astype(np.int64),
+        )
+    if not batch:
+        fields = {name: value[0].item() for name, value in fields.items()}
+    return LinkMetrics(**fields)
@@ -0,0 +1,38 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Vectorized derotation of sampled optical fields for constellation plots.
+
+Each function takes the complex samples as an array (or anything np.asarray accepts) and rotates all of them in a
+single pass, returning an ndarray. The quadrant-based rotations only need the signs of the real and imaginary parts,
+so no trigonometric function is evaluated per sample.
+
+The simulation_2 recipes import this module as lnoi_iq_modulator.simulation.postprocessing.
+"""
+
+import numpy as np
+
+
+def derotate_amplitude(samples) -> np.ndarray:
+    """Rotate every sample onto the positive real axis (OOK, ASK and PAM), i.e. keep its amplitude."""
+    return np.abs(np.asarray(samples)).astype(complex)
+
+
+def derotate_bpsk(samples) -> np.ndarray:
+    """Rotate every sample onto the real axis, on the side of its half-plane: samples in the right half-plane
+    (|phase| < pi / 2) to +|sample|, the others to -|sample|."""
+    samples = np.asarray(samples)
+    return np.where(samples.real >= 0, 1.0, -1.0) * np.abs(samples) + 0j
+
+
+def derotate_qpsk(samples) -> np.ndarray:
+    """Rotate every sample onto the diagonal of its quadrant (phase pi / 4, 3 pi / 4, -3 pi / 4 or -pi / 4)."""
+    samples = np.asarray(samples)
+    diagonal = np.where(samples.real >= 0, 1.0, -1.0) + 1j * np.where(samples.imag >= 0, 1.0, -1.0)
+    return np.abs(samples) * np.sqrt(0.5) * diagonal
+
+
+def derotate_mean_phase(samples) -> np.ndarray:
+    """Rotate all samples by their mean phase (QAM)."""
+    samples = np.asarray(samples)
+    return samples * np.exp(-1j * np.mean(np.angle(samples)))
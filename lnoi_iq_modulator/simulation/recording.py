@@ -0,0 +1,123 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Selective recording of time-domain results: which signals to keep, at which samples, and with which precision.
+
+A RecordingSpec is applied to the results of every run (or every window of a streaming run), so only the recorded
+samples outlive the solver output. For instance, keeping one sample per symbol of the optical output of a 16-QAM run
+with 2**12 symbols stores 4096 samples instead of every step of every source and probe:
+
+    recording = RecordingSpec(out=ProbeRecording(decimation=sps, offset=int(sps * (10 + sampling_point))),
+                              complex64=True)
+    results = sim.run(t1=t1, dt=dt, center_wavelength=1.55, recording=recording)
+    constellation = results["out"]
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ProbeRecording(object):
+    """Samples to record of one signal.
+
+    Parameters
+    ----------
+    decimation : int
+        Keep one sample out of decimation.
+    offset : int
+        Index of the first recorded sample.
+    instants : np.ndarray
+        Explicit sample indices to record, instead of offset and decimation.
+    """
+
+    def __init__(self, decimation: int = 1, offset: int = 0, instants=None):
+        if decimation < 1:
+            raise ValueError("The decimation must be at least 1, got {}".format(decimation))
+        self.decimation = int(decimation)
+        self.offset = int(offset)
+        self.instants = None if instants is None else np.unique(np.asarray(instants, dtype=np.int64))
+
+    def indices(self, start: int, n_samples: int) -> np.ndarray:
+        """Indices, relative to start, of the recorded samples among the samples [start, start + n_samples)."""
+        if self.instants is not None:
+            lo, hi = np.searchsorted(self.instants, [start, start + n_samples])
+            return self.instants[lo:hi] - start
+        first = self.offset - start
+        if first < 0:
+            first %= self.decimation
+        return np.arange(first, n_samples, self.decimation)
+
+
+class RecordedResults(object):
+    """Recorded signals, each with the time of its samples.
+
+    Parameters
+    ----------
+    signals : dict
+        Recorded samples keyed on the signal name.
+    timesteps : dict
+        Time [s] of the recorded samples, keyed on the signal name.
+    """
+
+    def __init__(self, signals, timesteps):
+        self.signals = signals
+        self.timesteps = timesteps
+
+    def __getitem__(self, name):
+        return self.signals[name]
+
+    def __contains__(self, name):
+        return name in self.signals
+
+    def keys(self):
+        return self.signals.keys()
+
+
+class RecordingSpec(object):
+    """Signals to record and how.
+
+    Parameters
+    ----------
+    complex64 : bool
+        If True, complex signals are stored in single precision and real signals as float32.
+    probes :
+        Signal name to a ProbeRecording, or to an int decimation factor. Signals that are not listed are dropped.
+    """
+
+    def __init__(self, complex64: bool = False, **probes):
+        self.complex64 = complex64
+        self.probes = OrderedDict(
+            (name, recording if isinstance(recording, ProbeRecording) else ProbeRecording(decimation=recording))
+            for name, recording in probes.items()
+        )
+
+    def _select(self, values, indices) -> np.ndarray:
+        selected = np.asarray(values)[indices]
+        if self.complex64:
+            selected = selected.astype(np.complex64 if np.iscomplexobj(selected) else np.float32)
+        return selected
+
+    def apply(self, results, start: int = 0) -> RecordedResults:
+        """Recorded part of a time response (or of a window of a streaming run starting at sample start)."""
+        timesteps = np.asarray(results.timesteps)
+        signals, times = OrderedDict(), OrderedDict()
+        for name, recording in self.probes.items():
+            indices = recording.indices(start, timesteps.shape[0])
+            signals[name] = self._select(results[name], indices)
+            times[name] = timesteps[indices]
+        return RecordedResults(signals, times)
+
+    def collect(self, windows) -> RecordedResults:
+        """Record the windows of a streaming run (see stream_time_response) and join them."""
+        signals = OrderedDict((name, []) for name in self.probes)
+        times = OrderedDict((name, []) for name in self.probes)
+        for window in windows:
+            recorded = self.apply(window, start=window.start)
+            for name in self.probes:
+                signals[name].append(recorded.signals[name])
+                times[name].append(recorded.timesteps[name])
+        return RecordedResults(
+            OrderedDict((name, np.concatenate(chunks)) for name, chunks in signals.items()),
+            OrderedDict((name, np.concatenate(chunks)) for name, chunks in times.items()),
+        )
@@ -0,0 +1,270 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Content-addressed cache of simulation results on disk.
+
+A recipe call is identified by a hash of the recipe and its code version (see recipe_version), the DUT (class, name
+and the properties of dut_parameters), and every other argument: excitation amplitudes, seeds, symbol streams, pulse
+shapes and solver settings. A repeated call returns the stored results (see result_store.StoredResults) instead of
+re-simulating, until the code of the recipe or of the modules it builds its waveforms with changes. The least recently
+used entries are evicted when the cache grows over its size limit, and the stored results handed out for them are
+closed first.
+
+    simulate = cached_recipe(simulate_modulation_QAM, outputs=("sig_i", "sig_q", "src_in", "out"))
+    results = simulate(cell=iq_mod, seed=1, ...)   # simulated and stored
+    results = simulate(cell=iq_mod, seed=1, ...)   # read back from disk
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+import types
+import weakref
+
+import numpy as np
+
+from .result_store import default_backend, open_results, run_metadata, save_results
+from .testbench import dut_parameters
+
+CACHE_DIRECTORY = ".simulation_cache"
+CACHE_MAX_BYTES = 2**32
+
+_INDEX_FILE = "index.json"
+
+
+def _code_digest(code):
+    """Digest of a code object: its bytecode, constants (nested functions included) and names."""
+    digest = hashlib.sha1(code.co_code)
+    for const in code.co_consts:
+        digest.update((_code_digest(const) if isinstance(const, types.CodeType) else repr(const)).encode())
+    digest.update(repr(code.co_names).encode())
+    return digest.hexdigest()
+
+
+def canonical(value):
+    """JSON-serializable form of a parameter value, with arrays replaced by a digest of their content and functions
+    (e.g. a frequency-dependent alpha_rf) by a digest of their code, defaults and closure."""
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return {"__array__": [value.dtype.str, list(value.shape), hashlib.sha1(value.view(np.uint8)).hexdigest()]}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float):
+        return repr(value)
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    # Numba dispatchers wrap the Python function they were compiled from
+    value = getattr(value, "py_func", value)
+    if isinstance(value, types.FunctionType):
+        closure = [cell.cell_contents for cell in value.__closure__ or ()]
+        return {"__function__": [value.__module__, value.__qualname__, _code_digest(value.__code__),
+                                 canonical(value.__defaults__ or ()), canonical(closure)]}
+    if hasattr(value, "__dict__"):
+        return {"__class__": type(value).__name__, "state": canonical(vars(value))}
+    return repr(value)
+
+
+def _package_modules(module, package, found):
+    """Add module and, recursively, the modules of package whose functions or classes it uses to found."""
+    found[module.__name__] = module
+    for value in vars(module).values():
+        used = inspect.getmodule(value)
+        if used is not None and used.__name__ not in found and used.__name__.startswith(package + "."):
+            _package_modules(used, package, found)
+    return found
+
+
+def recipe_version(recipe) -> str:
+    """Digest of the code of a recipe: the source of its module and of the modules of its package it draws on
+    (testbench, waveform generation, post-processing, ...), so that editing any of them invalidates the cached results.
+
+    Parameters
+    ----------
+    recipe : callable
+        Recipe function.
+
+    Returns
+    -------
+    Hexadecimal SHA-1 digest.
+
+    """
+    module = sys.modules[recipe.__module__]
+    package = (module.__package__ or module.__name__).split(".")[0]
+    modules = _package_modules(module, package, {})
+    digest = hashlib.sha1()
+    for name in sorted(modules):
+        digest.update(name.encode())
+        digest.update(inspect.getsource(modules[name]).encode())
+    return digest.hexdigest()
+
+
+def result_key(recipe: str, cell, params, version: str = "") -> str:
+    """Hash of a recipe call.
+
+    Parameters
+    ----------
+    recipe : str
+        Name of the recipe.
+    cell : i3.PCell
+        DUT.
+    params : dict
+        Other arguments of the recipe.
+    version : str
+        Version of the code of the recipe, see recipe_version.
+
+    Returns
+    -------
+    Hexadecimal SHA-256 digest.
+
+    """
+    content = {
+        "recipe": recipe,
+        "version": version,
+        "cell": [type(cell).__name__, cell.name],
+        "dut": canonical(dict(dut_parameters(cell))),
+        "params": canonical(params),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class ResultCache(object):
+    """Directory of stored results, keyed on result_key, with LRU eviction by size.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the cache.
+    max_bytes : int
+        Size limit of the cache [bytes].
+    backend : str
+        Backend of the stored results, see result_store.ResultWriter.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, max_bytes: int = CACHE_MAX_BYTES, backend: str = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backend = backend or default_backend()
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, _INDEX_FILE)
+        self.index = {}
+        # Stored results handed out by get and put, per key, closed before their entry is removed
+        self._handles = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + (".h5" if self.backend == "hdf5" else ""))
+
+    def _save_index(self):
+        with open(os.path.join(self.directory, _INDEX_FILE), "w") as f:
+            json.dump(self.index, f, indent=2)
+
+    def __contains__(self, key):
+        return key in self.index and os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Stored results of a key, or None."""
+        if key not in self:
+            return None
+        self.index[key]["last_access"] = time.time()
+        self._save_index()
+        return self._open(key)
+
+    def put(self, key, results, names, metadata=None):
+        """Store the named signals of a time response under a key and return them as stored results."""
+        path = self._path(key)
+        save_results(path, results, names, metadata=metadata, backend=self.backend)
+        self.index[key] = {"size": _size(path), "last_access": time.time()}
+        self.evict(keep=key)
+        self._save_index()
+        return self._open(key)
+
+    def _open(self, key):
+        stored = open_results(self._path(key))
+        self._handles.setdefault(key, weakref.WeakSet()).add(stored)
+        return stored
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_access"]):
+            if self.size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+
+    def remove(self, key):
+        """Remove an entry, after closing the stored results of it that are still open."""
+        for stored in list(self._handles.pop(key, ())):
+            stored.close()
+        path = self._path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        self.index.pop(key, None)
+
+    def clear(self):
+        for key in list(self.index):
+            self.remove(key)
+        self._save_index()
+
+
+def cached_recipe(recipe, outputs, cache: ResultCache = None):
+    """Wrap a recipe function so that repeated calls with the same DUT and arguments are read from the cache.
+
+    Parameters
+    ----------
+    recipe : callable
+        Recipe, called as recipe(cell=cell, **params).
+    outputs : tuple of str
+        Signals to store (the timesteps are always stored).
+    cache : ResultCache
+        Cache to use. Defaults to a ResultCache in CACHE_DIRECTORY.
+
+    Returns
+    -------
+    Function with the signature of the recipe that returns StoredResults. Calls of a seeded recipe without a seed
+    are not cached, and return the results of the recipe. The results are keyed on the code version of the recipe
+    when it is wrapped, see recipe_version.
+
+    """
+    cache = cache or ResultCache()
+    name = "{}.{}".format(recipe.__module__.rsplit(".", 1)[-1], recipe.__name__)
+    version = recipe_version(recipe)
+    seeded = "seed" in inspect.signature(recipe).parameters
+
+    @functools.wraps(recipe)
+    def wrapper(cell, **params):
+        if seeded and params.get("seed") is None:
+            # Without a seed the noise differs from run to run, so there is nothing to reuse
+            return recipe(cell=cell, **params)
+        key = result_key(name, cell, params, version)
+        stored = cache.get(key)
+        if stored is None:
+            results = recipe(cell=cell, **params)
+            metadata = run_metadata(cell, recipe=name, version=version, params=canonical(params))
+            stored = cache.put(key, results, outputs, metadata=metadata)
+        return stored
+
+    return wrapper
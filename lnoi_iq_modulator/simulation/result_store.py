@@ -0,0 +1,278 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+On-disk store of simulation results: the timesteps and selected signals of a run, written in chunks and reopened
+lazily, so plots and metrics can slice long runs without loading them.
+
+Three backends are supported, picked in this order when available:
+
+- "hdf5" (h5py): one file, chunked and gzip-compressed datasets;
+- "zarr": a directory, chunked and compressed arrays;
+- "npy": a directory with one sub-directory of .npy chunks per signal, reopened as memory maps.
+
+The run metadata (DUT parameters, seeds, dt, center_wavelength, ...) is stored next to the signals. Signals can be
+written at once from a time response, or appended window by window from a streaming run:
+
+    with ResultWriter("run.h5", metadata=run_metadata(iq_mod, seed=seed, dt=dt, center_wavelength=1.55)) as writer:
+        for window in stream_time_response(sim, waveforms, dt=dt, center_wavelength=1.55, window_samples=2**18):
+            writer.append_window(window)
+
+    stored = open_results("run.h5")
+    plt.plot(stored.timesteps[:10000], np.abs(stored["out"][:10000]) ** 2)
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+from .testbench import dut_parameters
+
+BACKENDS = ("hdf5", "zarr", "npy")
+CHUNK_SAMPLES = 2**16
+
+_METADATA_FILE = "metadata.json"
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def run_metadata(cell=None, **params):
+    """Metadata of a run: name, class and parameters of the DUT (see dut_parameters), and any other parameters.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT.
+    params :
+        Other parameters of the run, e.g. seed, dt, center_wavelength.
+
+    Returns
+    -------
+    OrderedDict that can be serialized to JSON.
+
+    """
+    metadata = OrderedDict()
+    if cell is not None:
+        metadata["cell"] = cell.name
+        metadata["cell_class"] = type(cell).__name__
+        metadata["dut"] = dut_parameters(cell)
+    metadata.update(params)
+    return json.loads(json.dumps(metadata, default=_to_json), object_pairs_hook=OrderedDict)
+
+
+def default_backend():
+    if h5py is not None:
+        return "hdf5"
+    if zarr is not None:
+        return "zarr"
+    return "npy"
+
+
+class ResultWriter(object):
+    """Writer of the signals of a run to an on-disk store.
+
+    Parameters
+    ----------
+    path : str
+        File (hdf5) or directory (zarr, npy) of the store. An existing store is overwritten.
+    metadata : dict
+        Run metadata, see run_metadata.
+    backend : str
+        "hdf5", "zarr" or "npy". Defaults to the first one available.
+    chunk_samples : int
+        Number of samples per chunk.
+    """
+
+    def __init__(self, path: str, metadata=None, backend: str = None, chunk_samples: int = CHUNK_SAMPLES):
+        backend = backend or default_backend()
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend {}, choose from {}".format(backend, BACKENDS))
+        if backend == "hdf5" and h5py is None or backend == "zarr" and zarr is None:
+            raise ImportError("The {} backend is not installed".format(backend))
+        self.path = path
+        self.backend = backend
+        self.chunk_samples = chunk_samples
+        self.metadata = OrderedDict(metadata or {})
+        self._n_chunks = {}
+
+        if backend == "hdf5":
+            self._store = h5py.File(path, "w")
+            self._store.attrs["metadata"] = json.dumps(self.metadata, default=_to_json)
+        elif backend == "zarr":
+            self._store = zarr.open_group(path, mode="w")
+            self._store.attrs["metadata"] = json.loads(json.dumps(self.metadata, default=_to_json))
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, _METADATA_FILE), "w") as f:
+                json.dump(self.metadata, f, indent=2, default=_to_json)
+            self._store = None
+
+    def append(self, name: str, values):
+        """Append samples to a signal, creating it on the first call."""
+        values = np.ascontiguousarray(values)
+        if self.backend == "hdf5":
+            if name not in self._store:
+                self._store.create_dataset(name, shape=(0,) + values.shape[1:], maxshape=(None,) + values.shape[1:],
+                                           dtype=values.dtype, chunks=(self.chunk_samples,) + values.shape[1:],
+                                           compression="gzip", shuffle=True)
+            dataset = self._store[name]
+            dataset.resize(dataset.shape[0] + values.shape[0], axis=0)
+            dataset[-values.shape[0]:] = values
+        elif self.backend == "zarr":
+            if name not in self._store:
+                create = getattr(self._store, "create_array", None) or self._store.create_dataset
+                create(name, shape=(0,) + values.shape[1:], dtype=values.dtype,
+                       chunks=(self.chunk_samples,) + values.shape[1:])
+            self._store[name].append(values)
+        else:
+            directory = os.path.join(self.path, name)
+            index = self._n_chunks.get(name, 0)
+            if index == 0:
+                os.makedirs(directory, exist_ok=True)
+            for start in range(0, values.shape[0], self.chunk_samples):
+                np.save(os.path.join(directory, "{:06d}.npy".format(index)), values[start:start + self.chunk_samples])
+                index += 1
+            self._n_chunks[name] = index
+
+    def append_window(self, window, names=None):
+        """Append the timesteps and the signals of a window of a streaming run, see stream_time_response."""
+        self.append("timesteps", window.timesteps)
+        for name in names or window.signals:
+            self.append(name, window[name])
+
+    def write(self, results, names):
+        """Write the timesteps and the named signals of a time response.
+
+        For RecordedResults, whose signals have their own sample times, these are written as "<name>_timesteps".
+        """
+        if isinstance(results.timesteps, dict):
+            for name in names:
+                self.append("{}_timesteps".format(name), results.timesteps[name])
+        else:
+            self.append("timesteps", results.timesteps)
+        for name in names:
+            self.append(name, results[name])
+
+    def close(self):
+        if self.backend == "hdf5":
+            self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkedArray(object):
+    """Read-only 1D array over a sequence of memory-mapped .npy chunks, loading only the sliced samples."""
+
+    def __init__(self, paths):
+        self.chunks = [np.load(path, mmap_mode="r") for path in paths]
+        self.offsets = np.cumsum([0] + [chunk.shape[0] for chunk in self.chunks])
+        self.dtype = self.chunks[0].dtype if self.chunks else np.dtype(float)
+        self.shape = (int(self.offsets[-1]),) + (self.chunks[0].shape[1:] if self.chunks else ())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            indices = np.arange(*item.indices(self.shape[0]))
+        else:
+            indices = np.asarray(item)
+            if indices.ndim == 0:
+                index = int(indices) % self.shape[0]
+                chunk = np.searchsorted(self.offsets, index, side="right") - 1
+                return self.chunks[chunk][index - self.offsets[chunk]]
+            indices = np.where(indices < 0, indices + self.shape[0], indices)
+        values = np.empty((indices.shape[0],) + self.shape[1:], dtype=self.dtype)
+        chunk_of = np.searchsorted(self.offsets, indices, side="right") - 1
+        for chunk in np.unique(chunk_of):
+            selected = chunk_of == chunk
+            values[selected] = self.chunks[chunk][indices[selected] - self.offsets[chunk]]
+        return values
+
+    def __array__(self, dtype=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+
+class StoredResults(object):
+    """Lazily opened results: indexing a signal returns an array-like that is only read when sliced.
+
+    Parameters
+    ----------
+    path : str
+        File or directory of the store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.isfile(path):
+            if h5py is None:
+                raise ImportError("h5py is needed to open {}".format(path))
+            self._store = h5py.File(path, "r")
+            self.metadata = json.loads(self._store.attrs["metadata"], object_pairs_hook=OrderedDict)
+            self._names = list(self._store.keys())
+        elif os.path.exists(os.path.join(path, _METADATA_FILE)):
+            self._store = None
+            with open(os.path.join(path, _METADATA_FILE)) as f:
+                self.metadata = json.load(f, object_pairs_hook=OrderedDict)
+            self._names = sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+        else:
+            if zarr is None:
+                raise ImportError("zarr is needed to open {}".format(path))
+            self._store = zarr.open_group(path, mode="r")
+            self.metadata = OrderedDict(self._store.attrs["metadata"])
+            self._names = sorted(self._store.array_keys())
+
+    def keys(self):
+        return list(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError("No signal {} in {}, its signals are {}".format(name, self.path, self._names))
+        if self._store is not None:
+            return self._store[name]
+        directory = os.path.join(self.path, name)
+        return ChunkedArray([os.path.join(directory, f) for f in sorted(os.listdir(directory))])
+
+    @property
+    def timesteps(self):
+        return self["timesteps"]
+
+    def close(self):
+        if h5py is not None and isinstance(self._store, h5py.File):
+            self._store.close()
+
+
+def open_results(path: str) -> StoredResults:
+    """Reopen a store written by ResultWriter, see StoredResults."""
+    return StoredResults(path)
+
+
+def save_results(path: str, results, names, metadata=None, backend: str = None):
+    """Write the timesteps and the named signals of a time response to a new store, see ResultWriter.write."""
+    with ResultWriter(path, metadata=metadata, backend=backend) as writer:
+        writer.write(results, names)
@@ -0,0 +1,99 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Symbol-synchronous sampling of time-domain results.
+
+The optical output is sampled once per symbol, at a fixed fraction of the symbol period, after skipping the first
+symbols while the modulator settles. Without a sample count this is a strided slice, so ndarrays and memory-mapped
+results (np.memmap, result_store.StoredResults) return a view and nothing is copied. With a sample count, a seeded
+random subset of the symbols is picked and only those samples are read:
+
+    constellation = sample_symbols(results["out"], samples_per_symbol, sampling_point=0.9, n_symbols=200, seed=1)
+
+With sampling_point=None the sampling point is searched for on the signal, see timing.optimal_sampling_point.
+
+The simulation_2 recipes import this module as lnoi_iq_modulator.simulation.sampling.
+"""
+
+import numpy as np
+
+SKIP_SYMBOLS = 10
+
+
+def symbol_offset(samples_per_symbol: int, sampling_point: float = 0.5, skip_symbols: int = SKIP_SYMBOLS) -> int:
+    """Index of the first sampled sample: sampling_point of the way into symbol skip_symbols."""
+    return int(samples_per_symbol * (skip_symbols + sampling_point))
+
+
+def symbol_indices(
+    n_samples: int,
+    samples_per_symbol: int,
+    sampling_point: float = 0.5,
+    skip_symbols: int = SKIP_SYMBOLS,
+    n_symbols: int = None,
+    seed=None,
+) -> np.ndarray:
+    """Sample indices of the symbols of a signal.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples of the signal.
+    samples_per_symbol : int
+        Number of samples per symbol.
+    sampling_point : float
+        Fraction of the symbol period at which the symbols are sampled.
+    skip_symbols : int
+        Number of symbols skipped at the start of the signal.
+    n_symbols : int
+        If given, a random subset of n_symbols symbols is picked, otherwise every symbol is kept.
+    seed : int or numpy.random.Generator
+        Seed of the subset.
+
+    Returns
+    -------
+    Increasing array of sample indices.
+
+    """
+    offset = symbol_offset(samples_per_symbol, sampling_point, skip_symbols)
+    n_available = max(0, (n_samples - offset + samples_per_symbol - 1) // samples_per_symbol)
+    symbols = np.arange(n_available)
+    if n_symbols is not None and n_symbols < n_available:
+        symbols = np.sort(np.random.default_rng(seed).choice(n_available, size=n_symbols, replace=False))
+    return offset + symbols * samples_per_symbol
+
+
+def sample_symbols(
+    values,
+    samples_per_symbol: int,
+    sampling_point: float = 0.5,
+    skip_symbols: int = SKIP_SYMBOLS,
+    n_symbols: int = None,
+    seed=None,
+):
+    """Symbol-synchronous samples of a signal, see symbol_indices.
+
+    Parameters
+    ----------
+    values : array-like
+        Samples of the signal: an ndarray, an np.memmap, or a signal of result_store.StoredResults.
+    sampling_point : float
+        Fraction of the symbol period at which the symbols are sampled. If None, it is searched for with
+        timing.optimal_sampling_point.
+
+    Returns
+    -------
+    The sampled values. Without n_symbols, this is a strided view of an ndarray or memory map.
+
+    """
+    if sampling_point is None:
+        from .timing import optimal_sampling_point
+
+        sampling_point = optimal_sampling_point(values, samples_per_symbol, skip_symbols)
+    if n_symbols is None:
+        return values[symbol_offset(samples_per_symbol, sampling_point, skip_symbols)::samples_per_symbol]
+    indices = symbol_indices(len(values), samples_per_symbol, sampling_point, skip_symbols, n_symbols, seed)
+    if hasattr(values, "oindex"):
+        # zarr arrays only take integer arrays through orthogonal indexing
+        return values.oindex[indices]
+    return values[indices]
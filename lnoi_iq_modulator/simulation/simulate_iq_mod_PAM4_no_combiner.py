@@ -4,12 +4,46 @@
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
 
-import random
+from .testbench import build_testbench
+from .benches.noise import NoiseBank
+from .benches.sources import random_levels
+from .benches.prbs import prbs_levels
+from .benches.pulse_shaping import shape_drive
+from .postprocessing import derotate_amplitude
+from .sampling import sample_symbols
 
-import numpy as np
 
-import ipkiss3.all as i3
-from si_fab.benches.sources import random_bitsource, rand_normal
+def prepare_testbench(cell):
+    """Testbench of simulate_modulation_PAM4 on an IQ modulator, see testbench.build_testbench.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+
+    Returns
+    -------
+    PreparedSimulation
+
+    """
+    return build_testbench(
+        cell,
+        sources={
+            "src_in": "in",
+            "sig_i": "top_signal",
+            "sig_q": "bottom_signal",
+        },
+        probes={"top_out": "top_out", "bottom_out": "bottom_out"},
+        # DC biases; all other electrical ports are grounded
+        biases={
+            "ht_i": "mzm_1_ps_out_in",
+            "ht_q": "mzm_2_ps_out_in",
+            "mzm_left1": "mzm_1_ps_1_in",
+            "mzm_left2": "mzm_1_ps_2_in",
+            "mzm_right1": "mzm_2_ps_1_in",
+            "mzm_right2": "mzm_2_ps_2_in",
+        },
+    )
 
 
 def simulate_modulation_PAM4(
@@ -31,6 +65,11 @@ def simulate_modulation_PAM4(
     steps_per_bit=50,
     center_wavelength=1.5,
     debug=False,
+    prbs_order=None,
+    seed=None,
+    symbols=None,
+    pulse_shape=None,
+    simulation=None,
 ):
     """
     Simulation recipe to simulate an IQ modulator.
@@ -73,6 +112,21 @@ def simulate_modulation_PAM4(
         Center wavelength of the optical carrier.
     debug : bool
         If True, the simulation is run in debug mode.
+    prbs_order : int
+        If given, the symbols are taken from an ITU PRBS of this order (7, 9, 11, 15, 23 or 31) instead of random
+        draws, which gives repeatable, standards-compliant stress patterns.
+    seed : int
+        Seed of the noise and symbol streams. Every port draws from its own stream, so a run is reproducible for a
+        given seed, also across processes.
+    symbols : SymbolStream
+        Precomputed Gray-coded symbols (see benches.mapping) whose real and imaginary parts drive the I and Q
+        tributaries. n_bytes is set to their length; keep them as the reference for BER/SER/EVM.
+    pulse_shape : PulseShape
+        Pulse shape of the DAC/driver (see benches.pulse_shaping), e.g. PulseShape("rrc", roll_off=0.2,
+        bandwidth=35e9). Defaults to ideal rectangular NRZ.
+    simulation : PreparedSimulation
+        Testbench from prepare_testbench to bind and run, e.g. held by a batch worker. Defaults to the cached
+        testbench of cell.
 
     Returns
     -------
@@ -80,115 +134,43 @@ def simulate_modulation_PAM4(
 
     """
 
-    # Define the excitations with noise on the electrical
-    f_mod_i = random_bitsource(
-        bitrate=bit_rate,
-        amplitude=mod_amplitude_i,
-        n_bytes=n_bytes,
-    )
-    f_mod_q = random_bitsource(
-        bitrate=bit_rate,
-        amplitude=mod_amplitude_q,
-        n_bytes=n_bytes,
-    )
-    # f_mod_i2 = random_bitsource(
-    #     bitrate=bit_rate,
-    #     amplitude=mod_amplitude_i / 2,
-    #     n_bytes=n_bytes,
-    # )
-    # f_mod_q2 = random_bitsource(
-    #     bitrate=bit_rate,
-    #     amplitude=mod_amplitude_q / 2,
-    #     n_bytes=n_bytes,
-    # )
-    rand_normal_dist = rand_normal()
-    src_in = i3.FunctionExcitation(
-        port_domain=i3.OpticalDomain, excitation_function=lambda t: opt_amplitude + rand_normal_dist(opt_noise)
-    )
-    signal_i = i3.FunctionExcitation(
-        port_domain=i3.ElectricalDomain, excitation_function=lambda t: f_mod_i(t) + rand_normal_dist(mod_noise_i)
-    )
-    # revsignal_i = i3.FunctionExcitation(
-    #     port_domain=i3.ElectricalDomain, excitation_function=lambda t: -f_mod_i2(t) - rand_normal_dist(mod_noise_i)
-    # )
-    signal_q = i3.FunctionExcitation(
-        port_domain=i3.ElectricalDomain, excitation_function=lambda t: f_mod_q(t) + rand_normal_dist(mod_noise_q)
-    )
-    # revsignal_q = i3.FunctionExcitation(
-    #     port_domain=i3.ElectricalDomain, excitation_function=lambda t: -f_mod_q2(t) - rand_normal_dist(mod_noise_q)
-    # )
-    heater_i = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_heater_i)
-    heater_q = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_heater_q)
-    mzm_left1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_left1)
-    mzm_left2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_left2)
-    mzm_right1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_right1)
-    mzm_right2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_right2)
-    gnd1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd3 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd4 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd5 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd6 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd7 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd8 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd9 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-
+    # Define the excitations with noise on the electrical.
+    # The drive and noise are sampled once on the simulation time base and played back by the solver.
+    if symbols is not None:
+        n_bytes = len(symbols)
     t0 = 0.0
     t1 = n_bytes / bit_rate
     dt = t1 / n_bytes / steps_per_bit
-
-    testbench = i3.ConnectComponents(
-        child_cells={
-            "DUT": cell,
-            "top_out": i3.Probe(port_domain=i3.OpticalDomain),
-            "bottom_out": i3.Probe(port_domain=i3.OpticalDomain),
-            "src_in": src_in,
-            "sig_i": signal_i,
-            # "revsig_i": revsignal_i,
-            "sig_q": signal_q,
-            # "revsig_q": revsignal_q,
-            "gnd1": gnd1,
-            "gnd2": gnd2,
-            "gnd3": gnd3,
-            "gnd4": gnd4,
-            "gnd5": gnd5,
-            "gnd6": gnd6,
-            "gnd7": gnd7,
-            "gnd8": gnd8,
-            "gnd9": gnd9,
-            "ht_i": heater_i,
-            "ht_q": heater_q,
-            "mzm_left1": mzm_left1,
-            "mzm_left2": mzm_left2,
-            "mzm_right1": mzm_right1,
-            "mzm_right2": mzm_right2,
-        },
-        links=[
-            ("src_in:out", "DUT:in"),
-            ("DUT:top_out", "top_out:in"),
-            ("DUT:bottom_out", "bottom_out:in"),
-            ("DUT:mzm_1_ps_out_in", "ht_i:out"),
-            ("DUT:mzm_2_ps_out_in", "ht_q:out"),
-            ("DUT:mzm_1_ps_1_in", "mzm_left1:out"),
-            ("DUT:mzm_1_ps_2_in", "mzm_left2:out"),
-            ("DUT:mzm_2_ps_1_in", "mzm_right1:out"),
-            ("DUT:mzm_2_ps_2_in", "mzm_right2:out"),
-            ("DUT:top_signal", "sig_i:out"),
-            ("DUT:bottom_signal", "sig_q:out"),
-            ("DUT:mzm_1_ps_out_gnd", "gnd1:out"),
-            ("DUT:mzm_2_ps_out_gnd", "gnd2:out"),
-            ("DUT:mzm_1_ps_1_gnd", "gnd3:out"),
-            ("DUT:mzm_1_ps_2_gnd", "gnd4:out"),
-            ("DUT:mzm_2_ps_1_gnd", "gnd5:out"),
-            ("DUT:mzm_2_ps_2_gnd", "gnd6:out"),
-            ("DUT:top_ground", "gnd7:out"),
-            ("DUT:middle_ground", "gnd8:out"),
-            ("DUT:bottom_ground", "gnd9:out"),
-        ],
+    n_samples = n_bytes * steps_per_bit + 1
+    noise = NoiseBank(seed)
+
+    if symbols is not None:
+        levels_i, levels_q = symbols.i, symbols.q
+    elif prbs_order is not None:
+        levels_i, levels_q = prbs_levels(prbs_order, n_bytes, n_levels=(2, 2))
+    else:
+        levels_i, levels_q = (random_levels(n_bytes, rng=noise.generator(key)) for key in ("levels_i", "levels_q"))
+    drive_i = mod_amplitude_i * shape_drive(levels_i, steps_per_bit, pulse_shape, bit_rate)
+    drive_i += noise.normal("sig_i", mod_noise_i, n_samples)
+    drive_q = mod_amplitude_q * shape_drive(levels_q, steps_per_bit, pulse_shape, bit_rate)
+    drive_q += noise.normal("sig_q", mod_noise_q, n_samples)
+    opt_in = opt_amplitude + noise.normal("src_in", opt_noise, n_samples)
+
+    if simulation is None:
+        simulation = prepare_testbench(cell)
+    simulation.bind(
+        dt=dt,
+        src_in=opt_in,
+        sig_i=drive_i,
+        sig_q=drive_q,
+        ht_i=v_heater_i,
+        ht_q=v_heater_q,
+        mzm_left1=v_mzm_left1,
+        mzm_left2=v_mzm_left2,
+        mzm_right1=v_mzm_right1,
+        mzm_right2=v_mzm_right2,
     )
-
-    testbench_model = testbench.CircuitModel()
-    results = testbench_model.get_time_response(
+    results = simulation.run(
         t0=t0,
         t1=t1,
         dt=dt,
@@ -197,11 +179,11 @@ def simulate_modulation_PAM4(
     )
     return results
 
-def result_modified_PAM4(result, arg="out"):
-    res_sample = random.sample(list(result[arg]), 200)
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+def result_modified_PAM4(result, arg="out", samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result[arg], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
+    return derotate_amplitude(res_sample)
 
 def result_modified_OOK(result, samples_per_symbol, sampling_point, arg="out"):
-    res_sample = result[arg][int(samples_per_symbol * (10 + sampling_point))::samples_per_symbol]  # Ignore the first 10 symbols
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+    res_sample = sample_symbols(result[arg], samples_per_symbol, sampling_point)
+    return derotate_amplitude(res_sample)
 
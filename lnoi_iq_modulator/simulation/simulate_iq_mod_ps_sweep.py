@@ -3,13 +3,89 @@
 """
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
-import math
-import random
-
 import numpy as np
 
-import ipkiss3.all as i3
-from si_fab.benches.sources import random_bitsource, rand_normal
+from .testbench import build_testbench
+from .benches.noise import NoiseBank
+from .benches.sources import hold_waveform
+from .calibration import PS_VPI, electrode_volts_per_rad, fit_arms, output_field
+
+SWEEP_MODES = ("transient", "static")
+
+
+class PSSweepMap(object):
+    """Static sweep of the Q output phase shifter: output field versus heater voltage and wavelength.
+
+    Parameters
+    ----------
+    voltages : np.ndarray
+        Swept voltages [V] of the Q output phase shifter.
+    wavelengths : np.ndarray
+        Wavelengths [um].
+    field : np.ndarray
+        Complex output field, of shape (len(voltages), len(wavelengths)).
+    n_evaluations : int
+        Number of S-matrix evaluations (each over all the wavelengths).
+    """
+
+    def __init__(self, voltages, wavelengths, field, n_evaluations):
+        self.voltages = voltages
+        self.wavelengths = wavelengths
+        self.field = field
+        self.n_evaluations = n_evaluations
+
+    @property
+    def transmission(self):
+        """Output power map."""
+        return np.abs(self.field) ** 2
+
+    @property
+    def phase(self):
+        """Output phase map [rad]."""
+        return np.angle(self.field)
+
+    def extrema(self, wavelength_index: int = 0):
+        """Voltages of the maximum and the minimum of the output power at one wavelength, and their mid-point.
+
+        Returns
+        -------
+        Tuple (v_max, v_min, v_quadrature).
+
+        """
+        power = self.transmission[:, wavelength_index]
+        v_max = self.voltages[np.argmax(power)]
+        v_min = self.voltages[np.argmin(power)]
+        return v_max, v_min, 0.5 * (v_max + v_min)
+
+
+def prepare_testbench(cell):
+    """Testbench of simulate_modulation_ps_sweep on an IQ modulator, see testbench.build_testbench.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+
+    Returns
+    -------
+    PreparedSimulation
+
+    """
+    return build_testbench(
+        cell,
+        sources={"src_in": "in", "ht_q": "mzm_2_ps_out_in"},
+        probes={"out": "out"},
+        # DC biases; all other electrical ports are grounded
+        biases={
+            "ht_i": "mzm_1_ps_out_in",
+            "mzm_left1": "mzm_1_ps_1_in",
+            "mzm_left2": "mzm_1_ps_2_in",
+            "mzm_right1": "mzm_2_ps_1_in",
+            "mzm_right2": "mzm_2_ps_2_in",
+            "sig_i": "top_signal",
+            "sig_q": "bottom_signal",
+        },
+    )
 
 
 def simulate_modulation_ps_sweep(
@@ -33,6 +109,11 @@ def simulate_modulation_ps_sweep(
     debug=False,
     start_v=0,
     end_v=10,
+    seed=None,
+    mode="transient",
+    wavelengths=None,
+    ps_vpi=PS_VPI,
+    simulation=None,
 ):
     """
     Simulation recipe to simulate an IQ modulator.
@@ -75,95 +156,79 @@ def simulate_modulation_ps_sweep(
         Center wavelength of the optical carrier.
     debug : bool
         If True, the simulation is run in debug mode.
+    seed : int
+        Seed of the noise on the optical input, so a run is reproducible for a given seed, also across processes.
+    mode : str
+        "transient" ramps the heater in a time-domain simulation. "static" evaluates the same n_bytes heater voltages
+        from S-matrices instead, for all the wavelengths at once, without noise.
+    wavelengths : np.ndarray
+        Wavelengths [um] of the static sweep. Defaults to center_wavelength.
+    ps_vpi : float
+        Vpi [V] of the phase shifters, used by the static sweep.
+    simulation : PreparedSimulation
+        Testbench from prepare_testbench to bind and run, e.g. held by a batch worker. Defaults to the cached
+        testbench of cell.
 
     Returns
     -------
-    Dictionary of simulated signals.
+    Dictionary of simulated signals, or a PSSweepMap in static mode.
 
     """
-
-    # Define the excitations with noise on the electrical
-    rand_normal_dist = rand_normal()
-    src_in = i3.FunctionExcitation(
-        port_domain=i3.OpticalDomain, excitation_function=lambda t: opt_amplitude + rand_normal_dist(opt_noise)
-    )
-    signal_i = i3.FunctionExcitation(
-        port_domain=i3.ElectricalDomain, excitation_function=lambda t: mod_amplitude_i
-    )
-    signal_q = i3.FunctionExcitation(
-        port_domain=i3.ElectricalDomain, excitation_function=lambda t: mod_amplitude_i
-    )
-
-    v_heater_q = linear_v_source(bitrate=bit_rate, start_v=start_v, end_v=end_v)
-
-    heater_i = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_heater_i)
-    heater_q = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_heater_q(t))
-    mzm_left1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_left1)
-    mzm_left2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_left2)
-    mzm_right1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_right1)
-    mzm_right2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: v_mzm_right2)
-    gnd1 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd2 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd3 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd4 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd5 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd6 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd7 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd8 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-    gnd9 = i3.FunctionExcitation(port_domain=i3.ElectricalDomain, excitation_function=lambda t: 0.0)
-
+    if mode not in SWEEP_MODES:
+        raise ValueError("Unknown sweep mode {}, choose from {}".format(mode, SWEEP_MODES))
+    if mode == "static":
+        # The phase shifters are quasi-static, so the ramp reduces to the static response at each voltage. The
+        # arm coefficients of the DUT are fitted once over all the wavelengths, then every (voltage, wavelength)
+        # point of the map is evaluated by broadcasting.
+        if wavelengths is None:
+            wavelengths = np.array([center_wavelength])
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        voltages = np.linspace(start_v, end_v, n_bytes)
+        arms, _, n_evaluations = fit_arms(cell, wavelengths)
+        field = opt_amplitude * output_field(
+            arms[:, np.newaxis, :],
+            {
+                "v_heater_i": v_heater_i,
+                "v_heater_q": voltages[:, np.newaxis],
+                "v_mzm_left1": v_mzm_left1,
+                "v_mzm_left2": v_mzm_left2,
+                "v_mzm_right1": v_mzm_right1,
+                "v_mzm_right2": v_mzm_right2,
+            },
+            voltage_top=mod_amplitude_i,
+            voltage_bottom=mod_amplitude_i,  # as tied in the transient testbench
+            ps_vpi=ps_vpi,
+            volts_per_rad=electrode_volts_per_rad(cell),
+        )
+        return PSSweepMap(voltages, wavelengths, field, n_evaluations)
+
+    # Define the excitations with noise on the electrical.
+    # The optical input and the heater ramp are sampled once on the simulation time base and played back by the solver.
     t0 = 0.0
     t1 = n_bytes / bit_rate
     dt = t1 / n_bytes / steps_per_bit
+    n_samples = n_bytes * steps_per_bit + 1
+    noise = NoiseBank(seed)
 
-    testbench = i3.ConnectComponents(
-        child_cells={
-            "DUT": cell,
-            "out": i3.Probe(port_domain=i3.OpticalDomain),
-            "src_in": src_in,
-            "sig_i": signal_i,
-            "sig_q": signal_q,
-            "gnd1": gnd1,
-            "gnd2": gnd2,
-            "gnd3": gnd3,
-            "gnd4": gnd4,
-            "gnd5": gnd5,
-            "gnd6": gnd6,
-            "gnd7": gnd7,
-            "gnd8": gnd8,
-            "gnd9": gnd9,
-            "ht_i": heater_i,
-            "ht_q": heater_q,
-            "mzm_left1": mzm_left1,
-            "mzm_left2": mzm_left2,
-            "mzm_right1": mzm_right1,
-            "mzm_right2": mzm_right2,
-        },
-        links=[
-            ("src_in:out", "DUT:in"),
-            ("DUT:out", "out:in"),
-            ("DUT:mzm_1_ps_out_in", "ht_i:out"),
-            ("DUT:mzm_2_ps_out_in", "ht_q:out"),
-            ("DUT:mzm_1_ps_1_in", "mzm_left1:out"),
-            ("DUT:mzm_1_ps_2_in", "mzm_left2:out"),
-            ("DUT:mzm_2_ps_1_in", "mzm_right1:out"),
-            ("DUT:mzm_2_ps_2_in", "mzm_right2:out"),
-            ("DUT:top_signal", "sig_i:out"),
-            ("DUT:bottom_signal", "sig_q:out"),
-            ("DUT:mzm_1_ps_out_gnd", "gnd1:out"),
-            ("DUT:mzm_2_ps_out_gnd", "gnd2:out"),
-            ("DUT:mzm_1_ps_1_gnd", "gnd3:out"),
-            ("DUT:mzm_1_ps_2_gnd", "gnd4:out"),
-            ("DUT:mzm_2_ps_1_gnd", "gnd5:out"),
-            ("DUT:mzm_2_ps_2_gnd", "gnd6:out"),
-            ("DUT:top_ground", "gnd7:out"),
-            ("DUT:middle_ground", "gnd8:out"),
-            ("DUT:bottom_ground", "gnd9:out"),
-        ],
-    )
+    opt_in = opt_amplitude + noise.normal("src_in", opt_noise, n_samples)
 
-    testbench_model = testbench.CircuitModel()
-    results = testbench_model.get_time_response(
+    v_ramp_q = hold_waveform(np.linspace(start_v, end_v, n_bytes), steps_per_bit)
+
+    if simulation is None:
+        simulation = prepare_testbench(cell)
+    simulation.bind(
+        dt=dt,
+        src_in=opt_in,
+        ht_q=v_ramp_q,
+        ht_i=v_heater_i,
+        mzm_left1=v_mzm_left1,
+        mzm_left2=v_mzm_left2,
+        mzm_right1=v_mzm_right1,
+        mzm_right2=v_mzm_right2,
+        sig_i=mod_amplitude_i,
+        sig_q=mod_amplitude_i,
+    )
+    results = simulation.run(
         t0=t0,
         t1=t1,
         dt=dt,
@@ -171,17 +236,3 @@ def simulate_modulation_ps_sweep(
         debug=debug,
     )
     return results
-
-def linear_v_source(bitrate: float, n_bytes: int = 2**10, start_v=0, end_v=10):
-    from numba import njit
-
-    data = np.linspace(start_v, end_v, n_bytes)
-
-    @njit()
-    def f_rbs(t):
-        idx = int(t * bitrate)
-        if idx >= n_bytes:
-            idx = n_bytes - 1
-        return data[idx]
-
-    return f_rbs
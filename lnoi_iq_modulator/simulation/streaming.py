@@ -0,0 +1,149 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Streaming time-domain simulation: [t0, t1] is split into windows that are simulated one after the other, and the
+signals of every window are handed to the caller and freed before the next window runs, so the memory use is set by
+the window length instead of the simulation length.
+
+The solver always starts from its initial state, so every window is preceded by a warm-up segment that re-plays the
+end of the previous window: the electrode voltages (the states of CustomPushPullModulatorModel) settle and the delay
+lines fill with the history they would have had. The warm-up samples are dropped. The warm-up must cover the memory
+of the DUT, see settling_time.
+
+    sim = prepare_iq_modulator(iq_mod)
+    sim.set_biases(**calibrate_heaters(iq_mod, center_wavelength=1.55).biases)
+    for window in stream_time_response(sim, dict(src_in=opt_in, sig_i=drive_i, sig_q=drive_q), dt=dt,
+                                       center_wavelength=1.55, window_samples=2**18, warmup=settling_time(iq_mod)):
+        writer.append(window["out"])
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from scipy.constants import speed_of_light
+
+import ipkiss3.all as i3
+
+
+def settling_time(cell, n_tau: float = 10.0, delay_margin: float = 2.0) -> float:
+    """Time [s] after which the response of an IQ modulator no longer depends on its initial state.
+
+    This is n_tau time constants of the electrode (from the bandwidth of the CircuitModel) plus the optical delay
+    through the device, estimated from the width of its layout and the extra length of the delay arm, times
+    delay_margin.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+    n_tau : float
+        Number of electrode time constants.
+    delay_margin : float
+        Safety factor on the optical delay.
+
+    Returns
+    -------
+    Settling time [s].
+
+    """
+    tau = 1.0 / (2 * np.pi * cell.CircuitModel().bandwidth)
+    n_g = cell.trace_template.get_default_view(i3.CircuitModelView).n_g
+    length = cell.get_default_view(i3.LayoutView).size_info().width
+    if getattr(cell, "with_delays", False):
+        length += 1.55**2 / (cell.fsr_nm * 1e-3 * n_g)
+    return n_tau * tau + delay_margin * n_g * length * 1e-6 / speed_of_light
+
+
+class SimulationWindow(object):
+    """Signals of one window of a streaming simulation.
+
+    Parameters
+    ----------
+    index : int
+        Index of the window.
+    start : int
+        Index of the first sample of the window in the whole simulation.
+    timesteps : np.ndarray
+        Time [s] of every sample.
+    signals : dict
+        Recorded signals of the window, keyed on their name.
+    """
+
+    def __init__(self, index, start, timesteps, signals):
+        self.index = index
+        self.start = start
+        self.timesteps = timesteps
+        self.signals = signals
+
+    def __len__(self):
+        return self.timesteps.shape[0]
+
+    def __getitem__(self, name):
+        return self.signals[name]
+
+
+def stream_time_response(
+    simulation,
+    waveforms,
+    dt: float,
+    center_wavelength: float,
+    window_samples: int,
+    warmup: float = 0.0,
+    outputs=None,
+    t0: float = 0.0,
+    debug: bool = False,
+    recording=None,
+):
+    """Run a prepared simulation window by window, yielding the signals of every window.
+
+    Parameters
+    ----------
+    simulation : PreparedSimulation
+        Testbench, with its biases already set.
+    waveforms : dict
+        Waveforms of the sources, keyed on the source names, all sampled every dt from t0 and of the same length.
+        Only the samples of the current window are read, so np.memmap arrays can be used for long simulations.
+    dt : float
+        Time step [s].
+    center_wavelength : float
+        Center wavelength [um] of the optical carrier.
+    window_samples : int
+        Number of samples per window.
+    warmup : float
+        Time [s] re-simulated before every window and then dropped, see settling_time.
+    outputs : list of str
+        Signals to keep. Defaults to the probes of the testbench, or the signals of recording.
+    t0 : float
+        Time of the first sample [s].
+    debug : bool
+        If True, the simulation is run in debug mode.
+    recording : RecordingSpec
+        If given, only the signals it records are kept. Pass the windows to recording.collect to decimate and join
+        them.
+
+    Yields
+    ------
+    SimulationWindow, whose samples join seamlessly with those of the previous window.
+
+    """
+    n_samples = {np.shape(values)[0] for values in waveforms.values()}
+    if len(n_samples) != 1:
+        raise ValueError("All the waveforms must have the same length")
+    n_samples = n_samples.pop()
+    if outputs is None:
+        outputs = list(recording.probes) if recording is not None else list(simulation.probes)
+    n_warmup = int(np.ceil(warmup / dt))
+
+    for index, start in enumerate(range(0, n_samples - 1, window_samples)):
+        stop = min(start + window_samples, n_samples - 1)
+        first = max(start - n_warmup, 0)
+        simulation.bind(dt=dt, t0=t0 + first * dt,
+                        **{name: np.asarray(values[first:stop + 1]) for name, values in waveforms.items()})
+        results = simulation.run(t1=t0 + stop * dt, dt=dt, center_wavelength=center_wavelength, t0=t0 + first * dt,
+                                 debug=debug)
+        # Keep the samples of [start, stop), and the last sample with the last window
+        keep = slice(start - first, stop - first + (1 if stop == n_samples - 1 else 0))
+        signals = OrderedDict((name, np.array(results[name][keep])) for name in outputs)
+        timesteps = np.array(results.timesteps[keep])
+        del results
+        yield SimulationWindow(index, start, timesteps, signals)
@@ -0,0 +1,113 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Reduced-order surrogate of the IQ modulator for large sweeps.
+
+The hierarchical model of IQModulator propagates the signals through the three splitters, the three combiners, the
+six phase shifters, the bends and the RF phase modulator on every time step. Between the input and the output this is
+a sum of four arms, each with a transmission, a phase that depends on the wavelength and on the voltages of its
+electrode and phase shifters, and a group delay. fit_surrogate identifies the arms from the S-matrix of the
+hierarchical model at three wavelengths (see calibration.fit_arms): with the first-order dispersion of the waveguide
+models the phase of an arm is phase_lambda / wavelength + phase_0, and its group delay follows from phase_lambda.
+The IQModulatorSurrogateModel then evaluates the four arms in closed form:
+
+    cm = iq_mod.CircuitModel()
+    cm.surrogate = fit_surrogate(iq_mod, center_wavelength=1.55)
+    results = simulate_modulation_QAM(iq_mod, ...)
+
+The S-matrix of the surrogate matches the hierarchical model at the fitted wavelength. The electrode keeps its RC
+pole, and the bandwidth and the static electrode voltages are read from the CircuitModel when the model is
+generated. The fit has to be repeated after changing the layout or vpi_l. Cached testbenches hold on to the model
+they were built with, so call testbench.clear_testbench_cache after switching between the two models.
+"""
+
+import numpy as np
+from scipy.constants import speed_of_light
+
+import ipkiss3.all as i3
+
+from .calibration import PS_VPI, electrode_volts_per_rad, fit_arms
+
+# Sign of the electro-optic phase shift of the four arms (MZM 1 top and bottom, MZM 2 top and bottom)
+ARM_SIGNS = np.array([1.0, -1.0, 1.0, -1.0])
+
+
+def surrogate_parameters(arms, wavelengths, volts_per_rad: float, electrode_wavelength: float,
+                         ps_vpi: float = PS_VPI):
+    """Parameters of IQModulatorSurrogateModel from arm coefficients at a few wavelengths.
+
+    Parameters
+    ----------
+    arms : np.ndarray
+        Arm coefficients, shape (4, n_wavelengths), see calibration.fit_arms.
+    wavelengths : np.ndarray
+        Increasing wavelengths [um] of the arm coefficients, closely spaced so that the phase of an arm changes by
+        less than pi between two of them. The surrogate is exact at the middle one.
+    volts_per_rad : float
+        Electrode voltage per radian of phase of an arm at electrode_wavelength, see
+        calibration.electrode_volts_per_rad.
+    electrode_wavelength : float
+        Wavelength [um] at which volts_per_rad is defined, the center wavelength of the waveguide model.
+    ps_vpi : float
+        Vpi [V] of the phase shifters.
+
+    Returns
+    -------
+    Dictionary of the fitted parameters, to set as the surrogate of the CircuitModel of the IQModulator.
+
+    """
+    arms = np.asarray(arms)
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    inv_wavelengths = 1.0 / wavelengths
+    center = wavelengths.shape[0] // 2
+    phases = np.unwrap(np.angle(arms), axis=1)
+    phase_lambda = np.polyfit(inv_wavelengths, phases.T, 1)[0]
+    if np.any(phase_lambda <= 0):
+        raise ValueError("The phase of every arm must decrease with the wavelength, got slopes {}".format(phase_lambda))
+    phase_0 = phases[:, center] - phase_lambda * inv_wavelengths[center]
+    # The group delay is d(phase)/d(omega), with omega = 2 pi c / wavelength
+    delays = phase_lambda * 1e-6 / (2 * np.pi * speed_of_light)
+    phase_v = ARM_SIGNS * electrode_wavelength / volts_per_rad
+
+    parameters = {"ps_phase": np.pi / ps_vpi}
+    for k in range(4):
+        parameters["amplitude_{}".format(k + 1)] = float(np.abs(arms[k, center]))
+        parameters["phase_lambda_{}".format(k + 1)] = float(phase_lambda[k])
+        parameters["phase_0_{}".format(k + 1)] = float(phase_0[k])
+        parameters["delay_{}".format(k + 1)] = float(delays[k])
+        parameters["phase_v_{}".format(k + 1)] = float(phase_v[k])
+    return parameters
+
+
+def fit_surrogate(cell, center_wavelength: float = 1.55, delta_wavelength: float = 1e-5, ps_vpi: float = PS_VPI):
+    """Fit the IQModulatorSurrogateModel of an IQ modulator on its hierarchical model.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator with a combined output.
+    center_wavelength : float
+        Wavelength [um] at which the surrogate matches the hierarchical model, e.g. the center wavelength of the
+        simulations.
+    delta_wavelength : float
+        Wavelength step [um] of the fit. The phase of the arms changes by 2 pi n_g L delta_wavelength / wavelength^2,
+        which must stay below pi.
+    ps_vpi : float
+        Vpi [V] of the phase shifters.
+
+    Returns
+    -------
+    Dictionary of the fitted parameters, see surrogate_parameters.
+
+    """
+    cm = cell.CircuitModel()
+    surrogate = cm.surrogate
+    cm.surrogate = None
+    try:
+        wavelengths = center_wavelength + delta_wavelength * np.array([-1.0, 0.0, 1.0])
+        arms, _, _ = fit_arms(cell, wavelengths, out_ports=["out"])
+    finally:
+        cm.surrogate = surrogate
+    trace_template = cell.phase_modulator.trace_template.get_default_view(i3.CircuitModelView)
+    return surrogate_parameters(arms, wavelengths, electrode_volts_per_rad(cell), trace_template.center_wavelength,
+                                ps_vpi)
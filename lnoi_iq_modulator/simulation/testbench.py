@@ -0,0 +1,496 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Helpers to assemble the testbenches of the IQ modulator simulation recipes.
+
+build_testbench wires sources, probes and DC biases to the ports of a DUT, ties every other electrical port to
+ground and returns the testbench as a PreparedSimulation. All the DC biases and grounds are the terms of a single
+TieOff instance, so the solver evaluates one constant model instead of one excitation per tied port.
+
+Testbenches are cached for the session on the DUT identity and the port map only: the waveforms and bias voltages are
+bound per run into buffers of the testbench, so repeated runs of a recipe, with any waveforms, reuse the compiled
+testbench.
+
+PreparedSimulation builds the testbench once: every source is a SampleSlot that plays back a mutable
+sample buffer, and the voltages of the TieOff are a buffer too. Both are read by the solver at run time, so every
+iteration only writes new waveforms or bias values into the buffers and re-runs the time integration, e.g.
+
+    sim = prepare_iq_modulator(iq_mod)
+    sim.bind(dt=dt, src_in=opt_in, sig_i=drive_i, sig_q=drive_q)
+    for v in np.linspace(0, ps_vpi, 11):
+        sim.set_biases(ht_q=v)
+        results = sim.run(t1=t1, dt=dt, center_wavelength=1.55)
+"""
+
+import linecache
+from collections import OrderedDict
+
+import numpy as np
+
+import ipkiss3.all as i3
+
+# Maximum number of testbenches kept in the session cache
+TESTBENCH_CACHE_SIZE = 8
+
+# Properties of the IQModulator, its layout and its circuit model that identify a DUT (see dut_parameters)
+CELL_PARAMS = ("with_delays", "fsr_nm", "delay_at_input", "bend_to_phase_shifter_dist")
+LAYOUT_PARAMS = (
+    "electrode_length",
+    "hot_width",
+    "ground_width",
+    "centre_width",
+    "electrode_gap",
+    "taper_length",
+    "hot_taper_width",
+    "taper_gap",
+    "taper_straight_length",
+    "bend_length",
+    "phase_shifter_electrode_separation",
+    "bend_radius",
+)
+MODEL_PARAMS = ("vpi_l", "bandwidth", "n_rf", "alpha_rf", "z_electrode", "z_source", "z_load", "surrogate")
+
+_testbenches = OrderedDict()
+_tie_off_models = {}
+
+
+def _cache_put(cache, key, value, size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+
+def dut_ports(cell):
+    """Ports exposed by the DUT, as an ordered mapping of port name to domain.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT.
+
+    Returns
+    -------
+    OrderedDict of port name to i3.OpticalDomain or i3.ElectricalDomain.
+
+    """
+    layout = cell.get_default_view(i3.LayoutView)
+    return OrderedDict((port.name, port.domain) for port in layout.ports)
+
+
+def dut_parameters(cell):
+    """Properties of the DUT, its layout and its circuit model that set its response, see CELL_PARAMS, LAYOUT_PARAMS
+    and MODEL_PARAMS. Properties the DUT does not have are skipped.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT.
+
+    Returns
+    -------
+    OrderedDict of property name to value.
+
+    """
+    layout = cell.get_default_view(i3.LayoutView)
+    model = cell.get_default_view(i3.CircuitModelView)
+    params = OrderedDict()
+    for view, names in ((cell, CELL_PARAMS), (layout, LAYOUT_PARAMS), (model, MODEL_PARAMS)):
+        params.update((name, getattr(view, name)) for name in names if hasattr(view, name))
+    return params
+
+
+def tie_off_model(n_terms: int):
+    """CompactModel with the electrical terms out_0 ... out_<n_terms - 1>, term out_k held at voltages[k].
+
+    The voltages are an array parameter that the kernel reads at every step, so a new bias written into the array is
+    picked up by the next run without recompiling the testbench. The model compiler reads the source of
+    calculate_signals and resolves the term names in it, so they have to be literals. The kernel is therefore
+    generated once per number of terms, and its source is registered in linecache where inspect finds it.
+    """
+    model = _tie_off_models.get(n_terms)
+    if model is None:
+        filename = "<tie_off_model_{}>".format(n_terms)
+        lines = ["def calculate_signals(parameters, env, output_signals, y, t, input_signals):"]
+        lines += ["    output_signals['out_{0}'] = parameters.voltages[{0}]".format(k) for k in range(n_terms)]
+        source = "\n".join(lines) + "\n"
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        namespace = {}
+        exec(compile(source, filename, "exec"), namespace)
+        model = type("TieOffModel{}".format(n_terms), (i3.CompactModel,), {
+            "parameters": ["voltages"],
+            "terms": [i3.ElectricalTerm(name="out_{}".format(k)) for k in range(n_terms)],
+            "calculate_signals": namespace["calculate_signals"],
+        })
+        _tie_off_models[n_terms] = model
+    return model
+
+
+class TieOff(i3.PCell):
+    """Multi-terminal tie-off: holds each of its electrical terms out_0, out_1, ... at a constant voltage, so any
+    number of DC biases and grounds is a single instance of the testbench."""
+
+    _name_prefix = "TIE_OFF"
+    voltages = i3.DefinitionProperty(doc="np.ndarray of the voltage [V] of every term, out_k is held at voltages[k]. "
+                                         "The array is read at run time, so it can be written in place.")
+
+    class Netlist(i3.NetlistView):
+        def _generate_netlist(self, nl):
+            for k in range(len(self.cell.voltages)):
+                nl += i3.ElectricalTerm(name="out_{}".format(k))
+            return nl
+
+    class CircuitModel(i3.CircuitModelView):
+        def _generate_model(self):
+            return tie_off_model(len(self.cell.voltages))(voltages=self.cell.voltages)
+
+
+def tie_ports(child_cells, links, ties, dut_name="DUT", tie_name="ties"):
+    """Tie ports of the DUT to constant voltages (DC biases and grounds) with a single TieOff instance.
+
+    Parameters
+    ----------
+    child_cells : dict
+        Child cells of the testbench, updated in place.
+    links : list
+        Links of the testbench, updated in place.
+    ties : dict
+        Mapping of the name of the tie to the port name on the DUT. The k-th tie is connected to the term out_k of the
+        TieOff.
+    dut_name : str
+        Name of the DUT in child_cells.
+    tie_name : str
+        Name of the TieOff instance in child_cells.
+
+    Returns
+    -------
+    Tuple (indices, voltages): the index of every tie in voltages, and the voltage buffer of the TieOff, all 0 V.
+    Voltages written into the buffer are applied by the next run of the testbench.
+
+    """
+    indices = OrderedDict()
+    for name, port in ties.items():
+        indices[name] = len(indices)
+        links.append(("{}:{}".format(dut_name, port), "{}:out_{}".format(tie_name, indices[name])))
+    voltages = np.zeros(len(indices))
+    if indices:
+        child_cells[tie_name] = TieOff(voltages=voltages)
+    return indices, voltages
+
+
+def build_testbench(cell, sources, probes, biases=None, dut_name="DUT"):
+    """Build (or reuse) the testbench of a DUT, see PreparedSimulation.
+
+    Testbenches are cached on the DUT and on the names and ports of the sources, probes and biases only, so every
+    run of a recipe on the same DUT reuses the compiled testbench and only binds its waveforms and bias voltages.
+    The bindings of the previous run are kept, so bind every source and bias before running.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT.
+    sources : dict
+        Mapping of the name of the source to the port name on the DUT. A port of None adds the source without
+        connecting it, so its signal is still recorded.
+    probes : dict
+        Mapping of the name of the probe instance to the port name on the DUT.
+    biases : dict
+        Mapping of the name of the DC bias to the port name on the DUT. The biases are the terms of a single TieOff
+        instance named "ties", together with a ground (0 V) on every other electrical port that is not driven or
+        probed, and are not recorded in the results.
+    dut_name : str
+        Name of the DUT in the testbench.
+
+    Returns
+    -------
+    PreparedSimulation
+
+    """
+    biases = biases or {}
+    key = (
+        id(cell),
+        tuple(sorted((name, port or "") for name, port in sources.items())),
+        tuple(sorted(probes.items())),
+        tuple(sorted(biases.items())),
+        dut_name,
+    )
+    cached = _testbenches.get(key)
+    if cached is not None and cached.cell is cell:
+        _testbenches.move_to_end(key)
+        return cached
+    simulation = PreparedSimulation(cell, sources=sources, probes=probes, biases=biases, dut_name=dut_name)
+    _cache_put(_testbenches, key, simulation, TESTBENCH_CACHE_SIZE)
+    return simulation
+
+
+def clear_testbench_cache():
+    """Drop the cached testbenches, e.g. after changing the DUT properties in place."""
+    _testbenches.clear()
+
+
+class SampleBuffer(object):
+    """Fixed-size buffer of the samples played back by a SampleSlot.
+
+    The samples and the timing are arrays handed to the slot model as parameters, and the model reads them at every
+    step, so writing new samples into the buffers changes the excitation without recompiling the testbench.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of samples.
+    dtype :
+        Type of the samples, complex for optical slots.
+    """
+
+    def __init__(self, capacity: int, dtype=float):
+        self.samples = np.zeros(capacity, dtype=dtype)
+        # Time of the first sample [s], inverse of the sample time [1/s] and number of samples
+        self.timing = np.array([0.0, 0.0, 1.0])
+
+    @property
+    def capacity(self):
+        return self.samples.shape[0]
+
+    def write(self, values, dt: float = None, t0: float = 0.0):
+        """Write a waveform sampled every dt starting at t0, or a constant value, into the buffer."""
+        values = np.atleast_1d(values)
+        n_samples = values.shape[0]
+        if n_samples > self.capacity:
+            raise ValueError("{} samples do not fit in a buffer of {}".format(n_samples, self.capacity))
+        if n_samples > 1 and dt is None:
+            raise ValueError("A waveform needs its sample time dt")
+        self.samples[:n_samples] = values
+        self.timing[:] = (t0, 1.0 / dt if n_samples > 1 else 0.0, n_samples)
+
+
+class SampleSlotModel(i3.CompactModel):
+    """Plays back the nearest of the first timing[2] samples, like benches.sources.sampled_waveform, on the
+    electrical term out. The term monitor carries the same signal, so it can be recorded by a probe."""
+
+    parameters = ["samples", "timing"]
+
+    terms = [
+        i3.ElectricalTerm(name="out"),
+        i3.ElectricalTerm(name="monitor"),
+    ]
+
+    def calculate_signals(parameters, env, output_signals, y, t, input_signals):
+        timing = parameters.timing
+        idx = int((t - timing[0]) * timing[1] + 0.5)
+        if idx < 0:
+            idx = 0
+        if idx > int(timing[2]) - 1:
+            idx = int(timing[2]) - 1
+        output_signals['out'] = parameters.samples[idx]
+        output_signals['monitor'] = parameters.samples[idx]
+
+
+class OpticalSampleSlotModel(SampleSlotModel):
+    """SampleSlotModel on optical terms."""
+
+    terms = [
+        i3.OpticalTerm(name="out"),
+        i3.OpticalTerm(name="monitor"),
+    ]
+
+
+class SampleSlot(i3.PCell):
+    """Source that plays back the samples of a SampleBuffer, which can be rewritten between runs."""
+
+    _name_prefix = "SAMPLE_SLOT"
+    domain = i3.DefinitionProperty(default=i3.ElectricalDomain, doc="i3.ElectricalDomain or i3.OpticalDomain")
+    buffer = i3.DefinitionProperty(doc="SampleBuffer played back on the terms out and monitor")
+
+    class Netlist(i3.NetlistView):
+        def _generate_netlist(self, nl):
+            term = i3.OpticalTerm if self.cell.domain == i3.OpticalDomain else i3.ElectricalTerm
+            nl += term(name="out")
+            nl += term(name="monitor")
+            return nl
+
+    class CircuitModel(i3.CircuitModelView):
+        def _generate_model(self):
+            model = OpticalSampleSlotModel if self.cell.domain == i3.OpticalDomain else SampleSlotModel
+            return model(samples=self.cell.buffer.samples, timing=self.cell.buffer.timing)
+
+
+class PreparedSimulation(object):
+    """Testbench of a DUT that is built once and re-run with new excitations.
+
+    Every source is a SampleSlot, and the DC biases and grounds are the terms of a single TieOff, whose samples and
+    voltages are buffers read by the solver at run time. Binding new waveforms or bias values writes into those
+    buffers, so the compiled testbench is reused; it is only rebuilt when a waveform is longer than the buffer of its
+    source, which then grows to the next power of two. t0, t1, dt and center_wavelength are arguments of run, so a
+    sweep only re-runs the time integration.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        DUT.
+    sources : dict
+        Mapping of the name of the source to the port name on the DUT. A port of None adds the source without
+        connecting it, so its signal is still recorded. Sources start at a constant 0, and the signal of every source
+        is recorded under its name.
+    probes : dict
+        Mapping of the name of the probe to the port name on the DUT.
+    biases : dict
+        Mapping of the name of the DC bias to the port name on the DUT. Biases start at 0 V. Every other electrical
+        port that is not driven or probed is tied to ground.
+    dut_name : str
+        Name of the DUT in the testbench.
+    """
+
+    def __init__(self, cell, sources, probes, biases=None, dut_name="DUT"):
+        ports = dut_ports(cell)
+        biases = biases or {}
+        for port in list(sources.values()) + list(probes.values()) + list(biases.values()):
+            if port is not None and port not in ports:
+                raise ValueError("{} has no port {}, its ports are {}".format(cell.name, port, list(ports)))
+        self.cell = cell
+        self.dut_name = dut_name
+        self.sources = OrderedDict(sources)
+        self.bias_ports = OrderedDict(biases)
+        self.probes = OrderedDict(probes)
+        self._domains = {name: ports[port] if port is not None else i3.ElectricalDomain
+                         for name, port in self.sources.items()}
+        self.buffers = OrderedDict(
+            (name, SampleBuffer(1, dtype=complex if self._domains[name] == i3.OpticalDomain else float))
+            for name in self.sources
+        )
+        used = set(self.sources.values()) | set(self.probes.values()) | set(self.bias_ports.values())
+        self.ties = OrderedDict(self.bias_ports)
+        self.ties.update(("gnd_{}".format(port), port) for port, domain in ports.items()
+                         if port not in used and domain == i3.ElectricalDomain)
+        self._tie_index = OrderedDict((name, k) for k, name in enumerate(self.ties))
+        self._voltages = np.zeros(len(self.ties))
+        self._testbench_model = None
+
+    @property
+    def bias_names(self):
+        return list(self.bias_ports)
+
+    @property
+    def voltages(self):
+        """Current DC bias voltages [V], keyed on the bias names."""
+        return OrderedDict((name, float(self._voltages[self._tie_index[name]])) for name in self.bias_ports)
+
+    @property
+    def testbench_model(self):
+        """CircuitModel of the testbench, built at the first run and reused as long as the buffers fit."""
+        if self._testbench_model is None:
+            self._testbench_model = self._build()
+        return self._testbench_model
+
+    def _build(self):
+        # Imported here, electrode imports result_cache, which imports this module
+        from .electrode import warn_ignored_electrode
+
+        warn_ignored_electrode(self.cell)
+        ports = dut_ports(self.cell)
+        child_cells = {self.dut_name: self.cell}
+        links = []
+        for name, port in self.sources.items():
+            slot = "slot_{}".format(name)
+            child_cells[slot] = SampleSlot(domain=self._domains[name], buffer=self.buffers[name])
+            child_cells[name] = i3.Probe(port_domain=self._domains[name])
+            links.append(("{}:monitor".format(slot), "{}:in".format(name)))
+            if port is not None:
+                links.append(("{}:out".format(slot), "{}:{}".format(self.dut_name, port)))
+        for name, port in self.probes.items():
+            child_cells[name] = i3.Probe(port_domain=ports[port])
+            links.append(("{}:{}".format(self.dut_name, port), "{}:in".format(name)))
+        _, voltages = tie_ports(child_cells, links, self.ties, dut_name=self.dut_name)
+        # The TieOff reads the voltages of this simulation
+        voltages[:] = self._voltages
+        self._voltages = voltages
+        testbench = i3.ConnectComponents(child_cells=child_cells, links=links)
+        return testbench.CircuitModel()
+
+    def bind(self, dt: float = None, t0: float = 0.0, **values):
+        """Bind waveforms (sampled every dt starting at t0) or constant values to the named sources and biases.
+
+        The values are written into the buffers of the testbench; biases only take constant values.
+        """
+        for name, value in values.items():
+            if name in self.bias_ports:
+                if np.ndim(value) != 0:
+                    raise ValueError("The bias {} takes a constant voltage".format(name))
+                self._voltages[self._tie_index[name]] = float(value)
+            elif name in self.buffers:
+                value = np.atleast_1d(value)
+                n_samples = value.shape[0]
+                if n_samples > self.buffers[name].capacity:
+                    self.buffers[name] = SampleBuffer(1 << (n_samples - 1).bit_length(),
+                                                      dtype=self.buffers[name].samples.dtype)
+                    self._testbench_model = None
+                self.buffers[name].write(value, dt, t0=t0)
+            else:
+                raise KeyError("Unknown source {}, choose from {}".format(name, list(self.sources) + self.bias_names))
+
+    def set_biases(self, **voltages):
+        """Set DC bias voltages [V]."""
+        self.bind(**voltages)
+
+    def run(self, t1: float, dt: float, center_wavelength: float, t0: float = 0.0, debug: bool = False,
+            recording=None):
+        """Run the time-domain simulation with the current bindings.
+
+        Parameters
+        ----------
+        recording : RecordingSpec
+            If given, only the signals and samples it selects are returned.
+
+        Returns
+        -------
+        Simulated signals, as returned by get_time_response, or RecordedResults if recording is given.
+
+        """
+        results = self.testbench_model.get_time_response(
+            t0=t0,
+            t1=t1,
+            dt=dt,
+            center_wavelength=center_wavelength,
+            debug=debug,
+        )
+        if recording is not None:
+            return recording.apply(results)
+        return results
+
+
+# DC bias ports of the IQ modulator, keyed on the names used in the recipes
+IQ_MODULATOR_BIASES = OrderedDict(
+    [
+        ("ht_i", "mzm_1_ps_out_in"),
+        ("ht_q", "mzm_2_ps_out_in"),
+        ("mzm_left1", "mzm_1_ps_1_in"),
+        ("mzm_left2", "mzm_1_ps_2_in"),
+        ("mzm_right1", "mzm_2_ps_1_in"),
+        ("mzm_right2", "mzm_2_ps_2_in"),
+    ]
+)
+
+
+def prepare_iq_modulator(cell):
+    """Prepared simulation of an IQ modulator with the sources, probes and biases of the recipes, see build_testbench.
+
+    The sources are "src_in" (optical input), "sig_i" and "sig_q" (top and bottom signal electrodes), and the biases
+    those of IQ_MODULATOR_BIASES. The optical outputs ("out", or "top_out" and "bottom_out") are probed.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+
+    Returns
+    -------
+    PreparedSimulation
+
+    """
+    ports = dut_ports(cell)
+    probes = {port: port for port in ("out", "top_out", "bottom_out") if port in ports}
+    return build_testbench(
+        cell,
+        sources={"src_in": "in", "sig_i": "top_signal", "sig_q": "bottom_signal"},
+        probes=probes,
+        biases=IQ_MODULATOR_BIASES,
+    )
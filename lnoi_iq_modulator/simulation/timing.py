@@ -0,0 +1,241 @@
+# Copyright (C) 2020-2024 Luceda Photonics
+
+"""
+Symbol-timing recovery of time-domain results.
+
+The post-processors sample every symbol at a fixed fraction of the symbol period (sampling_point) after skipping the
+first symbols. The best fraction depends on the electrode bandwidth, the electrode length and the delays in the
+modulator, so instead of tuning it by hand it can be searched for: the output is reshaped into a
+(n_symbols, samples_per_symbol) view and a timing metric is computed for every sampling phase in one pass.
+
+    index = optimal_sampling_index(results["out"], samples_per_symbol)
+    sampling_point = (index + 0.5) / samples_per_symbol
+    constellation = sample_symbols(results["out"], samples_per_symbol, sampling_point)
+
+On long streams, where the best phase can drift, refine_timing tracks it block by block with a Gardner or
+Mueller-Muller timing error detector.
+"""
+
+import numpy as np
+from scipy.constants import speed_of_light
+
+from .calibration import fit_arms
+from .sampling import SKIP_SYMBOLS
+
+METRICS = ("variance", "eye")
+COMPONENTS = ("abs", "real", "imag")
+DETECTORS = ("gardner", "mueller_muller")
+
+
+def symbol_matrix(values, samples_per_symbol: int, skip_symbols: int = SKIP_SYMBOLS, max_symbols: int = None):
+    """Samples of a signal as a (n_symbols, samples_per_symbol) array, one row per symbol.
+
+    The first skip_symbols symbols and the incomplete last symbol are dropped. For an ndarray or an np.memmap this
+    is a view, nothing is copied.
+    """
+    start = skip_symbols * samples_per_symbol
+    n_symbols = max(0, (len(values) - start) // samples_per_symbol)
+    if max_symbols is not None:
+        n_symbols = min(n_symbols, max_symbols)
+    return np.asarray(values[start:start + n_symbols * samples_per_symbol]).reshape(n_symbols, samples_per_symbol)
+
+
+def _component(values, component):
+    if component not in COMPONENTS:
+        raise ValueError("Unknown component {}, choose from {}".format(component, COMPONENTS))
+    if component == "abs":
+        return np.abs(values)
+    return values.real if component == "real" else values.imag
+
+
+def phase_metric(matrix: np.ndarray, metric: str = "variance", n_levels: int = 2, component: str = "abs"):
+    """Timing metric of every sampling phase, the larger the better.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        Samples as a (n_symbols, samples_per_symbol) array, see symbol_matrix.
+    metric : str
+        "variance": variance of the samples of every phase. The symbols are the furthest apart at the center of the
+        eye, and are averaged towards each other at the transitions. This works for any modulation format.
+        "eye": vertical eye opening, the smallest of the n_levels - 1 largest gaps between the sorted samples of
+        component.
+    n_levels : int
+        Number of levels of the eye ("eye" only), e.g. 2 for OOK and BPSK, 4 for PAM4.
+    component : str
+        Part of the complex samples the eye is drawn from ("eye" only): "abs" for intensity formats, "real" or
+        "imag" for the I or Q eye.
+
+    Returns
+    -------
+    Array of samples_per_symbol metric values.
+
+    """
+    if metric not in METRICS:
+        raise ValueError("Unknown metric {}, choose from {}".format(metric, METRICS))
+    if metric == "variance":
+        return np.var(matrix, axis=0)
+    gaps = np.diff(np.sort(_component(matrix, component), axis=0), axis=0)
+    return np.sort(gaps, axis=0)[-(n_levels - 1)]
+
+
+def optimal_sampling_index(
+    values,
+    samples_per_symbol: int,
+    skip_symbols: int = SKIP_SYMBOLS,
+    metric: str = "variance",
+    n_levels: int = 2,
+    component: str = "abs",
+    max_symbols: int = 2**12,
+) -> int:
+    """Sample index within the symbol period at which the symbols are best sampled, see phase_metric.
+
+    Parameters
+    ----------
+    values : array-like
+        Samples of the signal.
+    samples_per_symbol : int
+        Number of samples per symbol.
+    skip_symbols : int
+        Number of symbols skipped at the start of the signal, see settling_symbols.
+    max_symbols : int
+        Maximum number of symbols the metric is computed on.
+
+    Returns
+    -------
+    Index in [0, samples_per_symbol). The matching sampling_point of sample_symbols is (index + 0.5) /
+    samples_per_symbol.
+
+    """
+    matrix = symbol_matrix(values, samples_per_symbol, skip_symbols, max_symbols)
+    if matrix.shape[0] == 0:
+        raise ValueError("The signal is shorter than the {} skipped symbols".format(skip_symbols))
+    return int(np.argmax(phase_metric(matrix, metric, n_levels, component)))
+
+
+def optimal_sampling_point(values, samples_per_symbol: int, skip_symbols: int = SKIP_SYMBOLS, **kwargs) -> float:
+    """Fraction of the symbol period at which the symbols are best sampled, see optimal_sampling_index."""
+    return (optimal_sampling_index(values, samples_per_symbol, skip_symbols, **kwargs) + 0.5) / samples_per_symbol
+
+
+def group_delay(cell, center_wavelength: float = 1.55, delta_wavelength: float = 1e-4) -> float:
+    """Optical group delay [s] from the input to the output of an IQ modulator.
+
+    The group delay of every arm is the slope of its phase over the optical frequency, from the arm coefficients
+    fitted at three wavelengths (see calibration.fit_arms), so it does not depend on the bias point. The delays of
+    the arms are averaged, weighted by their transmission.
+
+    Parameters
+    ----------
+    cell : i3.PCell
+        IQ modulator.
+    center_wavelength : float
+        Wavelength [um].
+    delta_wavelength : float
+        Wavelength step [um] of the finite difference.
+
+    Returns
+    -------
+    Group delay [s].
+
+    """
+    wavelengths = center_wavelength + delta_wavelength * np.array([-1.0, 0.0, 1.0])
+    arms, _, _ = fit_arms(cell, wavelengths)
+    omega = 2 * np.pi * speed_of_light / (wavelengths * 1e-6)
+    phase = np.unwrap(np.angle(arms), axis=1)
+    delays = np.abs(np.gradient(phase, omega, axis=1)[:, 1])
+    weights = np.abs(arms[:, 1])
+    return float(np.sum(weights * delays) / np.sum(weights))
+
+
+def modulation_delay(cell, center_wavelength: float = 1.55) -> float:
+    """Delay [s] between the drive signals and the optical output of an IQ modulator: the time constant of the
+    electrode (from the bandwidth of the CircuitModel) plus the optical group delay, see group_delay."""
+    return 1.0 / (2 * np.pi * cell.CircuitModel().bandwidth) + group_delay(cell, center_wavelength)
+
+
+def settling_symbols(cell, symbol_rate: float, center_wavelength: float = 1.55, n_tau: float = 10.0) -> int:
+    """Number of symbols to skip at the start of a simulation: n_tau electrode time constants plus the optical
+    group delay, rounded up to whole symbols."""
+    tau = 1.0 / (2 * np.pi * cell.CircuitModel().bandwidth)
+    return int(np.ceil((n_tau * tau + group_delay(cell, center_wavelength)) * symbol_rate))
+
+
+def _interpolate(values, positions):
+    """Linear interpolation of samples at fractional sample positions."""
+    lower = np.floor(positions).astype(np.int64)
+    fraction = positions - lower
+    return (1 - fraction) * values[lower] + fraction * values[lower + 1]
+
+
+def _quadrant_decision(samples):
+    return np.where(samples.real >= 0, 1.0, -1.0) + 1j * np.where(samples.imag >= 0, 1.0, -1.0)
+
+
+def refine_timing(
+    values,
+    samples_per_symbol: int,
+    index: float,
+    skip_symbols: int = SKIP_SYMBOLS,
+    detector: str = "gardner",
+    block_symbols: int = 256,
+    gain: float = 0.05,
+    decide=None,
+) -> np.ndarray:
+    """Track the sampling phase along a long signal with a timing error detector.
+
+    The signal is processed in blocks of block_symbols symbols. For every block the mean timing error at the current
+    phase is computed in one vectorized pass (the samples between two sample instants are linearly interpolated),
+    and the phase is corrected by gain times the error before the next block. Both detectors settle where the
+    symbol transitions are symmetric around the sampling instant; with the asymmetric response of the electrode this
+    can differ by a few samples from optimal_sampling_index, so the loop is mostly useful to follow a drift.
+
+    Parameters
+    ----------
+    values : array-like
+        Samples of the signal. Only the samples of the current block are read, so np.memmap arrays can be used.
+    samples_per_symbol : int
+        Number of samples per symbol.
+    index : float
+        Initial sampling index within the symbol period, e.g. from optimal_sampling_index.
+    skip_symbols : int
+        Number of symbols skipped at the start of the signal.
+    detector : str
+        "gardner": Gardner detector, Re{(x[k] - x[k-1]) x*[k-1/2]}, which needs no decisions.
+        "mueller_muller": Mueller-Muller detector, Re{d*[k] x[k-1] - d*[k-1] x[k]}, on the decisions d of decide.
+    block_symbols : int
+        Number of symbols per block.
+    gain : float
+        Loop gain, as a fraction of the symbol period per unit of normalized timing error.
+    decide : callable
+        Decisions of the samples (Mueller-Muller only). Defaults to the quadrant of every sample (BPSK, QPSK).
+
+    Returns
+    -------
+    Array with the sampling index used for every block, in [0, samples_per_symbol).
+
+    """
+    if detector not in DETECTORS:
+        raise ValueError("Unknown detector {}, choose from {}".format(detector, DETECTORS))
+    decide = decide or _quadrant_decision
+    sps = samples_per_symbol
+    n_symbols = (len(values) - 1) // sps - skip_symbols - 2
+    position = float(index) % sps
+    trajectory = []
+    for first in range(1, n_symbols, block_symbols):
+        symbols = np.arange(first, min(first + block_symbols, n_symbols))
+        trajectory.append(position)
+        # Read the block and one symbol on either side
+        start = (skip_symbols + symbols[0] - 1) * sps
+        block = np.asarray(values[start:(skip_symbols + symbols[-1] + 2) * sps + 1])
+        instants = (symbols - symbols[0] + 1) * sps + position
+        current = _interpolate(block, instants)
+        previous = _interpolate(block, instants - sps)
+        if detector == "gardner":
+            error = np.real((current - previous) * np.conj(_interpolate(block, instants - sps / 2)))
+        else:
+            error = np.real(np.conj(decide(current)) * previous - np.conj(decide(previous)) * current)
+        power = np.mean(np.abs(current) ** 2)
+        if power > 0:
+            position = (position - gain * sps * np.mean(error) / power) % sps
+    return np.array(trajectory)
@@ -4,12 +4,12 @@
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
 import math
-import random
 
 import numpy as np
 
 import ipkiss3.all as i3
 from si_fab.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 
 def simulate_modulation_16QAM(
@@ -187,14 +187,13 @@ def simulate_modulation_16QAM(
 
 
 def result_modified_16QAM(result, samples_per_symbol=2**6, sampling_point=0.9):
-    # res_sample = random.sample(list(result["out"]), 1000)
-    res_sample = result["out"][int(samples_per_symbol * (10 + sampling_point))::samples_per_symbol]
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point)
 
     angle_sample = np.mean(np.angle(res_sample))
     print(angle_sample)
     print(angle_sample*180.0/math.pi)
 
-    return [res * np.exp(-1j * angle_sample) for res in res_sample]
+    return np.asarray(res_sample) * np.exp(-1j * angle_sample)
     # return [res for res in res_sample]
 
 def random_v_source(bitrate: float, amplitude: float, n_bytes: int = 100, qam_level=32, seed=None):
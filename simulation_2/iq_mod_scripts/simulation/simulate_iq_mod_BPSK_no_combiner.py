@@ -4,12 +4,10 @@
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
 
-import random
-
-import numpy as np
-
 import ipkiss3.all as i3
 from si_fab.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.postprocessing import derotate_bpsk
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 
 def simulate_modulation_BPSK(
@@ -197,47 +195,19 @@ def simulate_modulation_BPSK(
     )
     return results
 
-def result_modified_BPSK(result):
-    results_rotation = []
-    res_sample = random.sample(list(result["out"]), 200)
-    for res in res_sample:
-        if np.angle(res) > 0 and np.angle(res) < np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-        elif np.angle(res) > np.pi / 2 and np.angle(res) < np.pi:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi and np.angle(res) < -np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi / 2 and np.angle(res) < 0:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-
-    return results_rotation
-
-def result_modified_BPSK_top(result):
-    results_rotation = []
-    res_sample = random.sample(list(result["top_out"]), 200)
-    for res in res_sample:
-        if np.angle(res) > 0 and np.angle(res) < np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-        elif np.angle(res) > np.pi / 2 and np.angle(res) < np.pi:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi and np.angle(res) < -np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi / 2 and np.angle(res) < 0:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-
-    return results_rotation
-
-def result_modified_BPSK_bottom(result):
-    results_rotation = []
-    res_sample = random.sample(list(result["bottom_out"]), 200)
-    for res in res_sample:
-        if np.angle(res) > 0 and np.angle(res) < np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-        elif np.angle(res) > np.pi / 2 and np.angle(res) < np.pi:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi and np.angle(res) < -np.pi / 2:
-            results_rotation.append(res * np.exp(-1j * (np.angle(res) - np.pi)))
-        elif np.angle(res) > -np.pi / 2 and np.angle(res) < 0:
-            results_rotation.append(res * np.exp(-1j * np.angle(res)))
-
-    return results_rotation
+def result_modified_BPSK(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
+
+    return derotate_bpsk(res_sample)
+
+def result_modified_BPSK_top(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result["top_out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
+
+    return derotate_bpsk(res_sample)
+
+def result_modified_BPSK_bottom(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(
+        result["bottom_out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed
+    )
+
+    return derotate_bpsk(res_sample)
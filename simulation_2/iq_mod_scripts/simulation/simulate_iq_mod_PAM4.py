@@ -6,10 +6,10 @@ Set up a testbench for an IQ modulator working in QAM modulation format.
 
 import random
 
-import numpy as np
-
 import ipkiss3.all as i3
 from si_fab.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.postprocessing import derotate_amplitude
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 
 def simulate_modulation_PAM4(
@@ -198,10 +198,10 @@ def simulate_modulation_PAM4(
 # def result_modified_PAM4(result):
 #     res_sample = random.sample(list(result["out"]), 200)
 #
-#     return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+#     return derotate_amplitude(res_sample)
 
 def result_modified_PAM4(result, samples_per_symbol=2**6, sampling_point=0.5):
-    res_sample = result["out"][int(samples_per_symbol * (10 + sampling_point))::samples_per_symbol]
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point)
 
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+    return derotate_amplitude(res_sample)
 
@@ -4,12 +4,10 @@
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
 
-import random
-
-import numpy as np
-
 import ipkiss3.all as i3
 from si_fab.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.postprocessing import derotate_amplitude
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 
 def simulate_modulation_PAM4(
@@ -197,11 +195,11 @@ def simulate_modulation_PAM4(
     )
     return results
 
-def result_modified_PAM4(result, arg="out"):
-    res_sample = random.sample(list(result[arg]), 200)
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+def result_modified_PAM4(result, arg="out", samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result[arg], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
+    return derotate_amplitude(res_sample)
 
 def result_modified_OOK(result, samples_per_symbol, sampling_point, arg="out"):
-    res_sample = result[arg][int(samples_per_symbol * (10 + sampling_point))::samples_per_symbol]  # Ignore the first 10 symbols
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+    res_sample = sample_symbols(result[arg], samples_per_symbol, sampling_point)
+    return derotate_amplitude(res_sample)
 
@@ -4,12 +4,10 @@
 Set up a testbench for an IQ modulator working in QAM modulation format.
 """
 
-import random
-
-import numpy as np
-
 import ipkiss3.all as i3
 from si_fab.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.postprocessing import derotate_mean_phase, derotate_qpsk
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 
 def simulate_modulation_QPSK(
@@ -193,25 +191,11 @@ def simulate_modulation_QPSK(
     return results
 
 
-def result_modified_16QAM(result):
-    res_sample = random.sample(list(result["out"]), 1000)
-    angle_sample = np.mean(np.angle(res_sample))
-
-    return [res * np.exp(-1j * angle_sample) for res in res_sample]
+def result_modified_16QAM(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=1000, seed=None):
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
+    return derotate_mean_phase(res_sample)
 
 def result_modified_QPSK(result, samples_per_symbol=2**7, sampling_point=0.5):
-    results_rotation = []
-    # res_sample = random.sample(list(result["out"]), 200)
-    res_sample = result["out"][int(samples_per_symbol * (10 + sampling_point))::samples_per_symbol]
-
-    for res in res_sample:
-        if np.angle(res) > 0 and np.angle(res) < np.pi / 2:
-            results_rotation.append(res * np.exp(1j * (np.pi / 4 - np.angle(res))))
-        elif np.angle(res) > np.pi / 2 and np.angle(res) < np.pi:
-            results_rotation.append(res * np.exp(1j * (np.pi * 3 / 4 - np.angle(res))))
-        elif np.angle(res) > -np.pi and np.angle(res) < -np.pi / 2:
-            results_rotation.append(res * np.exp(1j * (np.pi * 5 / 4 - np.angle(res))))
-        elif np.angle(res) > -np.pi / 2 and np.angle(res) < 0:
-            results_rotation.append(res * np.exp(1j * (-np.pi / 4 - np.angle(res))))
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point)
 
-    return results_rotation
\ No newline at end of file
+    return derotate_qpsk(res_sample)
@@ -4,12 +4,10 @@
 Set up a testbench for an IQ modulator.
 """
 
-import random
-
-import numpy as np
-
 import ipkiss3.all as i3
 from simulation.benches.sources import random_bitsource, rand_normal
+from lnoi_iq_modulator.simulation.postprocessing import derotate_amplitude, derotate_qpsk
+from lnoi_iq_modulator.simulation.sampling import sample_symbols
 
 def simulate_modulation_iq_mod(
     cell,
@@ -178,23 +176,13 @@ def simulate_modulation_iq_mod(
     return results
 
 
-def result_modified_QPSK(result):
-    results_rotation = []
-    res_sample = random.sample(list(result["out"]), 200)
-    for res in res_sample:
-        if np.angle(res) > 0 and np.angle(res) < np.pi / 2:
-            results_rotation.append(res * np.exp(1j * (np.pi / 4 - np.angle(res))))
-        elif np.angle(res) > np.pi / 2 and np.angle(res) < np.pi:
-            results_rotation.append(res * np.exp(1j * (np.pi * 3 / 4 - np.angle(res))))
-        elif np.angle(res) > -np.pi and np.angle(res) < -np.pi / 2:
-            results_rotation.append(res * np.exp(1j * (np.pi * 5 / 4 - np.angle(res))))
-        elif np.angle(res) > -np.pi / 2 and np.angle(res) < 0:
-            results_rotation.append(res * np.exp(1j * (-np.pi / 4 - np.angle(res))))
+def result_modified_QPSK(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
 
-    return results_rotation
+    return derotate_qpsk(res_sample)
 
 
-def result_modified_PAM4(result):
-    res_sample = random.sample(list(result["out"]), 200)
+def result_modified_PAM4(result, samples_per_symbol=2**7, sampling_point=0.5, n_symbols=200, seed=None):
+    res_sample = sample_symbols(result["out"], samples_per_symbol, sampling_point, n_symbols=n_symbols, seed=seed)
 
-    return [res * np.exp(-1j * np.angle(res)) for res in res_sample]
+    return derotate_amplitude(res_sample)